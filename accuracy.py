@@ -0,0 +1,338 @@
+#!/usr/bin/python3
+
+"""
+    Compare A396 routines with their translations over dense grids of
+    inputs, to catch numerical regressions in the translators.
+
+    Each routine has a grid, one Axis per argument, and the axes' break
+    points cut the grid into regions (tquantile's n = 1, n = 2 and small n
+    take different branches, for example). Regions are split into chunks
+    of at most chunk points and spread over a process pool. Each worker
+    translates the routine once, evaluates the formulas over its chunk in
+    SQLite with sqlrender and the original Python function point by point,
+    and returns per-region statistics: the maximum absolute error, the
+    maximum error in units in the last place (ULPs) of the Python value,
+    and how often only one side failed (NULL in SQL, an exception in
+    Python). Points where both fail are not compared; the report counts
+    them by the Python exception and warns when they are more than
+    BOTH_NULL_WARNING of the grid. For tquantile they are the points where
+    A396.py's stand-in x = 99 for the normal deviate overflows EXP, which
+    the translation reproduces as infinity.
+
+    python accuracy.py sweeps the default million-point tquantile grid;
+    --scale 0.1 is a quick pass, and --max-ulp makes the exit status fail
+    on a regression. --range checks the translation rangeanalysis
+    simplifies under declared argument ranges, which should match the
+    plain one wherever the grid lies within them.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import math
+import sqlite3
+import sys
+import time
+
+import A396
+import costmodel
+import libsnapshot
+import rangeanalysis
+import sqlrender
+
+class Axis:
+    """
+        The values one argument takes: count points from low to high,
+        integers if integer (duplicates dropped, and every break included so
+        no region is skipped), otherwise the midpoints of count equal steps
+        so an open interval's ends are never hit. breaks are the inner
+        region boundaries along the axis.
+    """
+
+    def __init__(self, name, low, high, count, integer=False, breaks=()):
+        self.name = name
+        self.low = low
+        self.high = high
+        self.count = count
+        self.integer = integer
+        self.breaks = tuple(breaks)
+
+    def values(self, scale=1.0):
+        """Return the axis values, with count multiplied by scale."""
+        count = max(2, int(round(self.count * scale)))
+        if self.integer:
+            count = min(count, self.high - self.low + 1)
+            step = (self.high - self.low) / max(count - 1, 1)
+            return sorted(set(self.low + int(round(k * step)) for k in range(count)).union(self.breaks))
+        step = (self.high - self.low) / count
+        return [self.low + (k + 0.5) * step for k in range(count)]
+
+    def intervals(self):
+        """Return the (low, high) bounds of each region along the axis; high is exclusive but the last."""
+        bounds = (self.low,) + self.breaks + (self.high,)
+        return list(zip(bounds, bounds[1:]))
+
+    @staticmethod
+    def select(values, low, high, last):
+        """Return the values in [low, high), or [low, high] for the last interval."""
+        return [value for value in values if low <= value and (value < high or (last and value == high))]
+
+class Routine:
+    """A library function to check: its name, Python implementation and input grid."""
+
+    def __init__(self, name, function, axes):
+        self.name = name
+        self.function = function
+        self.axes = tuple(axes)
+
+    def regions(self, scale=1.0):
+        """Map each region, a tuple of per-axis (low, high) bounds, to its per-axis values."""
+        values = [axis.values(scale) for axis in self.axes]
+        per_axis = []
+        for axis, axis_values in zip(self.axes, values):
+            intervals = axis.intervals()
+            per_axis.append([
+                (interval, Axis.select(axis_values, low, high, k == len(intervals) - 1))
+                for k, interval in enumerate(intervals)
+                for low, high in [interval]
+            ])
+        return {
+            tuple(interval for interval, _ in combination): [selected for _, selected in combination]
+            for combination in itertools.product(*per_axis)
+            if all(selected for _, selected in combination)
+        }
+
+LIBRARY = A396.A396()
+
+ROUTINES = {
+    'tquantile': Routine('tquantile', LIBRARY.tquantile, [
+        Axis('n', 1, 1000, 1000, integer=True, breaks=(2, 3, 5, 10, 100)),
+        Axis('p', 0.0, 1.0, 1000, breaks=(0.001, 0.05, 0.5, 0.95, 0.999)),
+    ]),
+    'ltqnorm': Routine('ltqnorm', A396.A396.ltqnorm, [
+        Axis('p', 0.0, 1.0, 200000, breaks=(0.02425, 0.5, 0.97575)),
+    ]),
+}
+
+def chunks(routine, scale=1.0, chunk=50000):
+    """
+        Split the grid into work items (region, per-axis values) of at most
+        about chunk points, cutting along the first axis.
+    """
+    for region, values in routine.regions(scale).items():
+        rest = math.prod(len(axis_values) for axis_values in values[1:])
+        step = max(1, chunk // max(rest, 1))
+        for start in range(0, len(values[0]), step):
+            yield region, [values[0][start:start + step]] + values[1:]
+
+# fraction of points NULL on both sides above which the report warns
+BOTH_NULL_WARNING = 0.01
+
+class RegionStatistics:
+    """Error statistics over the points of one region, mergeable across chunks."""
+
+    def __init__(self, region):
+        self.region = region
+        self.points = 0
+        self.compared = 0
+        self.both_null = 0
+        # why Python failed at the points NULL on both sides
+        self.both_null_causes = collections.Counter()
+        self.sql_only_null = 0
+        self.python_only_null = 0
+        self.max_abs = 0.0
+        self.max_ulp = 0.0
+        self.worst = None
+        self.seconds = 0.0
+
+    def add_point(self, point, got, expected, cause=None):
+        """
+            Account for one point: got from SQL, expected from Python, None
+            where either failed, and cause the name of the exception Python
+            raised. An infinite or NaN value counts as failed, as SQLite's
+            EXP overflows to infinity where Python raises.
+        """
+        self.points += 1
+        if got is not None and not math.isfinite(got):
+            got = None
+        if expected is not None and not math.isfinite(expected):
+            expected, cause = None, 'non-finite'
+        if got is None or expected is None:
+            if got is None and expected is None:
+                self.both_null += 1
+                self.both_null_causes[cause or 'None'] += 1
+            elif got is None:
+                self.sql_only_null += 1
+            else:
+                self.python_only_null += 1
+            return
+        self.compared += 1
+        error = abs(got - expected)
+        self.max_abs = max(self.max_abs, error)
+        ulps = error / math.ulp(expected)
+        if ulps > self.max_ulp or self.worst is None:
+            self.max_ulp = ulps
+            self.worst = (point, got, expected)
+
+    def merge(self, other):
+        """Add another chunk's statistics for the same region."""
+        self.points += other.points
+        self.compared += other.compared
+        self.both_null += other.both_null
+        self.both_null_causes.update(other.both_null_causes)
+        self.sql_only_null += other.sql_only_null
+        self.python_only_null += other.python_only_null
+        self.max_abs = max(self.max_abs, other.max_abs)
+        if other.max_ulp > self.max_ulp or self.worst is None:
+            self.max_ulp = max(self.max_ulp, other.max_ulp)
+            self.worst = other.worst or self.worst
+        self.seconds += other.seconds
+
+    def describe(self, axes):
+        """Name the region by its bounds on each axis."""
+        return ' '.join(
+            '{}=[{:g},{:g}{}'.format(axis.name, low, high, ']' if high == axis.high else ')')
+            for axis, (low, high) in zip(axes, self.region)
+        )
+
+# per worker process: routine name, parentheses style and ranges to (SQLite connection, query)
+WORKER_STATE = {}
+
+def worker_query(routine, minimal_parentheses, ranges=()):
+    """Translate routine, simplified under the declarations ranges, and prepare its query, once per process."""
+    key = (routine.name, minimal_parentheses, tuple(ranges))
+    if key not in WORKER_STATE:
+        fields = libsnapshot.library_mathparse(minimal_parentheses=minimal_parentheses).link([routine.name])
+        if ranges:
+            fields = rangeanalysis.simplify(
+                fields, rangeanalysis.declare(*ranges), costmodel.function_roots(fields, routine.name),
+            )
+        connection = sqlite3.connect(':memory:')
+        sqlrender.register_math_functions(connection)
+        connection.execute('CREATE TEMP TABLE points (id INTEGER PRIMARY KEY, {})'.format(
+            ', '.join('{} REAL'.format(sqlrender.quote_identifier(axis.name)) for axis in routine.axes)
+        ))
+        query = sqlrender.render_query(
+            fields, {'value': '_{}'.format(routine.name)}, 'points', keep=['id'], materialized=True,
+        )
+        WORKER_STATE[key] = (connection, query)
+    return WORKER_STATE[key]
+
+def evaluate_chunk(name, region, values, minimal_parentheses=True, ranges=()):
+    """Evaluate one chunk of routine name in SQL and in Python; returns its RegionStatistics."""
+    start = time.perf_counter()
+    routine = ROUTINES[name]
+    connection, query = worker_query(routine, minimal_parentheses, ranges)
+    points = list(itertools.product(*values))
+    connection.execute('DELETE FROM points')
+    connection.executemany(
+        'INSERT INTO points VALUES (?, {})'.format(', '.join('?' for _ in routine.axes)),
+        [(k,) + point for k, point in enumerate(points)],
+    )
+    got = [value for _, value in sorted(connection.execute(query).fetchall())]
+    statistics = RegionStatistics(region)
+    function = routine.function
+    for point, value in zip(points, got):
+        cause = None
+        try:
+            expected = function(*point)
+        except (ValueError, ArithmeticError, NameError) as e:
+            # NameError: ltqnorm reads q before assigning it outside the lower tail
+            expected, cause = None, e.__class__.__name__
+        statistics.add_point(point, value, expected, cause)
+    statistics.seconds = time.perf_counter() - start
+    return statistics
+
+def sweep(name, scale=1.0, workers=None, chunk=50000, minimal_parentheses=True, ranges=()):
+    """
+        Check routine name over its grid on a pool of workers processes
+        (None for one per CPU, 0 to run in this process), simplified under
+        the range declarations ranges if any. Returns the RegionStatistics
+        of each region in grid order and the wall time.
+    """
+    start = time.perf_counter()
+    work = list(chunks(ROUTINES[name], scale, chunk))
+    arguments = ([name] * len(work), [region for region, _ in work], [values for _, values in work],
+                 [minimal_parentheses] * len(work), [tuple(ranges)] * len(work))
+    if workers == 0:
+        results = list(map(evaluate_chunk, *arguments))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(evaluate_chunk, *arguments))
+    regions = {}
+    for statistics in results:
+        if statistics.region in regions:
+            regions[statistics.region].merge(statistics)
+        else:
+            regions[statistics.region] = statistics
+    return list(regions.values()), time.perf_counter() - start
+
+def report(name, regions, elapsed):
+    """Return lines describing a sweep: one per region, then totals and throughput."""
+    axes = ROUTINES[name].axes
+    lines = ['{:>9} {:>9} {:>6} {:>6} {:>6} {:>11} {:>11}  region'.format(
+        'points', 'compared', 'null', 'sql', 'python', 'max abs', 'max ulp')]
+    for statistics in regions:
+        lines.append('{:>9} {:>9} {:>6} {:>6} {:>6} {:>11.3g} {:>11.3g}  {}'.format(
+            statistics.points, statistics.compared, statistics.both_null, statistics.sql_only_null,
+            statistics.python_only_null, statistics.max_abs, statistics.max_ulp, statistics.describe(axes),
+        ))
+    total = RegionStatistics(None)
+    for statistics in regions:
+        total.merge(statistics)
+    lines.append('{}: {} points in {:.2f}s ({:.0f} points/s), max abs {:.3g}, max ulp {:.3g}'.format(
+        name, total.points, elapsed, total.points / elapsed, total.max_abs, total.max_ulp,
+    ))
+    if total.worst is not None:
+        point, got, expected = total.worst
+        lines.append('worst at {}: translation {!r}, Python {!r}'.format(
+            ', '.join('{}={!r}'.format(axis.name, value) for axis, value in zip(axes, point)), got, expected,
+        ))
+    lines.append('NULL on one side only: {} in SQL, {} in Python'.format(
+        total.sql_only_null, total.python_only_null))
+    lines.append('NULL on both sides, not compared: {} ({:.1%}){}'.format(
+        total.both_null, total.both_null / max(total.points, 1), ''.join(
+            ', {} {}'.format(count, cause) for cause, count in total.both_null_causes.most_common()
+        ),
+    ))
+    if total.both_null > BOTH_NULL_WARNING * total.points:
+        lines.append('warning: only {} of {} points were compared'.format(total.compared, total.points))
+    return lines
+
+def main():
+    """Sweep routines and optionally fail on errors above a threshold."""
+    parser = argparse.ArgumentParser(description='Compare A396 routines with their translations over grids.')
+    parser.add_argument('routines', nargs='*', metavar='ROUTINE',
+                        help='any of {} (default tquantile)'.format(', '.join(sorted(ROUTINES))))
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the points per axis')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default one per CPU, 0 for none)')
+    parser.add_argument('--chunk', type=int, default=50000)
+    parser.add_argument('--full-parentheses', action='store_true')
+    parser.add_argument('--range', action='append', default=[], dest='ranges', metavar='DECLARATION',
+                        help="simplify under an argument range such as '0 < p < 1' (repeatable)")
+    parser.add_argument('--max-ulp', type=float, help='fail if any region exceeds this ULP error')
+    parser.add_argument('--max-abs', type=float, help='fail if any region exceeds this absolute error')
+    args = parser.parse_args()
+    for name in args.routines:
+        if name not in ROUTINES:
+            parser.error('unknown routine {}'.format(name))
+    try:
+        rangeanalysis.declare(*args.ranges)
+    except ValueError as e:
+        parser.error(str(e))
+
+    failed = False
+    for name in args.routines or ['tquantile']:
+        regions, elapsed = sweep(name, args.scale, args.workers, args.chunk, not args.full_parentheses, args.ranges)
+        print('\n'.join(report(name, regions, elapsed)))
+        for statistics in regions:
+            if (args.max_ulp is not None and not statistics.max_ulp <= args.max_ulp) or \
+                    (args.max_abs is not None and not statistics.max_abs <= args.max_abs):
+                failed = True
+                print('{} {} exceeds the threshold'.format(name, statistics.describe(ROUTINES[name].axes)))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,25 @@
 #!/usr/bin/python3
 
-import sys
+"""
+    Dump the AST of a Python source file, as an indented compact text tree
+    or as JSON lines (one object per node), with optional depth and node
+    type filters and summary statistics.
+
+    The tree is walked iteratively and output is written in large chunks,
+    so modules with hundreds of thousands of nodes dump in well under a
+    second and do not hit the recursion limit.
+"""
+
+import argparse
 import ast
+import collections
+import json
+import sys
+
+# node fields worth showing inline: names and constants (operators are added by name)
+SCALAR_FIELDS = ('name', 'asname', 'id', 'arg', 'attr', 'module', 'value')
+
+FUNCTION_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)
 
 class visitor_printtree(ast.NodeVisitor):
     def __init__(self):
@@ -19,11 +37,170 @@ class visitor_func(ast.NodeVisitor):
         print("generating", name)
         self.generic_visit(node)
 
+class NodeLayout:
+    """Which fields of a node class hold children and which are shown inline, worked out once per class."""
+
+    cache = {}
+
+    def __init__(self, cls):
+        self.name = cls.__name__
+        self.constant = issubclass(cls, ast.Constant)
+        # value is a constant's payload but an expression elsewhere
+        self.scalars = tuple(
+            field for field in SCALAR_FIELDS
+            if field in cls._fields and (field != 'value' or self.constant)
+        )
+        self.children = tuple(reversed([field for field in cls._fields if field not in self.scalars]))
+        self.has_op = 'op' in cls._fields
+
+    @classmethod
+    def of(cls, node):
+        layout = cls.cache.get(node.__class__)
+        if layout is None:
+            layout = cls.cache[node.__class__] = cls(node.__class__)
+        return layout
+
+def walk_depth(tree, max_depth=None):
+    """Yield (depth, node) in source order without recursion, down to max_depth."""
+    stack = [(0, tree)]
+    pop, push = stack.pop, stack.append
+    AST = ast.AST
+    while stack:
+        depth, node = pop()
+        yield depth, node
+        if max_depth is None or depth < max_depth:
+            depth += 1
+            for field in NodeLayout.of(node).children:
+                value = getattr(node, field, None)
+                if isinstance(value, list):
+                    for child in reversed(value):
+                        if isinstance(child, AST):
+                            push((depth, child))
+                elif isinstance(value, AST):
+                    push((depth, value))
+
+def node_attributes(node):
+    """Return the scalar fields of node, with operators given by class name."""
+    layout = NodeLayout.of(node)
+    attributes = {}
+    for field in layout.scalars:
+        value = getattr(node, field)
+        if layout.constant or isinstance(value, (str, int, float)):
+            attributes[field] = value
+    if layout.has_op:
+        attributes['op'] = node.op.__class__.__name__
+    return attributes
+
+def format_text(depth, node):
+    """Render one node as an indented line: type, scalar fields, then line number."""
+    parts = [' ' * (2 * depth) + node.__class__.__name__]
+    parts.extend('{}={!r}'.format(field, value) for field, value in node_attributes(node).items())
+    lineno = getattr(node, 'lineno', None)
+    if lineno is not None:
+        parts.append('@{}'.format(lineno))
+    return ' '.join(parts)
+
+def format_json(depth, node, encode=json.JSONEncoder(default=repr).encode):
+    """Render one node as a JSON object on one line."""
+    parts = ['{{"depth": {}, "type": "{}"'.format(depth, node.__class__.__name__)]
+    parts.extend('"{}": {}'.format(field, encode(value)) for field, value in node_attributes(node).items())
+    lineno = getattr(node, 'lineno', None)
+    if lineno is not None:
+        parts.append('"lineno": {}'.format(lineno))
+    return ', '.join(parts) + '}'
+
+FORMATS = {
+    'text': format_text,
+    'jsonl': format_json,
+}
+
+class TreeStatistics:
+    """Node counts by type, the maximum depth, and the size of every function."""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.max_depth = 0
+        self.function_sizes = collections.Counter()
+        self.enclosing = []
+
+    def add(self, depth, node):
+        """Account for one node, visited in walk_depth order."""
+        self.counts[node.__class__.__name__] += 1
+        self.max_depth = max(self.max_depth, depth)
+        while self.enclosing and self.enclosing[-1][0] >= depth:
+            self.enclosing.pop()
+        for _, key in self.enclosing:
+            self.function_sizes[key] += 1
+        if isinstance(node, FUNCTION_TYPES):
+            key = '{}@{}'.format(getattr(node, 'name', '<lambda>'), node.lineno)
+            self.function_sizes[key] += 1
+            self.enclosing.append((depth, key))
+
+    def summary(self, largest=10):
+        """Return the statistics as lines of text."""
+        lines = ['nodes: {}'.format(sum(self.counts.values())), 'max depth: {}'.format(self.max_depth)]
+        lines.extend('{:>8} {}'.format(count, name) for name, count in self.counts.most_common())
+        if self.function_sizes:
+            lines.append('largest functions:')
+            lines.extend(
+                '{:>8} {}'.format(size, name) for name, size in self.function_sizes.most_common(largest)
+            )
+        return lines
+
+def dump(tree, sink, fmt='text', max_depth=None, types=None, statistics=None, chunk=4096):
+    """
+        Write the nodes of tree to sink in fmt, joining chunk lines per
+        write. types, if given, limits the output (not the walk) to nodes
+        of those class names; statistics, a TreeStatistics, sees every node
+        walked. Returns the number of nodes written.
+    """
+    formatter = FORMATS[fmt]
+    types = frozenset(types) if types else None
+    buffer = []
+    written = 0
+    for depth, node in walk_depth(tree, max_depth):
+        if statistics is not None:
+            statistics.add(depth, node)
+        if types is None or node.__class__.__name__ in types:
+            buffer.append(formatter(depth, node))
+            if len(buffer) >= chunk:
+                sink.write('\n'.join(buffer) + '\n')
+                written += len(buffer)
+                buffer = []
+    if buffer:
+        sink.write('\n'.join(buffer) + '\n')
+        written += len(buffer)
+    return written
+
 def mathparse(fname):
     with open(fname, 'r') as fin:
         tree = ast.parse(fin.read())
         visitor_printtree().visit(tree)
 
-if __name__ == '__main__':
-    mathparse(sys.argv[1])
+def main():
+    """Parse the command line and dump the file."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filename')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='text')
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--type', action='append', dest='types', metavar='NODETYPE',
+                        help='only output nodes of this type (repeatable)')
+    parser.add_argument('--stats', action='store_true', help='print summary statistics to stderr')
+    parser.add_argument('--no-dump', action='store_true', help='only gather statistics')
+    args = parser.parse_args()
+
+    with open(args.filename, 'r') as fin:
+        tree = ast.parse(fin.read(), args.filename)
+    statistics = TreeStatistics() if args.stats else None
+    if args.no_dump:
+        for depth, node in walk_depth(tree, args.max_depth):
+            if statistics is not None:
+                statistics.add(depth, node)
+    else:
+        dump(tree, sys.stdout, args.format, args.max_depth, args.types, statistics)
+    if statistics is not None:
+        sys.stdout.flush()
+        print('\n'.join(statistics.summary()), file=sys.stderr)
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+
+"""
+    Estimate what a translation costs Tableau to evaluate per row, so two
+    translations of the same algorithm can be compared without deploying
+    either.
+
+    Formulas are parsed with formulaparse and their operations sorted into
+    classes (add, mul, div, pow, transcendental, compare, branch, call),
+    each weighted by a per-operation cost relative to an addition. The
+    weights come in profiles for the engine evaluating the formulas: the
+    default, hyper, models Tableau's Hyper engine, and sqlite was measured
+    by the bundled micro-benchmark, calibrate, which can be rerun to fit
+    SQLite elsewhere. Every branch of
+    a conditional is counted, so costs are an upper bound on what one row
+    evaluates. Anything the translators produce can be scored: a single
+    formula from mathparse.TranslatorVisitor or ctxmathparse.RenderVisitor,
+    or the field dictionaries MathParse.translate and
+    ASTMathParse.translate_statements return.
+"""
+
+import argparse
+import collections
+import random
+import sqlite3
+import time
+
+import ctxmathparse
+import formulaparse
+
+OPERATION_CLASSES = ('add', 'mul', 'div', 'pow', 'transcendental', 'compare', 'branch', 'call')
+
+BINARY_CLASSES = {
+    '+': 'add', '-': 'add',
+    '*': 'mul',
+    '/': 'div', '%': 'div',
+    '^': 'pow',
+    '=': 'compare', '==': 'compare', '!=': 'compare', '<>': 'compare',
+    '<': 'compare', '<=': 'compare', '>': 'compare', '>=': 'compare',
+    'AND': 'compare', 'OR': 'compare',
+}
+
+CALL_CLASSES = {
+    'POWER': 'pow', 'POW': 'pow',
+    'SQRT': 'transcendental', 'EXP': 'transcendental',
+    'LN': 'transcendental', 'LOG': 'transcendental',
+    'SIN': 'transcendental', 'COS': 'transcendental', 'TAN': 'transcendental',
+    'ATAN': 'transcendental',
+}
+
+# calibrate() on SQLite 3.40, the mean of three runs, rounded. SQLite's
+# bytecode interpreter spends most of each operation dispatching it, so the
+# classes come out nearly level.
+SQLITE_WEIGHTS = {
+    'add': 1.0,
+    'mul': 1.1,
+    'div': 1.1,
+    'pow': 2.3,
+    'transcendental': 1.4,
+    'compare': 0.9,
+    'branch': 0.9,
+    'call': 0.8,
+}
+
+# Tableau's Hyper engine compiles calculations to machine code, so the
+# arithmetic itself dominates: these follow typical double precision
+# latencies, with a math library call such as EXP or LN costing tens of
+# additions and a general power, EXP(y * LN(x)), about two of them. They are
+# estimates rather than measurements in Tableau.
+HYPER_WEIGHTS = {
+    'add': 1.0,
+    'mul': 1.0,
+    'div': 4.0,
+    'pow': 40.0,
+    'transcendental': 20.0,
+    'compare': 1.0,
+    'branch': 2.0,
+    'call': 2.0,
+}
+
+WEIGHT_PROFILES = {'hyper': HYPER_WEIGHTS, 'sqlite': SQLITE_WEIGHTS}
+
+# the translations are written for Tableau, so by default they are costed for Hyper
+DEFAULT_PROFILE = 'hyper'
+DEFAULT_WEIGHTS = WEIGHT_PROFILES[DEFAULT_PROFILE]
+
+def classify(node):
+    """Return the operation class of a formulaparse node, or None if it is an operand."""
+    tag = node[0]
+    if tag == 'binary':
+        return BINARY_CLASSES[node[1]]
+    elif tag == 'unary':
+        return 'compare' if node[1] == 'NOT' else 'add'
+    elif tag == 'call':
+        name = node[1].upper()
+        return CALL_CLASSES.get(ctxmathparse.TABLEAU_FUNCTIONS.get(node[1], name), 'call')
+    elif tag == 'if':
+        return 'branch'
+    return None
+
+def operation_counts(formula):
+    """Count the operations in formula by class; IF counts one branch per condition."""
+    counts = collections.Counter()
+    for node in formulaparse.iter_nodes(formulaparse.parse_formula(formula)):
+        kind = classify(node)
+        if kind is not None:
+            counts[kind] += len(node[1]) if kind == 'branch' else 1
+    return counts
+
+def function_roots(fields, name):
+    """Return the result fields of translated function name: _name, or its _name_out_k."""
+    root = '_{}'.format(name)
+    if root in fields:
+        return [root]
+    prefix = root + '_out_'
+    return [field for field in fields if field.startswith(prefix) and field[len(prefix):].isdigit()]
+
+class CostModel:
+    """
+        Weighted per-row cost of formulas and field sets. Formulas that do
+        not parse, like the placeholder text for constructs the translator
+        cannot handle, cost nothing and are listed in unparsed.
+    """
+
+    def __init__(self, weights=None, profile=DEFAULT_PROFILE):
+        """
+            Use weights (operation class to cost), taking any class they
+            leave out from the named profile in WEIGHT_PROFILES.
+        """
+        self.weights = dict(WEIGHT_PROFILES[profile], **(weights or {}))
+        self.unparsed = set()
+
+    def counts_cost(self, counts):
+        """Weigh a Counter of operation classes."""
+        return sum(self.weights[kind] * count for kind, count in counts.items())
+
+    def formula_cost(self, formula):
+        """Return the cost of evaluating formula alone, not counting the fields it references."""
+        try:
+            return self.counts_cost(operation_counts(formula))
+        except formulaparse.FormulaSyntaxError:
+            self.unparsed.add(formula)
+            return 0.0
+
+    def field_costs(self, fields):
+        """Return each field's own cost."""
+        return {name: self.formula_cost(formula) for name, formula in fields.items()}
+
+    def transitive_costs(self, fields, own=None):
+        """
+            Return each field's cost including every field it depends on,
+            directly or not. A field referenced along several paths is
+            evaluated once per row, so it is counted once.
+        """
+        own = own if own is not None else self.field_costs(fields)
+        reached = {}
+        result = {}
+        for name in ctxmathparse.field_dependency_order(fields):
+            reach = {name}
+            for ref in ctxmathparse.referenced_fields(fields[name]):
+                if ref in reached:
+                    reach |= reached[ref]
+            reached[name] = reach
+            result[name] = sum(own[field] for field in reach)
+        return result
+
+    def roots_cost(self, fields, roots, own=None):
+        """Return the cost of evaluating roots and everything they reference once."""
+        own = own if own is not None else self.field_costs(fields)
+        return sum(own[name] for name in ctxmathparse.reachable_fields(fields, roots))
+
+    def function_costs(self, fields, functions):
+        """Return the per-row cost of each named function's result fields."""
+        own = self.field_costs(fields)
+        return {
+            name: self.roots_cost(fields, function_roots(fields, name), own) for name in functions
+        }
+
+    def report(self, fields, functions=()):
+        """
+            Return lines listing the functions by cost, then the fields with
+            their own and transitive costs, most expensive first.
+        """
+        own = self.field_costs(fields)
+        transitive = self.transitive_costs(fields, own)
+        lines = ['total: {:.1f} over {} fields'.format(sum(own.values()), len(fields))]
+        for name, cost in sorted(
+            self.function_costs(fields, functions).items(), key=lambda item: -item[1]
+        ):
+            lines.append('function {}: {:.1f}'.format(name, cost))
+        for name in sorted(fields, key=lambda name: (-transitive[name], name)):
+            lines.append('{:>10.1f} {:>10.1f}  {}'.format(own[name], transitive[name], name))
+        if self.unparsed:
+            lines.append('{} formulas did not parse and cost nothing'.format(len(self.unparsed)))
+        return lines
+
+# one SQL operation per class over columns x and y
+CALIBRATION_OPERATIONS = {
+    'add': 'x + y',
+    'mul': 'x * y',
+    'div': 'x / y',
+    'pow': 'POWER(x, y)',
+    'transcendental': 'EXP(x)',
+    'compare': '(x < y)',
+    'branch': 'CASE WHEN x < 0.5 THEN x ELSE y END',
+    'call': 'ABS(x)',
+}
+
+def calibrate(rows=100000, repeat=5, copies=8, seed=396):
+    """
+        Time each class of operation in SQLite and return weights relative
+        to an addition. Each probe sums copies instances of the operation per
+        row, and the time of summing copies bare columns is subtracted, which
+        leaves the operations themselves. The best of repeat runs is used.
+    """
+    import sqlrender
+
+    connection = sqlite3.connect(':memory:')
+    sqlrender.register_math_functions(connection)
+    connection.execute('CREATE TABLE samples (x REAL, y REAL)')
+    generator = random.Random(seed)
+    connection.executemany('INSERT INTO samples VALUES (?, ?)', (
+        (generator.uniform(0.01, 1), generator.uniform(0.5, 2)) for _ in range(rows)
+    ))
+
+    def best_time(term):
+        query = 'SELECT SUM({}) FROM samples'.format(' + '.join([term] * copies))
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            connection.execute(query).fetchall()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    baseline = best_time('x')
+    seconds = {
+        kind: max(best_time(operation) - baseline, 0.0) / copies
+        for kind, operation in CALIBRATION_OPERATIONS.items()
+    }
+    unit = max(seconds['add'], 1e-12)
+    return {kind: elapsed / unit for kind, elapsed in seconds.items()}
+
+def main():
+    """Report the costs of the functions in a Python module."""
+    parser = argparse.ArgumentParser(description='Estimate the per-row cost of translated functions.')
+    parser.add_argument('module', nargs='?', default='A396.py')
+    parser.add_argument('functions', nargs='*')
+    parser.add_argument('--profile', choices=sorted(WEIGHT_PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument('--calibrate', action='store_true', help='measure SQLite weights first')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--minimal-parentheses', action='store_true')
+    args = parser.parse_args()
+
+    weights = None
+    if args.calibrate:
+        weights = calibrate(args.rows)
+        for kind in OPERATION_CLASSES:
+            print('weight {}: {:.2f}'.format(kind, weights[kind]))
+
+    mathparse = ctxmathparse.MathParse(minimal_parentheses=args.minimal_parentheses)
+    with open(args.module) as source:
+        mathparse.add_module(source.read())
+    functions = args.functions or sorted(mathparse.function_index)
+    fields = mathparse.link(functions)
+    for line in CostModel(weights, args.profile).report(fields, functions):
+        print(line)
+
+if __name__ == '__main__':
+    main()
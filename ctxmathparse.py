@@ -3,38 +3,57 @@
 """Implement the MathParse Python-to-Tableau translator and helper methods."""
 
 import ast
-
-def objectify_node(node):
+import collections
+import copy
+import hashlib
+import math
+import operator
+import re
+import sys
+
+import formulaparse
+from mathparse import PRECEDENCE, PrecedenceRenderer, StaticMathParse, needs_parentheses, reassociate
+
+def objectify_node(node, positions=False):
     """Get the tree into a friendly manipulable format we can easily
       compare in unit tests and does not have line/col info not needed
-      here"""
+      here, unless positions asks for each node's lineno and end_lineno"""
     if node is None:
         return None
 
-    elif isinstance(node, int) or isinstance(node, str):
+    elif isinstance(node, int) or isinstance(node, float) or isinstance(node, str):
         return node
 
     elif isinstance(node, list):
         return [
-            objectify_node(node[i]) for i in range(len(node))
+            objectify_node(node[i], positions) for i in range(len(node))
         ]
 
     else: # i hope this is an object!
-        return {
-            node.__class__.__name__: {
-                fieldname:
-                    objectify_node(getattr(node, fieldname))
-                for fieldname in node._fields
-            }
+        inner = {
+            fieldname:
+                objectify_node(getattr(node, fieldname), positions)
+            for fieldname in node._fields
         }
+        if positions and getattr(node, 'lineno', None) is not None:
+            inner['lineno'] = node.lineno
+            inner['end_lineno'] = node.end_lineno
+        return {node.__class__.__name__: inner}
 
-def objectify_ast(astree):
+def objectify_ast(astree, positions=False):
     """Create a simple Python object representing the AST."""
-    return objectify_node(astree)
+    return objectify_node(astree, positions)
 
-def objectify_string(mathstr):
+def objectify_string(mathstr, positions=False):
     """Return the Python object corresponding to the parsed string's AST."""
-    return objectify_ast(ast.parse(mathstr))
+    return objectify_ast(ast.parse(mathstr), positions)
+
+def node_lines(node):
+    """Return the (first, last) source lines of an objast node kept with positions, or None."""
+    inner = next(iter(node.values()))
+    if 'lineno' not in inner:
+        return None
+    return (inner['lineno'], inner['end_lineno'])
 
 def functions_from_ast(objast):
     """
@@ -46,6 +65,112 @@ def functions_from_ast(objast):
         for o in objast['Module']['body'] if 'FunctionDef' in o
     ]
 
+def drop_self_argument(astfunc):
+    """Return a method's objast without its leading self argument."""
+    arguments = astfunc['args']['arguments']
+    if not arguments['args'] or arguments['args'][0]['arg']['arg'] != 'self':
+        return astfunc
+    return dict(astfunc, args={'arguments': dict(arguments, args=arguments['args'][1:])})
+
+def functions_from_module(objast):
+    """
+        Return the top-level functions in the objast together with the methods
+        of its top-level classes, for linking across modules.
+    """
+    functions = []
+    for o in objast['Module']['body']:
+        if 'FunctionDef' in o:
+            functions.append(MathParseFunction(o['FunctionDef']))
+        elif 'ClassDef' in o:
+            functions.extend(
+                MathParseFunction(drop_self_argument(method['FunctionDef']))
+                for method in o['ClassDef']['body'] if 'FunctionDef' in method
+            )
+    return functions
+
+def called_functions(objast):
+    """Return the names of every function called anywhere in an objast."""
+    names = set()
+    pending = [objast]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+        elif isinstance(node, dict):
+            if 'Call' in node and len(node) == 1:
+                try:
+                    names.add(get_call_name(node))
+                except ValueError:
+                    pass
+            pending.extend(node.values())
+    return names
+
+def rename_field(name, old_prefix, new_prefix):
+    """Rename one field if it is old_prefix or under it."""
+    if name == old_prefix or name.startswith(old_prefix + '_'):
+        return new_prefix + name[len(old_prefix):]
+    return name
+
+def rename_fields(fields, old_prefix, new_prefix):
+    """Move every field named old_prefix or old_prefix_* under new_prefix, references included."""
+    def rename(name):
+        """Rename one field if it belongs to old_prefix."""
+        return rename_field(name, old_prefix, new_prefix)
+
+    return {
+        rename(name): FIELD_REFERENCE.sub(lambda m: '[{}]'.format(rename(m.group(1))), formula)
+        for name, formula in fields.items()
+    }
+
+def iter_module_functions(module, positions=False):
+    """
+        Yield a MathParseFunction for each top-level function of an ast.Module,
+        objectifying one at a time and removing each from the module's body.
+    """
+    for i, node in enumerate(module.body):
+        module.body[i] = None
+        if isinstance(node, ast.FunctionDef):
+            yield MathParseFunction(objectify_node(node, positions)['FunctionDef'])
+
+def drop_dead_stores(function):
+    """
+        Replace the top-level assignments of an ast.FunctionDef whose values
+        are never read (see StaticMathParse.eliminate_dead_stores) with pass,
+        so the statements left keep their _stmt_<i> numbers.
+    """
+    kept = {id(stmt) for stmt in StaticMathParse.eliminate_dead_stores(function.body, outputs=())}
+    function.body = [
+        stmt if id(stmt) in kept else ast.copy_location(ast.Pass(), stmt) for stmt in function.body
+    ]
+
+def write_fields(fields, sink):
+    """Write (field, formula) pairs to a text file as they arrive, returning how many."""
+    count = 0
+    for field, formula in fields:
+        sink.write('{}: {}\n'.format(field, formula))
+        count += 1
+    return count
+
+def return_arity(body):
+    """
+        Count the values a function body returns: the length of the tuples
+        it returns, or 1. Every return must agree.
+    """
+    arities = set()
+    stack = list(body)
+    while stack:
+        kind, inner = next(iter(stack.pop().items()))
+        if kind == 'Return' and inner['value'] is not None:
+            value = inner['value']
+            arities.add(len(value['Tuple']['elts']) if 'Tuple' in value else 1)
+        elif kind not in ('FunctionDef', 'ClassDef'):
+            for key in ('body', 'orelse'):
+                if isinstance(inner.get(key), list):
+                    stack.extend(inner[key])
+    if len(arities) > 1:
+        raise ValueError('returns {} values in different places'.format(sorted(arities)))
+    return arities.pop() if arities else 1
+
 def get_astfunction_args(astfunc):
     """Return a map of arg name -> Tableau function name."""
     return {
@@ -61,201 +186,1224 @@ def translate_binop(operator):
             "Mult": "*",
             "Add": "+",
             "Sub": "-",
+            "Div": "/",
+            "Mod": "%",
+            "Pow": "^",
         }[keylist[0]]
     except KeyError:
         result = keylist[0]
 
     return result
 
-def translate_expression(fname, args, localvars, expr):
+def translate_cmpop(operator):
+    """Convert a Compare op object into the corresponding Tableau comparison."""
+    return {
+        "Lt": "<",
+        "LtE": "<=",
+        "Gt": ">",
+        "GtE": ">=",
+        "Eq": "==",
+        "NotEq": "!=",
+    }[list(operator.keys())[0]]
+
+TABLEAU_FUNCTIONS = {
+    'abs': 'ABS',
+    'sqrt': 'SQRT',
+    'exp': 'EXP',
+    'log': 'LN',
+    'log10': 'LOG',
+    'pow': 'POWER',
+    'sign': 'SIGN',
+    'sin': 'SIN',
+    'cos': 'COS',
+    'tan': 'TAN',
+    'atan': 'ATAN',
+    'floor': 'FLOOR',
+    'ceil': 'CEILING',
+}
+
+# the largest integer (in bits) or sequence (in items) folding may build; a
+# power or repetition beyond it is left for Tableau rather than computed here
+MAX_FOLDED_SIZE = 4096
+
+def bounded_pow(base, exponent, *modulus):
+    """pow, raising OverflowError rather than building an integer beyond MAX_FOLDED_SIZE bits."""
+    if not modulus and isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1 \
+            and exponent * (abs(base).bit_length() - 1) > MAX_FOLDED_SIZE:
+        raise OverflowError('{} ** {} is too large to fold'.format(base, exponent))
+    return pow(base, exponent, *modulus)
+
+def bounded_mul(left, right):
+    """Multiply, raising OverflowError rather than repeating a sequence beyond MAX_FOLDED_SIZE items."""
+    for sequence, count in ((left, right), (right, left)):
+        if isinstance(sequence, (str, tuple)) and isinstance(count, int) \
+                and len(sequence) * count > MAX_FOLDED_SIZE:
+            raise OverflowError('repetition is too large to fold')
+    return left * right
+
+FOLDABLE_FUNCTIONS = {
+    'abs': abs,
+    'sqrt': math.sqrt,
+    'exp': math.exp,
+    'log': math.log,
+    'log10': math.log10,
+    'pow': bounded_pow,
+    'sign': lambda x: (x > 0) - (x < 0),
+    'sin': math.sin,
+    'cos': math.cos,
+    'tan': math.tan,
+    'atan': math.atan,
+    'floor': math.floor,
+    'ceil': math.ceil,
+}
+
+FOLDABLE_OPERATORS = {
+    'Mult': bounded_mul,
+    'Add': operator.add,
+    'Sub': operator.sub,
+    'Div': operator.truediv,
+    'Mod': operator.mod,
+    'Pow': bounded_pow,
+    'Lt': operator.lt,
+    'LtE': operator.le,
+    'Gt': operator.gt,
+    'GtE': operator.ge,
+    'Eq': operator.eq,
+    'NotEq': operator.ne,
+    'USub': operator.neg,
+    'UAdd': operator.pos,
+    'Not': operator.not_,
+}
+
+MATH_CONSTANTS = {
+    'pi': (math.pi, 'PI()'),
+    'e': (math.e, 'EXP(1)'),
+}
+
+class NotConstant(ValueError):
+    """The expression depends on something only known when Tableau evaluates it."""
+
+def render_constant(value):
+    """Render a Python constant as a Tableau literal."""
+    if value is None:
+        return 'NULL'
+    elif value is True:
+        return 'TRUE'
+    elif value is False:
+        return 'FALSE'
+    elif isinstance(value, str):
+        return '"{}"'.format(value.replace('"', '""'))
+    elif isinstance(value, float):
+        if not math.isfinite(value):
+            raise NotConstant(value)
+        return repr(value)
+    elif isinstance(value, int):
+        return str(value)
+    raise NotConstant(value)
+
+def get_call_name(expr):
+    """Return the bare name of a called function, dropping any module/self prefix."""
+    func = expr['Call']['func']
+    if 'Name' in func:
+        return func['Name']['id']
+    elif 'Attribute' in func:
+        return func['Attribute']['attr']
+    raise ValueError(list(func.keys())[0])
+
+def get_subscript_index(expr):
+    """Return the index expression of a subscript, unwrapping pre-3.9 Index nodes."""
+    index = expr['Subscript']['slice']
+    if 'Index' in index:
+        return index['Index']['value']
+    return index
+
+def fold_constant(expr, constants):
+    """Fold expr if it is constant, returning None otherwise."""
+    try:
+        return fold_expression(expr, constants)
+    except NotConstant:
+        return None
+
+def fold_expression(expr, constants):
+    """
+        Evaluate an expression at translation time, raising NotConstant when
+        it refers to anything not bound in constants.
+    """
+    if 'Constant' in expr:
+        return expr['Constant']['value']
+    elif 'Num' in expr:
+        return expr['Num']['n']
+    elif 'Name' in expr:
+        try:
+            return constants[expr['Name']['id']]
+        except KeyError:
+            raise NotConstant(expr['Name']['id'])
+    elif 'Attribute' in expr:
+        try:
+            return MATH_CONSTANTS[expr['Attribute']['attr']][0]
+        except KeyError:
+            raise NotConstant(expr['Attribute']['attr'])
+    elif 'Tuple' in expr or 'List' in expr:
+        node = expr.get('Tuple', expr.get('List'))
+        return tuple(fold_expression(elt, constants) for elt in node['elts'])
+    elif 'Subscript' in expr:
+        try:
+            return fold_expression(expr['Subscript']['value'], constants)[
+                fold_expression(get_subscript_index(expr), constants)
+            ]
+        except (IndexError, TypeError):
+            raise NotConstant(expr)
+
+    try:
+        if 'BinOp' in expr:
+            return FOLDABLE_OPERATORS[list(expr['BinOp']['op'].keys())[0]](
+                fold_expression(expr['BinOp']['left'], constants),
+                fold_expression(expr['BinOp']['right'], constants)
+            )
+        elif 'UnaryOp' in expr:
+            return FOLDABLE_OPERATORS[list(expr['UnaryOp']['op'].keys())[0]](
+                fold_expression(expr['UnaryOp']['operand'], constants)
+            )
+        elif 'Compare' in expr:
+            # a chain is False as soon as one constant link is, whatever the other links
+            operands, unknown = [], None
+            for operand in [expr['Compare']['left']] + expr['Compare']['comparators']:
+                try:
+                    operands.append((True, fold_expression(operand, constants)))
+                except NotConstant as e:
+                    operands.append((False, None))
+                    unknown = unknown or e
+            for cmpop, (left_known, left), (right_known, right) in zip(
+                expr['Compare']['ops'], operands, operands[1:]
+            ):
+                if left_known and right_known and not FOLDABLE_OPERATORS[list(cmpop.keys())[0]](left, right):
+                    return False
+            if unknown is not None:
+                raise unknown
+            return True
+        elif 'BoolOp' in expr:
+            # stop at the first constant operand that decides the result: a
+            # FALSE in an AND or a TRUE in an OR, whatever the other operands
+            is_and, unknown = 'And' in expr['BoolOp']['op'], None
+            for value in expr['BoolOp']['values']:
+                try:
+                    known = bool(fold_expression(value, constants))
+                except NotConstant as e:
+                    unknown = unknown or e
+                    continue
+                if known != is_and:
+                    return known
+            if unknown is not None:
+                raise unknown
+            return is_and
+        elif 'Call' in expr:
+            return FOLDABLE_FUNCTIONS[get_call_name(expr)](
+                *[fold_expression(arg, constants) for arg in expr['Call']['args']]
+            )
+    except (KeyError, ArithmeticError, ValueError, TypeError) as e:
+        if isinstance(e, NotConstant):
+            raise
+        raise NotConstant(expr)
+
+    raise NotConstant(expr)
+
+def translate_expression(fname, args, localvars, expr, constants=None, minimal_parentheses=False,
+                         call_handler=None):
     """Recursively translate an expression for the given function and arguments."""
+    return translate_expression_precedence(
+        fname, args, localvars, expr, constants, minimal_parentheses, call_handler
+    )[0]
+
+def constant_precedence(value):
+    """Return how tightly a rendered constant binds: negative numbers act like negation."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value < 0:
+        return PRECEDENCE['USub']
+    return PRECEDENCE['Atom']
+
+def translate_expression_precedence(fname, args, localvars, expr, constants=None,
+                                    minimal_parentheses=False, call_handler=None):
+    """
+        Translate an expression, returning the formula and the precedence of
+        its outermost operator. By default every operation is parenthesized;
+        with minimal_parentheses only the operands that need it are. Calls are
+        offered to call_handler(name, argument formulas) first, which returns
+        a formula for calls it resolves and None otherwise.
+    """
+    if constants is None:
+        constants = {}
+
+    try:
+        value = fold_expression(expr, constants)
+        return render_constant(value), constant_precedence(value)
+    except NotConstant:
+        pass
+
+    def recurse(subexpr):
+        """Translate a subexpression in the same scope."""
+        return translate_expression_precedence(
+            fname, args, localvars, subexpr, constants, minimal_parentheses, call_handler
+        )
+
+    def operand(subexpr, parent, right=False):
+        """Translate an operand, parenthesizing it if precedence requires."""
+        formula, precedence = recurse(subexpr)
+        if minimal_parentheses and needs_parentheses(parent, precedence, right):
+            return '({})'.format(formula)
+        return formula
+
+    def group(formula, precedence):
+        """Parenthesize an operation unless only operands get parentheses."""
+        if minimal_parentheses:
+            return formula, precedence
+        return '({})'.format(formula), PRECEDENCE['Atom']
+
     if 'BinOp' in expr:
-        return (
-            '({} {} {})'.format(
-                translate_expression(fname, args, localvars, expr['BinOp']['left']),
+        precedence = PRECEDENCE[list(expr['BinOp']['op'].keys())[0]]
+        return group(
+            '{} {} {}'.format(
+                operand(expr['BinOp']['left'], precedence),
                 translate_binop(expr['BinOp']['op']),
-                translate_expression(fname, args, localvars, expr['BinOp']['right'])
-            )
+                operand(expr['BinOp']['right'], precedence, True)
+            ),
+            precedence
         )
     elif 'Name' in expr:
         name = expr['Name']['id']
         if name in localvars: # look in localvars to see if a symbol got overwritten
-            return '[{}]'.format(localvars[name])
+            return '[{}]'.format(localvars[name]), PRECEDENCE['Atom']
         elif name in args:
-            return '[{}]'.format(args[name])
+            return '[{}]'.format(args[name]), PRECEDENCE['Atom']
         else:
-            return name
+            return name, PRECEDENCE['Atom']
+    elif 'Field' in expr:
+        return '[{}]'.format(expr['Field']['id']), PRECEDENCE['Atom']
     elif 'Num' in expr:
-        return expr['Num']['n']
+        return expr['Num']['n'], constant_precedence(expr['Num']['n'])
+    elif 'Constant' in expr:
+        value = expr['Constant']['value']
+        return render_constant(value), constant_precedence(value)
+    elif 'UnaryOp' in expr:
+        if 'Not' in expr['UnaryOp']['op']:
+            return group(
+                'NOT {}'.format(operand(expr['UnaryOp']['operand'], PRECEDENCE['Not'], True)),
+                PRECEDENCE['Not']
+            )
+        elif 'UAdd' in expr['UnaryOp']['op']:
+            return recurse(expr['UnaryOp']['operand'])
+        return '-{}'.format(
+            operand(expr['UnaryOp']['operand'], PRECEDENCE['USub'], True)
+        ), PRECEDENCE['USub']
+    elif 'Compare' in expr:
+        terms = []
+        left = expr['Compare']['left']
+        for cmpop, right in zip(expr['Compare']['ops'], expr['Compare']['comparators']):
+            terms.append(group('{} {} {}'.format(
+                operand(left, PRECEDENCE['Compare']),
+                translate_cmpop(cmpop),
+                operand(right, PRECEDENCE['Compare'], True)
+            ), PRECEDENCE['Compare'])[0])
+            left = right
+        if len(terms) == 1:
+            return terms[0], PRECEDENCE['Compare'] if minimal_parentheses else PRECEDENCE['Atom']
+        return group(' AND '.join(terms), PRECEDENCE['And'])
+    elif 'BoolOp' in expr:
+        is_and = 'And' in expr['BoolOp']['op']
+        precedence = PRECEDENCE['And'] if is_and else PRECEDENCE['Or']
+        terms = []
+        for value in expr['BoolOp']['values']:
+            try:
+                known = bool(fold_expression(value, constants))
+            except NotConstant:
+                terms.append(value)
+                continue
+            if known != is_and: # a TRUE in an OR or a FALSE in an AND decides it
+                return render_constant(known), PRECEDENCE['Atom']
+        if len(terms) == 1:
+            return recurse(terms[0])
+        return group((' AND ' if is_and else ' OR ').join(
+            operand(term, precedence, i > 0) for i, term in enumerate(terms)
+        ), precedence)
+    elif 'IfExp' in expr:
+        return 'IF {} THEN {} ELSE {} END'.format(
+            recurse(expr['IfExp']['test'])[0],
+            recurse(expr['IfExp']['body'])[0],
+            recurse(expr['IfExp']['orelse'])[0]
+        ), PRECEDENCE['Atom']
+    elif 'Attribute' in expr and expr['Attribute']['attr'] in MATH_CONSTANTS:
+        return MATH_CONSTANTS[expr['Attribute']['attr']][1], PRECEDENCE['Atom']
+    elif 'Call' in expr:
+        name = get_call_name(expr)
+        if call_handler is not None:
+            formula = call_handler(name, [recurse(arg)[0] for arg in expr['Call']['args']])
+            if formula is not None:
+                return formula, PRECEDENCE['Atom']
+        if name == 'log' and len(expr['Call']['args']) == 2:
+            name = 'log10' # Tableau's LOG takes the base as its optional second argument
+        return '{}({})'.format(
+            TABLEAU_FUNCTIONS.get(name, name),
+            ', '.join(recurse(arg)[0] for arg in expr['Call']['args'])
+        ), PRECEDENCE['Atom']
+
+    return 'unrecognized expression type ' + list(expr.keys())[0], PRECEDENCE['Atom']
+
+def find_dependencies(expr, scope, found=None):
+    """
+        Return the set of function arguments an expression depends on, given
+        scope mapping each visible name to its own argument dependencies.
+        When found is given it is filled with id(node) -> dependencies for
+        every subexpression visited.
+    """
+    if isinstance(expr, list):
+        deps = frozenset().union(*[find_dependencies(item, scope, found) for item in expr])
+    elif not isinstance(expr, dict) or len(expr) != 1:
+        return frozenset()
+    elif 'Name' in expr:
+        deps = scope.get(expr['Name']['id'], frozenset())
+    elif 'Call' in expr:
+        deps = find_dependencies(expr['Call']['args'], scope, found)
+    else:
+        inner = next(iter(expr.values()))
+        if not isinstance(inner, dict):
+            return frozenset()
+        deps = frozenset().union(*[
+            find_dependencies(value, scope, found) for value in inner.values()
+        ])
+    if found is not None:
+        found[id(expr)] = deps
+    return deps
+
+def specialization_name(name, bindings):
+    """
+        Name a function specialized on constant arguments, e.g. tquantile
+        with n=5 becomes tquantile_n_5 and p=0.95 adds _p_0p95.
+    """
+    for arg, value in sorted(bindings.items()):
+        name += '_{}_{}'.format(arg, re.sub(r'[^0-9A-Za-z]', lambda m: {
+            '.': 'p', '-': 'm'
+        }.get(m.group(0), ''), str(value)))
+    return name
+
+FIELD_REFERENCE = re.compile(r'\[(_[^\]]*)\]')
+
+def referenced_fields(formula):
+    """Return the names of the fields a formula refers to."""
+    return FIELD_REFERENCE.findall(formula)
+
+def reachable_fields(fields, roots):
+    """
+        Return the subset of fields, in their original order, that the root
+        fields depend on directly or transitively.
+    """
+    seen = set()
+    pending = [root for root in roots if root in fields]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        pending.extend(ref for ref in referenced_fields(fields[name]) if ref in fields)
+    return {name: formula for name, formula in fields.items() if name in seen}
+
+def field_dependency_order(fields):
+    """Return the field names ordered so every field comes after the fields it references."""
+    order = []
+    done = set()
+    for root in fields:
+        stack = [(root, False)]
+        while stack:
+            name, expanded = stack.pop()
+            if expanded:
+                if name not in done:
+                    done.add(name)
+                    order.append(name)
+                continue
+            if name in done:
+                continue
+            stack.append((name, True))
+            stack.extend(
+                (ref, False) for ref in reversed(referenced_fields(fields[name]))
+                if ref in fields and ref not in done
+            )
+    return order
+
+def content_address_fields(fields, keep=()):
+    """
+        Rename fields after a hash of their content, _c_<sha1 prefix>, where
+        the content is the formula with its references already renamed.
+        Identical computations therefore get the same name whatever function
+        or workbook they came from and collapse into one field, and names do
+        not move when unrelated code changes. The names in keep are emitted
+        as aliases of their content fields. Returns the renamed fields and
+        the map from original to content name. Fields that only reference
+        another field take that field's name rather than adding one.
+    """
+    names = {}
+    result = {}
+    for name in field_dependency_order(fields):
+        alias = FIELD_REFERENCE.fullmatch(fields[name])
+        if alias and alias.group(1) in names: # a bare reference is the same computation
+            names[name] = names[alias.group(1)]
+            continue
+        normalized = FIELD_REFERENCE.sub(
+            lambda m: '[{}]'.format(names.get(m.group(1), m.group(1))), fields[name]
+        )
+        digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+        length = 12
+        while result.get('_c_' + digest[:length], normalized) != normalized:
+            length += 4
+        names[name] = '_c_' + digest[:length]
+        result[names[name]] = normalized
+    for name in keep:
+        result[name] = '[{}]'.format(names[name])
+    return result, names
+
+def merge_provenance(provenance, names, fields=None):
+    """
+        Carry provenance across a renaming such as content_address_fields
+        returns: fields merged into one name get the union of their lines.
+        Given the original fields, merged fields that only referenced another
+        computed nothing and add no lines.
+    """
+    result = {}
+    for name, lines in provenance.items():
+        if fields is not None and name in names and FIELD_REFERENCE.fullmatch(fields.get(name, '')):
+            continue
+        renamed = names.get(name, name)
+        result[renamed] = result.get(renamed, frozenset()) | lines
+    return result
 
-    return 'unrecognized expression type ' + list(expr.keys())[0]
+def line_costs(fields, provenance):
+    """
+        Attribute each field's operation count and formula length to the
+        source line ranges it came from. A field with several origins, for
+        example one merged by content addressing, is charged to each of them;
+        fields without provenance are collected under None, and formulas the
+        translator could not produce count no operations.
+    """
+    costs = {}
+    for name, formula in fields.items():
+        try:
+            operations = formulaparse.count_operations(formula)
+        except formulaparse.FormulaSyntaxError:
+            operations = 0
+        for lines in provenance.get(name) or [None]:
+            cost = costs.setdefault(lines, {'fields': 0, 'operations': 0, 'length': 0})
+            cost['fields'] += 1
+            cost['operations'] += operations
+            cost['length'] += len(formula)
+    return costs
+
+def provenance_report(source, fields, provenance):
+    """Format line_costs as one line per source range, most operations first."""
+    source_lines = source.splitlines()
+    costs = line_costs(fields, provenance)
+    report = []
+    for lines, cost in sorted(
+        costs.items(), key=lambda item: (-item[1]['operations'], item[0] or (0, 0))
+    ):
+        if lines is None:
+            location, text = 'unattributed', ''
+        else:
+            location = '{}-{}'.format(*lines) if lines[0] != lines[1] else str(lines[0])
+            text = source_lines[lines[0] - 1].strip() if lines[0] <= len(source_lines) else ''
+        report.append('{:>12} {:>6} ops {:>8} chars {:>4} fields  {}'.format(
+            location, cost['operations'], cost['length'], cost['fields'], text
+        ))
+    return report
 
 def invert_dict(swap_me):
     """Swap each key -> value pair in a dictionary."""
     return {v: k for k, v in swap_me.items()}
 
-#class MathParseContext:
-#    """
-#        Encapsulate the state associated with a single context.
-#    """
-#
-#    def __init__(self, name, parent=None):
-#        """Initialize the context's name."""
-#        self.name = name
-#        self.parent = parent
-#        self.symbols = set()
-#        self.modified_symbols = set()
-#
-#    def translate_symbol(self, symbol):
-#        """Seek the symbol in the context or parent context and return its Tableau name."""
-#        if symbol in self.symbols:
-#            return '_{}:{}'.format(self.name, symbol)
-#        elif self.parent is not None:
-#            return self.parent.translate_symbol(symbol)
-#        else:
-#            raise ValueError(symbol)
-#
-#    def create_child_context(self, name):
-#        """Return a new context with this context as the parent and the appropriate name."""
-#        return MathParseContext("{}:{}".format(self.name, name), self)
-#
-#    def add_symbol(self, symbol):
-#        """Add a symbol to the context."""
-#        self.symbols.add(symbol)
-#
-#    def populate_modified_symbols(self, objast):
-#        """Find out which symbols are modified in this objast."""
-#        if 'Module' in objast:
-#            self.populate_modified_symbols(objast['Module'])
-#        elif 'body' in objast:
-#            for stmt in objast['body']:
-#                self.populate_modified_symbols(stmt)
-#        elif 'AugAssign' in objast:
-#            self.populate_modified_symbols(objast['AugAssign']['target'])
-#        elif 'Name' in objast:
-#            self.modified_symbols.add(objast['Name']['id'])
-#        elif 'Assign' in objast:
-#            for symbol in objast['Assign']['targets']:
-#                self.populate_modified_symbols(symbol)
-#        elif 'If' in objast:
-#            for stmt in objast['If']['body']:
-#                self.populate_modified_symbols(stmt)
-#            for stmt in objast['If']['orelse']:
-#                self.populate_modified_symbols(stmt)
-#        elif 'Pass' in objast:
-#            pass
-#        elif 'FunctionDef' in objast:
-#            pass
-#        elif 'Return' in objast:
-#            pass
-#        else:
-#            raise ValueError(objast.keys())
-#
-#    def populate_symbols(self, objast):
-#        """Find all symbols mentioned in this objast."""
-#        if 'Module' in objast:
-#            self.populate_symbols(objast['Module'])
-#        elif 'body' in objast:
-#            for stmt in objast['body']:
-#                self.populate_symbols(stmt)
-#        elif 'AugAssign' in objast:
-#            self.populate_symbols(objast['AugAssign']['target'])
-#            self.populate_symbols(objast['AugAssign']['value'])
-#        elif 'Name' in objast:
-#            self.symbols.add(objast['Name']['id'])
-#        elif 'Assign' in objast:
-#            for stmt in objast['Assign']['targets']:
-#                self.populate_symbols(stmt)
-#            self.populate_symbols(objast['Assign']['value'])
-#        elif 'Num' in objast:
-#            pass
-#        elif 'BinOp' in objast:
-#            self.populate_symbols(objast['BinOp']['left'])
-#            self.populate_symbols(objast['BinOp']['right'])
-#        elif 'If' in objast:
-#            for stmt in objast['If']['body']:
-#                self.populate_symbols(stmt)
-#            self.populate_symbols(objast['If']['test'])
-#            for stmt in objast['If']['orelse']:
-#                self.populate_symbols(stmt)
-#        elif 'Compare' in objast:
-#            self.populate_symbols(objast['Compare']['left'])
-#            for expr in objast['Compare']['comparators']:
-#                self.populate_symbols(expr)
-#        elif 'Pass' in objast:
-#            pass
-#        elif 'Return' in objast:
-#            self.populate_symbols(objast['Return']['value'])
-#        else:
-#            raise ValueError(objast)
-#
-#    def populate_returns(self):
-#        pass
+class MathParseContext:
+    """
+        Encapsulate the state associated with a single context.
+    """
+
+    def __init__(self, name, parent=None):
+        """Initialize the context's name."""
+        self.name = name
+        self.parent = parent
+        self.symbols = set()
+        self.modified_symbols = set()
+
+    def translate_symbol(self, symbol):
+        """Seek the symbol in the context or parent context and return its Tableau name."""
+        if symbol in self.symbols:
+            return '_{}:{}'.format(self.name, symbol)
+        elif self.parent is not None:
+            return self.parent.translate_symbol(symbol)
+        else:
+            raise ValueError(symbol)
+
+    def create_child_context(self, name):
+        """Return a new context with this context as the parent and the appropriate name."""
+        return MathParseContext("{}:{}".format(self.name, name), self)
+
+    def add_symbol(self, symbol):
+        """Add a symbol to the context."""
+        self.symbols.add(symbol)
+
+    def populate_modified_symbols(self, objast):
+        """Find out which symbols are modified in this objast."""
+        if 'Module' in objast:
+            self.populate_modified_symbols(objast['Module'])
+        elif 'body' in objast:
+            for stmt in objast['body']:
+                self.populate_modified_symbols(stmt)
+        elif 'AugAssign' in objast:
+            self.populate_modified_symbols(objast['AugAssign']['target'])
+        elif 'Name' in objast:
+            self.modified_symbols.add(objast['Name']['id'])
+        elif 'Assign' in objast:
+            for symbol in objast['Assign']['targets']:
+                self.populate_modified_symbols(symbol)
+        elif 'If' in objast:
+            for stmt in objast['If']['body']:
+                self.populate_modified_symbols(stmt)
+            for stmt in objast['If']['orelse']:
+                self.populate_modified_symbols(stmt)
+        elif 'Pass' in objast:
+            pass
+        elif 'FunctionDef' in objast:
+            pass
+        elif 'Return' in objast:
+            pass
+        else:
+            raise ValueError(objast.keys())
+
+    def populate_symbols(self, objast):
+        """Find all symbols mentioned in this objast."""
+        if 'Module' in objast:
+            self.populate_symbols(objast['Module'])
+        elif 'body' in objast:
+            for stmt in objast['body']:
+                self.populate_symbols(stmt)
+        elif 'AugAssign' in objast:
+            self.populate_symbols(objast['AugAssign']['target'])
+            self.populate_symbols(objast['AugAssign']['value'])
+        elif 'Name' in objast:
+            self.symbols.add(objast['Name']['id'])
+        elif 'Assign' in objast:
+            for stmt in objast['Assign']['targets']:
+                self.populate_symbols(stmt)
+            self.populate_symbols(objast['Assign']['value'])
+        elif 'Num' in objast or 'Constant' in objast:
+            pass
+        elif 'BinOp' in objast:
+            self.populate_symbols(objast['BinOp']['left'])
+            self.populate_symbols(objast['BinOp']['right'])
+        elif 'If' in objast:
+            for stmt in objast['If']['body']:
+                self.populate_symbols(stmt)
+            self.populate_symbols(objast['If']['test'])
+            for stmt in objast['If']['orelse']:
+                self.populate_symbols(stmt)
+        elif 'Compare' in objast:
+            self.populate_symbols(objast['Compare']['left'])
+            for expr in objast['Compare']['comparators']:
+                self.populate_symbols(expr)
+        elif 'Pass' in objast:
+            pass
+        elif 'Return' in objast:
+            self.populate_symbols(objast['Return']['value'])
+        else:
+            raise ValueError(objast)
+
+    def populate_returns(self, objast):
+        pass
+
+class FunctionTranslation(collections.namedtuple('FunctionTranslation', ['fields', 'result_fields', 'provenance'])):
+    """
+        The finished translation of one function: its fields, argument
+        fields first and output formulas last, as (name, formula) pairs;
+        the names of the fields holding its results; and the provenance of
+        its fields as (name, lines) pairs. Tuples throughout, so a result
+        can be shared between threads and sent between processes.
+    """
+    __slots__ = ()
+
+def translate_function(func):
+    """Return func.translation(); a module-level entry point for process pools."""
+    return func.translation()
 
 class MathParseFunction:
     """
         Encapsulate the state associated with translating a single function.
+
+        Statements become fields named after their position, _<name>_stmt_<i>.
+        An If statement's own field holds its condition; the statements in
+        its branches get fields under _<name>_stmt_<i>_then and _else, and
+        each variable the branches leave with different values is merged
+        into a single field _<name>_stmt_<i>_var_<variable> so later
+        statements reference one IF ... END rather than copies of both
+        branches. Early returns are tracked the same way, through a
+        "has returned" condition and the value returned so far.
+
+        A function returning tuples has one output per element: each return
+        gets fields <field>_out_<k>, and the results are _<name>_out_<k>
+        rather than _<name>. The outputs reference the same intermediate
+        fields, so work they share is done once. Tuple assignments get a
+        field <field>_elt_<k> per target, and unpacking a call to a linked
+        multi-output function binds each target to one clone's outputs.
+
+        When the objast keeps positions, provenance maps each field to the
+        source line ranges of the statement (or If condition) it came from.
+
+        translation() is the entry point: it works on a private copy and
+        returns an immutable FunctionTranslation, memoized per setting, so
+        the function can be translated from several threads at once. The
+        stepwise methods (translate_function_statement and the ones built
+        on it) translate in place and leave their state on the instance.
     """
 
-    def __init__(self, astfunc):
-        """Initialize class instance from objast"""
-        self.localvars = {}
-        self.name = astfunc['name']
-        self.args = get_astfunction_args(astfunc)
+    def __init__(self, astfunc, bindings=None):
+        """
+            Initialize class instance from objast, optionally fixing some
+            arguments to constants (see specialize).
+        """
+        self.astfunc = astfunc
+        self.bindings = dict(bindings or {})
+        for arg in self.bindings:
+            if arg not in get_astfunction_args(astfunc):
+                raise KeyError(arg)
+        self.name = specialization_name(astfunc['name'], self.bindings)
+        self.args = {
+            arg: '_{}_arg_{}'.format(self.name, arg)
+            for arg in get_astfunction_args(astfunc) if arg not in self.bindings
+        }
         self.body = astfunc['body']
+        self.outputs = return_arity(self.body)
+        self.parameters = frozenset()
+        self.parameter_wrapper = None
+        self.minimal_parentheses = False
+        self.callees = {}
+        self.translations = {}
+        self.digest = None
+        self.reset()
+
+    def reset(self):
+        """Forget any statements translated so far."""
+        self.localvars = {}
+        self.constants = dict(self.bindings)
+        self.fields = {}
+        self.returned = False
+        self.retval = None
+        self.dependencies = {}
+        self.call_sites = {}
+        self.provenance = {}
+        self.lines = None
+        self.result_fields = None
+
+    def save_state(self):
+        """Snapshot the bindings that branches may change."""
+        return (
+            dict(self.localvars), dict(self.constants), self.returned, self.retval,
+            dict(self.dependencies)
+        )
 
-    def translate_function_statement(self, i):
-        """Translate a single statement in the given function's context."""
-        stmt = self.body[i]
-        if 'Return' in stmt:
-            return translate_expression(
-                self.name, self.args, self.localvars, stmt['Return']['value']
+    def restore_state(self, state):
+        """Return the bindings to a snapshot taken by save_state."""
+        localvars, constants, self.returned, self.retval, dependencies = state
+        self.localvars = dict(localvars)
+        self.constants = dict(constants)
+        self.dependencies = dict(dependencies)
+
+    @staticmethod
+    def binding(state, name):
+        """Return what a name is bound to in a saved state, for comparison."""
+        localvars, constants = state[0], state[1]
+        if name in constants:
+            return ('constant', constants[name])
+        return ('field', localvars.get(name))
+
+    def binding_formula(self, state, name):
+        """Render the value a name has in a saved state."""
+        localvars, constants = state[0], state[1]
+        if name in constants:
+            return render_constant(constants[name])
+        elif name in localvars:
+            return '[{}]'.format(localvars[name])
+        elif name in self.args:
+            return '[{}]'.format(self.args[name])
+        return 'NULL'
+
+    def translate(self, expr):
+        """Translate an expression against the current bindings."""
+        return translate_expression(
+            self.name, self.args, self.localvars, expr, self.constants, self.minimal_parentheses,
+            self.instantiate_call if self.callees else None
+        )
+
+    def instantiate_call(self, name, arg_formulas):
+        """Translate a call to a linked single-output function as a reference to a clone of it."""
+        if name not in self.callees:
+            return None
+        if self.callees[name].outputs != 1:
+            raise ValueError('{} returns {} values; unpack them with an assignment'.format(
+                name, self.callees[name].outputs
+            ))
+        return '[{}]'.format(self.clone_callee(name, arg_formulas))
+
+    def clone_callee(self, name, arg_formulas):
+        """
+            Clone a linked callee's fields for a call site: the callee's
+            _<callee>* fields become _<name>_<callee>_<k>*, with the argument
+            fields set to the call's argument formulas. Calls with the same
+            arguments share one clone. Returns the clone's prefix.
+        """
+        callee = self.callees[name]
+        if len(arg_formulas) != len(callee.args):
+            raise ValueError('{} takes {} arguments'.format(name, len(callee.args)))
+
+        key = (name, tuple(arg_formulas))
+        if key not in self.call_sites:
+            prefix = '_{}_{}_{}'.format(
+                self.name, name, 1 + len([site for site in self.call_sites if site[0] == name])
             )
-        elif 'Assign' in stmt:
-            new_local = {
-                stmt['Assign']['targets'][0]['Name']['id']: '_{}_stmt_{}'.format(self.name, i)
-            }
-            expr_string = translate_expression(
-                self.name, self.args, self.localvars, stmt['Assign']['value']
+            translation = callee.translation()
+            clone = rename_fields(dict(translation.fields), '_' + callee.name, prefix)
+            self.provenance.update(
+                (rename_field(field, '_' + callee.name, prefix), lines)
+                for field, lines in translation.provenance
             )
-            self.localvars.update(new_local)
-            return expr_string
+            for arg, formula in zip(callee.args.values(), arg_formulas):
+                clone[prefix + arg[len('_' + callee.name):]] = formula
+                self.record_provenance(prefix + arg[len('_' + callee.name):])
+            self.fields.update(clone)
+            self.call_sites[key] = prefix
+        return self.call_sites[key]
+
+    def definition_digest(self):
+        """Hash the function's arguments, bindings and body, computed once."""
+        if self.digest is None:
+            definition = repr((self.name, sorted(self.args.items()), sorted(self.bindings.items()), self.body))
+            self.digest = hashlib.sha1(definition.encode('utf-8')).hexdigest()
+        return self.digest
+
+    def translation_key(self):
+        """
+            Return everything the function's translation depends on: its
+            definition, the translation settings and, recursively, the
+            callees' keys, so redefining a callee retranslates its callers.
+        """
+        return (
+            self.definition_digest(), self.minimal_parentheses, self.parameters, self.parameter_wrapper,
+            tuple(sorted((name, callee.translation_key()) for name, callee in self.callees.items())),
+        )
+
+    def translation(self, memoize=True):
+        """
+            Translate the whole function into a FunctionTranslation, the
+            complete field set that callers and call sites use. The work is
+            done on a copy, so this instance's translation state is left
+            alone, and the result is memoized per translation_key unless
+            memoize is false.
+        """
+        key = self.translation_key()
+        result = self.translations.get(key)
+        if result is None:
+            work = copy.copy(self)
+            work.reset()
+            fields = invert_dict(work.args)
+            fields.update(work.translate_function_fields())
+            fields.update(work.output_formulas())
+            result = FunctionTranslation(
+                tuple(fields.items()), tuple(work.result_fields), tuple(work.function_provenance().items())
+            )
+            if memoize:
+                self.translations[key] = result
+        return result
+
+    def remember_translation(self, translation):
+        """Memoize a translation of this function made elsewhere, e.g. in a worker process."""
+        self.translations.setdefault(self.translation_key(), translation)
+
+    def scope_dependencies(self):
+        """Map each name in scope to the arguments its current value depends on."""
+        scope = {arg: frozenset([arg]) for arg in self.args}
+        scope.update(self.dependencies)
+        for name in self.constants:
+            scope.pop(name, None)
+        return scope
+
+    def translate_hoisted(self, field, expr, wrap=True):
+        """
+            Translate an expression for field, first moving the largest
+            subexpressions that depend only on parameter arguments into fields
+            of their own (field_param_<k>). When the whole expression depends
+            only on parameters the field itself is parameter-level and is
+            wrapped with parameter_wrapper instead.
+        """
+        if not self.parameters:
+            return self.translate(expr)
+
+        scope = self.scope_dependencies()
+        found = {}
+        deps = find_dependencies(expr, scope, found)
+
+        def parameter_only(node):
+            """Check whether a subexpression varies only with the parameters."""
+            node_deps = found.get(id(node), frozenset())
+            return bool(node_deps) and node_deps <= self.parameters
+
+        if parameter_only(expr):
+            return self.wrap_parameter(self.translate(expr)) if wrap else self.translate(expr)
+
+        hoisted = []
+
+        def hoist(node):
+            """Replace maximal parameter-only subexpressions with Field references."""
+            if isinstance(node, list):
+                return [hoist(item) for item in node]
+            elif not isinstance(node, dict) or len(node) != 1:
+                return node
+            kind, inner = next(iter(node.items()))
+            if not isinstance(inner, dict) or kind in ('Name', 'Constant', 'Num', 'Attribute'):
+                return node
+            if parameter_only(node):
+                hoisted.append('{}_param_{}'.format(field, len(hoisted)))
+                self.add_field(hoisted[-1], self.wrap_parameter(self.translate(node)))
+                return {'Field': {'id': hoisted[-1]}}
+            return {kind: {key: hoist(value) for key, value in inner.items()}}
+
+        return self.translate(hoist(expr))
+
+    def wrap_parameter(self, formula):
+        """Apply parameter_wrapper, e.g. '{{FIXED : MIN({})}}', to a parameter-level formula."""
+        if self.parameter_wrapper is None:
+            return formula
+        return self.parameter_wrapper.format(formula)
+
+    def add_field(self, field, formula):
+        """Record a generated field."""
+        self.fields[field] = formula
+        self.record_provenance(field)
+        return formula
+
+    def record_provenance(self, field):
+        """Attribute field to the source lines being translated, if they are known."""
+        if self.lines is not None:
+            self.provenance[field] = frozenset([self.lines])
+
+    def function_provenance(self):
+        """
+            Return the provenance of every field translated so far, with the
+            argument and result fields attributed to the def line.
+        """
+        provenance = dict(self.provenance)
+        lines = node_lines({'FunctionDef': self.astfunc})
+        if lines is not None:
+            definition = frozenset([(lines[0], lines[0])])
+            for field in self.args.values():
+                provenance[field] = definition
+            for name, field in zip(self.output_names(), self.result_fields or []):
+                provenance[name] = provenance.get(field, definition)
+        return provenance
+
+    def bind(self, name, field, expr, scope=None, constants=None):
+        """
+            Point a variable at a field, or at a constant when it folds. Give
+            the scope and constants from before a statement when it assigns
+            several names at once.
+        """
+        self.dependencies[name] = find_dependencies(
+            expr, self.scope_dependencies() if scope is None else scope
+        )
+        try:
+            self.constants[name] = fold_expression(
+                expr, self.constants if constants is None else constants
+            )
+            self.localvars.pop(name, None)
+        except NotConstant:
+            self.localvars[name] = field
+            self.constants.pop(name, None)
+
+    def output_suffixes(self):
+        """Return the field name suffix of each output: '' or _out_<k>."""
+        if self.outputs == 1:
+            return ['']
+        return ['_out_{}'.format(k) for k in range(self.outputs)]
+
+    def output_names(self):
+        """Name the function's result fields: _<name>, or _<name>_out_<k> for each output."""
+        return ['_{}{}'.format(self.name, suffix) for suffix in self.output_suffixes()]
+
+    def translate_return(self, field, formulas):
+        """
+            Record a return of one formula per output, guarding each with any
+            earlier conditional return. Returns the formula, or the tuple of
+            formulas for a multi-output function.
+        """
+        if isinstance(formulas, str):
+            formulas = (formulas,) * self.outputs if formulas == 'NULL' else (formulas,)
+        if len(formulas) != self.outputs:
+            raise ValueError('{} returns {} values, not {}'.format(self.name, self.outputs, len(formulas)))
+        guarded = []
+        for suffix, formula, retval in zip(self.output_suffixes(), formulas, self.retval or formulas):
+            if self.returned is not False:
+                formula = 'IF {} THEN {} ELSE {} END'.format(self.returned, retval, formula)
+            guarded.append(self.add_field(field + suffix, formula))
+        self.returned = True
+        self.retval = tuple('[{}{}]'.format(field, suffix) for suffix in self.output_suffixes())
+        return guarded[0] if self.outputs == 1 else tuple(guarded)
+
+    def translate_return_value(self, field, value):
+        """Translate a returned expression, one formula per tuple element."""
+        elements = value['Tuple']['elts'] if 'Tuple' in value else [value]
+        if len(elements) != self.outputs:
+            raise ValueError('{} returns {} values, not {}'.format(self.name, self.outputs, len(elements)))
+        return self.translate_return(field, tuple(
+            self.translate_hoisted(field + suffix, element)
+            for suffix, element in zip(self.output_suffixes(), elements)
+        ))
+
+    def translate_block(self, prefix, body):
+        """Translate a statement list, stopping once every path has returned."""
+        for i, stmt in enumerate(body):
+            if self.returned is True:
+                break
+            self.translate_statement('{}_stmt_{}'.format(prefix, i), stmt)
+
+    def translate_if(self, field, stmt):
+        """Lower an If into a condition field and one merged field per changed variable."""
+        try:
+            taken = fold_expression(stmt['If']['test'], self.constants)
+        except NotConstant:
+            pass
+        else:
+            if taken:
+                self.translate_block(field + '_then', stmt['If']['body'])
+            else:
+                self.translate_block(field + '_else', stmt['If']['orelse'])
+            return None
+
+        lines, self.lines = self.lines, node_lines(stmt['If']['test']) or self.lines
+        condition = self.add_field(field, self.translate_hoisted(field, stmt['If']['test'], False))
+        self.lines = lines
+        condition_deps = find_dependencies(stmt['If']['test'], self.scope_dependencies())
+        before = self.save_state()
+        self.translate_block(field + '_then', stmt['If']['body'])
+        then_state = self.save_state()
+        self.restore_state(before)
+        self.translate_block(field + '_else', stmt['If']['orelse'])
+        else_state = self.save_state()
+        self.merge_states(field, then_state, else_state, condition_deps)
+        return condition
+
+    def merge_states(self, field, then_state, else_state, condition_deps=frozenset()):
+        """Join the bindings left by the two branches of the If at field."""
+        cond = '[{}]'.format(field)
+        then_returned, else_returned = then_state[2], else_state[2]
+
+        if then_returned is True and else_returned is True:
+            names = set()
+        elif then_returned is True:
+            self.restore_state(else_state)
+            names = set()
+        elif else_returned is True:
+            self.restore_state(then_state)
+            names = set()
+        else:
+            names = set(then_state[0]) | set(then_state[1]) | set(else_state[0]) | set(else_state[1])
+
+        for name in sorted(names):
+            if self.binding(then_state, name) == self.binding(else_state, name):
+                continue
+            then_formula = self.binding_formula(then_state, name)
+            else_formula = self.binding_formula(else_state, name)
+            if then_formula == else_formula:
+                continue
+            merged = '{}_var_{}'.format(field, name)
+            self.add_field(merged, 'IF {} THEN {} ELSE {} END'.format(
+                cond, then_formula, else_formula
+            ))
+            self.localvars[name] = merged
+            self.constants.pop(name, None)
+            unassigned = frozenset([name]) if name in self.args else frozenset()
+            self.dependencies[name] = condition_deps.union(
+                then_state[4].get(name, unassigned), else_state[4].get(name, unassigned)
+            )
+
+        self.returned = self.merge_returned(field, cond, then_returned, else_returned)
+        if then_state[3] == else_state[3] or else_state[3] is None:
+            self.retval = then_state[3]
+        elif then_state[3] is None: # the value only matters once returned is true
+            self.retval = else_state[3]
+        else:
+            self.retval = tuple(
+                '[{}_return{}]'.format(field, suffix) for suffix in self.output_suffixes()
+            )
+            for suffix, then_value, else_value in zip(self.output_suffixes(), then_state[3], else_state[3]):
+                self.add_field(field + '_return' + suffix, 'IF {} THEN {} ELSE {} END'.format(
+                    cond, then_value, else_value
+                ))
+
+    def merge_returned(self, field, cond, then_returned, else_returned):
+        """Combine the branches' has-returned conditions."""
+        if then_returned == else_returned:
+            return then_returned
+        elif then_returned is True and else_returned is False:
+            return cond
+        elif then_returned is False and else_returned is True:
+            return '(NOT {})'.format(cond)
+        self.add_field(field + '_returned', 'IF {} THEN {} ELSE {} END'.format(
+            cond, render_constant(then_returned) if isinstance(then_returned, bool) else then_returned,
+            render_constant(else_returned) if isinstance(else_returned, bool) else else_returned
+        ))
+        return '[{}]'.format(field + '_returned')
+
+    def translate_statement(self, field, stmt):
+        """Translate one statement into field, attributing what it adds to its source lines."""
+        lines, self.lines = self.lines, node_lines(stmt) or self.lines
+        try:
+            return self.translate_statement_fields(field, stmt)
+        finally:
+            self.lines = lines
+
+    def translate_statement_fields(self, field, stmt):
+        """Translate one statement into field, returning its formula if it has one."""
+        if 'Return' in stmt:
+            if stmt['Return']['value'] is None:
+                return self.translate_return(field, 'NULL')
+            return self.translate_return_value(field, stmt['Return']['value'])
+        elif 'Raise' in stmt:
+            # Tableau has no exceptions; an invalid argument evaluates to NULL
+            return self.translate_return(field, 'NULL')
+        elif 'Assign' in stmt:
+            if 'Tuple' in stmt['Assign']['targets'][0]:
+                if len(stmt['Assign']['targets']) > 1:
+                    raise ValueError('cannot chain a tuple assignment')
+                return self.translate_unpacking(
+                    field, stmt['Assign']['targets'][0]['Tuple']['elts'], stmt['Assign']['value']
+                )
+            expr_string = self.translate_hoisted(field, stmt['Assign']['value'])
+            scope, constants = self.scope_dependencies(), dict(self.constants)
+            for target in stmt['Assign']['targets']:
+                self.bind(target['Name']['id'], field, stmt['Assign']['value'], scope, constants)
+            if isinstance(fold_constant(stmt['Assign']['value'], constants), tuple):
+                return None # tuples only exist to be subscripted by constants
+            return self.add_field(field, expr_string)
         elif 'AugAssign' in stmt:
-            new_local = {
-                stmt['AugAssign']['target']['Name']['id']: '_{}_stmt_{}'.format(self.name, i)
-            }
-            expr_string = translate_expression(
-                self.name, self.args, self.localvars, {
-                    "BinOp": {
-                        "left": stmt['AugAssign']['target'],
-                        "op": stmt['AugAssign']['op'],
-                        "right": stmt['AugAssign']['value']
-                    }
+            expr = {
+                "BinOp": {
+                    "left": stmt['AugAssign']['target'],
+                    "op": stmt['AugAssign']['op'],
+                    "right": stmt['AugAssign']['value']
                 }
-            )
-            self.localvars.update(new_local)
-            return expr_string
-        elif 'If' in stmt:
-            new_local = {
-                stmt['If']['body']
             }
+            expr_string = self.translate_hoisted(field, expr)
+            self.bind(stmt['AugAssign']['target']['Name']['id'], field, expr)
+            return self.add_field(field, expr_string)
+        elif 'If' in stmt:
+            return self.translate_if(field, stmt)
+        elif 'Expr' in stmt or 'Pass' in stmt:
+            return None
         else:
             return 'unknown statement type ' + list(stmt.keys())[0]
 
+    def translate_unpacking(self, field, targets, value):
+        """
+            Assign a tuple of values, or the outputs of a linked multi-output
+            call, to a tuple of names. Every value is translated against the
+            bindings from before the statement, as Python evaluates them.
+        """
+        names = []
+        for target in targets:
+            if 'Name' not in target:
+                raise ValueError('can only unpack into plain names')
+            names.append(target['Name']['id'])
+        scope, constants = self.scope_dependencies(), dict(self.constants)
+
+        if 'Call' in value and get_call_name(value) in self.callees:
+            callee = self.callees[get_call_name(value)]
+            if callee.outputs != len(names):
+                raise ValueError('{} returns {} values, not {}'.format(callee.name, callee.outputs, len(names)))
+            prefix = self.clone_callee(
+                get_call_name(value), [self.translate(arg) for arg in value['Call']['args']]
+            )
+            for name, suffix in zip(names, callee.output_suffixes()):
+                self.bind(name, prefix + suffix, value, scope, constants)
+            return None
+
+        elements = value.get('Tuple', value.get('List', {})).get('elts')
+        if elements is None or len(elements) != len(names):
+            raise ValueError('cannot unpack {} into {} names'.format(list(value.keys())[0], len(names)))
+        formulas = [
+            self.translate_hoisted('{}_elt_{}'.format(field, k), element)
+            for k, element in enumerate(elements)
+        ]
+        for k, (name, element, formula) in enumerate(zip(names, elements, formulas)):
+            self.bind(name, '{}_elt_{}'.format(field, k), element, scope, constants)
+            if not isinstance(fold_constant(element, constants), tuple):
+                self.add_field('{}_elt_{}'.format(field, k), formula)
+        return tuple(formulas)
+
+    def translate_function_statement(self, i):
+        """Translate a single statement in the given function's context."""
+        if self.returned is True:
+            return None # unreachable
+        return self.translate_statement('_{}_stmt_{}'.format(self.name, i), self.body[i])
+
     def collect_function_statements(self):
         """
             Return an ordered list of expressions for each statement in the function.
         """
+        self.reset()
         return [
             self.translate_function_statement(i)
             for i in range(len(self.body))
         ]
 
+    def get_result_fields(self):
+        """
+            Name the field holding each of the function's outputs, adding
+            fall-through fields _<name>_return[_out_<k>] if no return covers
+            every path.
+        """
+        if self.returned is True:
+            self.result_fields = [retval[1:-1] for retval in self.retval]
+            return self.result_fields
+        self.result_fields = []
+        lines = node_lines({'FunctionDef': self.astfunc})
+        if lines is not None:
+            self.lines = lines[1], lines[1]
+        for k, suffix in enumerate(self.output_suffixes()):
+            field = '_{}_return{}'.format(self.name, suffix)
+            if self.returned is False:
+                self.add_field(field, 'NULL')
+            else:
+                self.add_field(field, 'IF {} THEN {} ELSE NULL END'.format(self.returned, self.retval[k]))
+            self.result_fields.append(field)
+        return self.result_fields
+
+    def get_result_field(self):
+        """Name the field holding a single-output function's value (see get_result_fields)."""
+        if self.outputs != 1:
+            raise ValueError('{} returns {} values'.format(self.name, self.outputs))
+        return self.get_result_fields()[0]
+
+    def output_formulas(self):
+        """Map each output name (see output_names) to a reference to the field holding it."""
+        return {
+            name: '[{}]'.format(field)
+            for name, field in zip(self.output_names(), self.get_result_fields())
+        }
+
+    def translate_function_fields(self):
+        """Translate the whole function, returning every field it needs in order."""
+        self.collect_function_statements()
+        self.get_result_fields()
+        return dict(self.fields)
+
     def get_function_statement(self):
         """Compose the function's top-level statements into a final expression."""
-        return '[_{}_stmt_{}]'.format(
-            self.name, len(self.collect_function_statements()) - 1
-        )
+        self.collect_function_statements()
+        return '[{}]'.format(self.get_result_field())
+
+    def specialize(self, bindings):
+        """Return a copy of this function with the given arguments fixed to constants."""
+        return MathParseFunction(self.astfunc, dict(self.bindings, **bindings))
 
 class MathParse:
     """
@@ -263,33 +1411,282 @@ class MathParse:
         a single context.
     """
 
-    def __init__(self, context_name='_'):
-        """Set default empty values for instance variables."""
+    def __init__(self, context_name='_', minimal_parentheses=False, content_addressed=False,
+                 track_provenance=False, library=None, reassociate=False, eliminate_dead_stores=False):
+        """
+            Set default empty values for instance variables. library is an
+            optional precompiled snapshot (libsnapshot.LibrarySnapshot) whose
+            functions are loaded when first called or linked. With
+            reassociate, every chain of + or * in the parsed source is
+            rebalanced (see mathparse.reassociate) so that a chain of n terms
+            nests log(n) deep rather than n, which long sums need to
+            translate at all; it changes floating point rounding, so it is
+            off by default. With eliminate_dead_stores, the top-level
+            assignments of each function whose values are never read get no
+            fields.
+        """
         self.context = MathParseContext(context_name)
+        self.minimal_parentheses = minimal_parentheses
+        self.reassociate = reassociate
+        self.eliminate_dead_stores = eliminate_dead_stores
+        self.content_addressed = content_addressed
+        self.track_provenance = track_provenance
+        self.library = library
+        self.library_functions = set()
 
         self.function_list = []
         self.source = ""
         self.objast = None
+        self.specializations = {}
+        self.function_index = {}
+        self.provenance = {}
 
-    def translate(self):
-        """Translate this context's function list."""
-        result = {}
+    def get_function(self, name):
+        """
+            Find a parsed function by name, falling back to the functions
+            indexed by add_module and then to the library.
+        """
         for func in self.function_list:
-            stmts = func.body
-            result.update(invert_dict(func.args))
-            result.update(
-                {
-                    '_{}_stmt_{}'.format(func.name, i): func.translate_function_statement(i)
-                    for i in range(len(stmts))
-                }
-            )
-            result.update(
-                {
-                    '_{}'.format(func.name): func.get_function_statement()
-                }
+            if func.name == name:
+                return func
+        self.load_library_functions([name])
+        return self.function_index[name]
+
+    def specialize(self, name, bindings):
+        """
+            Translate function name with some of its arguments fixed to
+            constants. The constants are propagated through the body, branches
+            they decide are dropped, and only the fields the result still
+            depends on are returned. Results are cached per argument binding.
+        """
+        key = (name, tuple(sorted(bindings.items())))
+        if key not in self.specializations:
+            func = self.get_function(name).specialize(bindings)
+            func.minimal_parentheses = self.minimal_parentheses
+            translation = func.translation()
+            self.specializations[key] = reachable_fields(dict(translation.fields), func.output_names())
+            self.provenance.update(translation.provenance)
+        return dict(self.specializations[key])
+
+    def mark_parameters(self, name, parameters, wrapper=None):
+        """
+            Declare some of function name's arguments parameter-like (constant
+            or low-cardinality), so that work depending only on them is hoisted
+            into separate fields, optionally wrapped for aggregate-level
+            evaluation with a format string such as '{{FIXED : MIN({})}}'.
+        """
+        func = self.get_function(name)
+        for parameter in parameters:
+            if parameter not in func.args:
+                raise KeyError(parameter)
+        func.parameters = frozenset(parameters)
+        func.parameter_wrapper = wrapper
+
+    def parse_module(self, mathstr):
+        """
+            Parse mathstr into an ast.Module, dropping dead stores and
+            rebalancing chains as the eliminate_dead_stores and reassociate
+            options ask.
+        """
+        module = ast.parse(mathstr)
+        if self.eliminate_dead_stores:
+            for node in ast.walk(module):
+                if isinstance(node, ast.FunctionDef):
+                    drop_dead_stores(node)
+        if self.reassociate:
+            module = reassociate(module)
+        return module
+
+    def add_module(self, mathstr):
+        """Index the functions and class methods defined in mathstr for linking."""
+        self.index_functions(functions_from_module(objectify_ast(self.parse_module(mathstr), self.track_provenance)))
+
+    def index_functions(self, functions):
+        """Index already-parsed MathParseFunctions, e.g. from irpack.load_functions, for linking."""
+        for func in functions:
+            self.function_index[func.name] = func
+
+    def load_library_functions(self, names):
+        """
+            Index those of names, and everything they call in turn, that
+            are neither defined here nor indexed yet but are in the library.
+        """
+        if self.library is None:
+            return
+        defined = {func.name for func in self.function_list}
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in self.function_index or name in defined or name not in self.library:
+                continue
+            func = self.library.function(name)
+            self.function_index[name] = func
+            self.library_functions.add(name)
+            pending.extend(called_functions(func.body))
+
+    def link_library_calls(self, functions):
+        """Resolve the calls functions make to library functions, as link would."""
+        if self.library is None:
+            return
+        called = set().union(*[called_functions(func.body) for func in functions])
+        self.load_library_functions(called)
+        used = sorted(called & self.library_functions)
+        if not used:
+            return
+        graph = self.call_graph()
+        for name in self.reachable_functions(used):
+            func = self.function_index[name]
+            func.callees = {callee: self.function_index[callee] for callee in graph[name]}
+            func.minimal_parentheses = self.minimal_parentheses
+        for func in functions:
+            func.callees.update(
+                (name, self.function_index[name]) for name in called_functions(func.body) & self.library_functions
             )
+
+    def call_graph(self):
+        """Map each indexed function to the indexed functions it calls."""
+        return {
+            name: sorted(called_functions(func.body) & set(self.function_index))
+            for name, func in self.function_index.items()
+        }
+
+    def reachable_functions(self, entry_points):
+        """
+            Return the indexed functions the entry points need, callees before
+            callers, raising ValueError on recursion, which Tableau cannot express.
+        """
+        graph = self.call_graph()
+        order = []
+        state = {}
+        for entry in entry_points:
+            if entry not in graph:
+                raise KeyError(entry)
+            stack = [(entry, iter(graph[entry]))]
+            state.setdefault(entry, 'visiting')
+            while stack:
+                name, callees = stack[-1]
+                callee = next(callees, None)
+                if callee is None:
+                    stack.pop()
+                    if state[name] != 'done':
+                        state[name] = 'done'
+                        order.append(name)
+                elif state.get(callee) == 'visiting':
+                    raise ValueError('recursive call from {} to {}'.format(name, callee))
+                elif callee not in state:
+                    state[callee] = 'visiting'
+                    stack.append((callee, iter(graph[callee])))
+        return order
+
+    def link(self, entry_points):
+        """
+            Translate the entry points among the indexed functions. Only
+            functions reachable from them are translated, each once, and
+            calls between them are resolved by cloning the callee's fields.
+        """
+        prebuilt = {name: self.prebuilt_fields(name) for name in entry_points}
+        translated = [name for name in entry_points if prebuilt[name] is None]
+        self.load_library_functions(
+            set(translated).union(*[called_functions(func.body) for func in self.function_index.values()])
+        )
+        graph = self.call_graph()
+        for name in self.reachable_functions(translated):
+            func = self.function_index[name]
+            func.callees = {callee: self.function_index[callee] for callee in graph[name]}
+            func.minimal_parentheses = self.minimal_parentheses
+        result = {}
+        for name in entry_points:
+            if prebuilt[name] is not None:
+                result.update(prebuilt[name])
+            else:
+                result.update(self.translate_function_stream(self.function_index[name]))
         return result
 
+    def prebuilt_fields(self, name):
+        """
+            Return the library's translation of function name if it comes
+            from the library and can be used as is, or None.
+        """
+        if self.library is None or self.track_provenance:
+            return None
+        if name in self.library_functions:
+            if self.function_index[name].parameters:
+                return None
+        elif name in self.function_index or name in {func.name for func in self.function_list} \
+                or name not in self.library:
+            return None
+        return self.library.fields(name, self.minimal_parentheses)
+
+    def translate(self, executor=None):
+        """
+            Translate this context's function list. With content_addressed,
+            intermediate fields are named by content (see
+            content_address_fields) and only the _<function> fields keep their
+            names; provenance follows the renaming. executor, a
+            concurrent.futures thread or process pool, translates the
+            functions in parallel (see translate_stream).
+        """
+        result = dict(self.translate_stream(executor, memoize=True))
+        if self.content_addressed:
+            keep = [name for func in self.function_list for name in func.output_names()]
+            fields = result
+            result, names = content_address_fields(fields, keep)
+            provenance = merge_provenance(self.provenance, names, fields)
+            provenance.update((name, self.provenance[name]) for name in keep if name in self.provenance)
+            self.provenance = provenance
+        return result
+
+    def translate_function_stream(self, func, translation=None, memoize=True):
+        """
+            Yield (field, formula) pairs for one function, from translation
+            if it was already made, keeping its fields' provenance. With
+            memoize false the translation is not kept on the function.
+        """
+        func.minimal_parentheses = self.minimal_parentheses
+        if translation is None:
+            translation = func.translation(memoize)
+        elif memoize:
+            func.remember_translation(translation)
+        self.provenance.update(translation.provenance)
+        yield from translation.fields
+
+    def translate_stream(self, executor=None, memoize=False):
+        """
+            Yield (field, formula) pairs function by function for the parsed
+            function list. With executor, the functions are translated on it
+            concurrently, since a translation reads nothing but the function
+            and its callees, and yielded in order as they finish. Each
+            function's translation is released once yielded rather than
+            memoized, unless memoize is set; linked callees still are.
+        """
+        self.link_library_calls(self.function_list)
+        if executor is None:
+            for func in self.function_list:
+                yield from self.translate_function_stream(func, memoize=memoize)
+            return
+        for func in self.function_list:
+            func.minimal_parentheses = self.minimal_parentheses
+        translations = executor.map(translate_function, self.function_list)
+        for func, translation in zip(self.function_list, translations):
+            yield from self.translate_function_stream(func, translation, memoize)
+
+    def translate_string_stream(self, mathstr):
+        """
+            Translate the top-level functions of mathstr without keeping the
+            module around: each function is objectified, translated, yielded
+            and released before the next, so memory follows the largest
+            function rather than the whole module.
+        """
+        for func in iter_module_functions(self.parse_module(mathstr), self.track_provenance):
+            yield from self.translate_function_stream(func, memoize=False)
+
+    def provenance_report(self, fields, source=None):
+        """
+            Attribute the cost of translated fields to lines of source,
+            by default the parsed source (see provenance_report).
+        """
+        return provenance_report(self.source if source is None else source, fields, self.provenance)
+
     def context_parse_string(self, mathstr):
         """Consume a string, updating it into the context."""
         self.source = mathstr
@@ -301,7 +1698,7 @@ class MathParse:
     def parse_string(self, mathstr):
         """Consume a string, keeping a source copy and storing its objast."""
         self.source = mathstr
-        self.objast = objectify_string(mathstr)
+        self.objast = objectify_ast(self.parse_module(mathstr), self.track_provenance)
         self.function_list = functions_from_ast(self.objast)
 
 class SymbolSeekerVisitor(ast.NodeVisitor):
@@ -372,6 +1769,20 @@ class RenderVisitor(ast.NodeVisitor):
     def visit_Num(self, node):
         return node.n
 
+class MinimalRenderVisitor(PrecedenceRenderer):
+    """Render like RenderVisitor, but with only the parentheses precedence requires."""
+
+    def __init__(self, symbol_defs, context_name='_'):
+        super().__init__()
+        self.symbol_defs = symbol_defs
+        self.context_name = context_name
+
+    def visit(self, node):
+        return self.render(node)
+
+    def expand_name(self, node):
+        return ['[{}]'.format(self.symbol_defs[node.id])]
+
 def translate_ast_expression(ast_expr):
     """Translate one expression and generate any formulas."""
     symbols = {}
@@ -383,13 +1794,23 @@ def translate_ast_expression(ast_expr):
     return formulae
 
 class ASTMathParse:
-    """Translate on the normal AST not an objast."""
+    """
+        Translate on the normal AST not an objast.
+
+        Contexts nest through parent, and a symbol resolves to the innermost
+        context defining it. Resolutions are interned and cached per context
+        and stay valid until the symbols of that context or one above it
+        change, so lookups are O(1) amortized however deep the chain of
+        contexts is, and changes elsewhere in the tree leave them be. The
+        symbols are a frozenset: change them by assigning symbols or with
+        add_symbols and discard_symbols, which count the change in version.
+    """
 
     def __init__(self, context_name='_', parent=None):
         """Initialize our instance variables."""
         self.src = ""
         self.ast = None
-        self.symbols = set()
+        self._symbols = frozenset()
         self.target_symbols = set()
         self.statements = []
 
@@ -398,7 +1819,45 @@ class ASTMathParse:
         self.qualified_context_name = '{}:{}'.format(
             parent.qualified_context_name, context_name
         ) if parent else context_name
+        self.symbol_prefix = '_{}:'.format(self.qualified_context_name)
         self.parent = parent
+        self.minimal_parentheses = parent.minimal_parentheses if parent else False
+        self.resolved = {}
+        # changes to the symbols of this context or those above it
+        self.version = parent.version if parent else 0
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def symbols(self):
+        """The symbols this context defines; assigning them invalidates cached resolutions."""
+        return self._symbols
+
+    @symbols.setter
+    def symbols(self, symbols):
+        self._symbols = frozenset(symbols)
+        self.symbols_changed()
+
+    def add_symbols(self, symbols):
+        """Define more symbols in this context."""
+        self.symbols = self._symbols.union(symbols)
+
+    def discard_symbols(self, symbols):
+        """Stop defining symbols in this context."""
+        self.symbols = self._symbols.difference(symbols)
+
+    def symbols_changed(self):
+        """
+            Count a change to this context's symbols in its version and those
+            of the contexts below it, emptying their resolution caches.
+        """
+        pending = [self]
+        while pending:
+            context = pending.pop()
+            context.version += 1
+            context.resolved = {}
+            pending.extend(context.children)
 
     def find_symbols(self):
         """Visit all the nodes in the AST finding symbols referenced."""
@@ -437,7 +1896,8 @@ class ASTMathParse:
 
     def translate_expression(self, expr):
         """Translate an expression in context."""
-        rv = RenderVisitor(self.symbol_table, self.context_name)
+        visitor = MinimalRenderVisitor if self.minimal_parentheses else RenderVisitor
+        rv = visitor(self.symbol_table, self.context_name)
         return rv.visit(expr)
 
     def create_child_context(self, name):
@@ -446,12 +1906,27 @@ class ASTMathParse:
 
     def resolve_symbol(self, symbol):
         """Look up the symbol in the chain of contexts and return its qualified name."""
-        if symbol in self.symbols:
-            return '_{}:{}'.format(self.qualified_context_name, symbol)
-        elif self.parent is not None:
-            return self.parent.resolve_symbol(symbol)
+        cache = self.resolved
+        if symbol in cache:
+            return cache[symbol]
+
+        # walk up iteratively, then cache the answer in every context passed
+        visited = [cache]
+        context = self
+        while symbol not in context.symbols:
+            context = context.parent
+            if context is None:
+                raise KeyError(symbol)
+            cache = context.resolved
+            if symbol in cache:
+                qualified = cache[symbol]
+                break
+            visited.append(cache)
         else:
-            raise KeyError(symbol)
+            qualified = sys.intern(context.symbol_prefix + symbol)
+        for cache in visited:
+            cache[symbol] = qualified
+        return qualified
 
     def translate_statements(self):
         """Translate whatever is in our statement list."""
@@ -500,7 +1975,7 @@ class ASTMathParse:
             self.symbol_table[symbol] = 0
 
         new_thing = {symbol: self.versioned_symbol(symbol)}
-        self.symbols.update(new_thing)
+        self.add_symbols(new_thing)
 
     def find_bound_variables(self, myast, ctx={}):
         """Identify the free variables in an assignment RHS."""
@@ -0,0 +1,309 @@
+#!/usr/bin/python3
+
+"""
+    Parse the Tableau calculated-field formulas the translators emit back into
+    a small expression tree, so they can be re-rendered for other backends.
+
+    Nodes are tuples tagged by their first element:
+
+        ('number', text)            ('string', value)
+        ('boolean', value)          ('null',)
+        ('field', name)             [name] reference to another field
+        ('column', name)            bare identifier, e.g. an argument placeholder
+        ('unary', op, operand)      op is '-' or 'NOT'
+        ('binary', op, left, right)
+        ('call', NAME, (args...))
+        ('if', ((cond, value), ...), else_value or None)
+
+    Parsing is operator-precedence with explicit stacks, so deeply nested
+    formulas do not hit the recursion limit; render_formula turns a tree
+    back into formula text the same way.
+"""
+
+import re
+
+TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+      | (?P<field>\[[^\]]*\])
+      | (?P<string>"(?:[^"]|"")*"|'(?:[^']|'')*')
+      | (?P<name>[A-Za-z_][A-Za-z_0-9]*)
+      | (?P<op>\*\*|<=|>=|==|!=|<>|[-+*/%^=<>(),])
+    )''', re.VERBOSE)
+
+KEYWORDS = frozenset(['AND', 'OR', 'NOT', 'IF', 'THEN', 'ELSEIF', 'ELSE', 'END', 'TRUE', 'FALSE', 'NULL'])
+
+# Tableau's binding strengths, loosest first. Unlike Python, negation binds
+# tighter than exponentiation: -x ^ 2 is (-x) ^ 2, which is how the
+# translators' full-parentheses output, (-[_x] ^ 2), means it.
+BINARY_PRECEDENCE = {
+    'OR': 1,
+    'AND': 2,
+    '=': 4, '==': 4, '!=': 4, '<>': 4, '<': 4, '<=': 4, '>': 4, '>=': 4,
+    '+': 5, '-': 5,
+    '*': 6, '/': 6, '%': 6,
+    '^': 8,
+}
+
+UNARY_PRECEDENCE = {
+    'NOT': 3,
+    '-': 9,
+}
+
+RIGHT_ASSOCIATIVE = frozenset(['^'])
+
+class FormulaSyntaxError(ValueError):
+    """The formula is not one the translators could have produced."""
+
+def tokenize(formula):
+    """
+        Yield (kind, text) tokens; names that are keywords come back as kind
+        'keyword', and ** (from mathparse.TranslatorVisitor) comes back as ^.
+    """
+    position = 0
+    formula = formula.rstrip()
+    while position < len(formula):
+        match = TOKEN.match(formula, position)
+        if match is None or match.end() == position:
+            raise FormulaSyntaxError('unexpected {!r} at {}'.format(formula[position:position + 10], position))
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'name' and text.upper() in KEYWORDS:
+            kind, text = 'keyword', text.upper()
+        elif text == '**':
+            text = '^'
+        yield kind, text
+        position = match.end()
+
+def literal(kind, text):
+    """Build the node for an operand token."""
+    if kind == 'number':
+        return ('number', text)
+    elif kind == 'field':
+        return ('field', text[1:-1])
+    elif kind == 'string':
+        return ('string', text[1:-1].replace(text[0] * 2, text[0]))
+    elif text == 'NULL':
+        return ('null',)
+    elif text in ('TRUE', 'FALSE'):
+        return ('boolean', text == 'TRUE')
+    return ('column', text)
+
+def parse_formula(formula):
+    """Parse a formula string into a node tuple."""
+    tokens = list(tokenize(formula))
+    output = []
+    # entries are ('binary', op), ('unary', op), or group markers
+    # ('paren',), ('call', NAME, depth), ('if', depth)
+    operators = []
+    expect_operand = True
+    pending_call = None
+
+    def reduce_one():
+        entry = operators.pop()
+        if entry[0] == 'unary':
+            output.append(('unary', entry[1], output.pop()))
+        else:
+            right = output.pop()
+            output.append(('binary', entry[1], output.pop(), right))
+
+    def reduce_to_group():
+        while operators and operators[-1][0] in ('unary', 'binary'):
+            reduce_one()
+        if not operators:
+            raise FormulaSyntaxError('unbalanced formula {!r}'.format(formula))
+        return operators[-1]
+
+    for i, (kind, text) in enumerate(tokens):
+        following = tokens[i + 1] if i + 1 < len(tokens) else (None, None)
+        if expect_operand:
+            if kind == 'name' and following == ('op', '('):
+                pending_call = text
+            elif kind == 'op' and text == '(':
+                operators.append(('paren',) if pending_call is None else ('call', pending_call, len(output)))
+                pending_call = None
+            elif kind == 'op' and text == ')' and operators and operators[-1][0] == 'call' \
+                    and operators[-1][2] == len(output) and tokens[i - 1] == ('op', '('):
+                output.append(('call', operators.pop()[1], ()))
+                expect_operand = False
+            elif (kind, text) in (('op', '-'), ('op', '+'), ('keyword', 'NOT')):
+                if text != '+':
+                    operators.append(('unary', text))
+            elif kind == 'keyword' and text == 'IF':
+                operators.append(('if', len(output)))
+            elif kind in ('number', 'field', 'string', 'name') or text in ('NULL', 'TRUE', 'FALSE'):
+                output.append(literal(kind, text))
+                expect_operand = False
+            else:
+                raise FormulaSyntaxError('expected an operand, found {!r}'.format(text))
+        elif text in BINARY_PRECEDENCE and kind in ('op', 'keyword'):
+            precedence = BINARY_PRECEDENCE[text]
+            while operators and operators[-1][0] in ('unary', 'binary'):
+                top = operators[-1]
+                top_precedence = (UNARY_PRECEDENCE if top[0] == 'unary' else BINARY_PRECEDENCE)[top[1]]
+                if top_precedence > precedence or (top_precedence == precedence and text not in RIGHT_ASSOCIATIVE):
+                    reduce_one()
+                else:
+                    break
+            operators.append(('binary', text))
+            expect_operand = True
+        elif text == ')':
+            group = reduce_to_group()
+            operators.pop()
+            if group[0] == 'call':
+                args = tuple(output[group[2]:])
+                del output[group[2]:]
+                output.append(('call', group[1], args))
+            elif group[0] != 'paren':
+                raise FormulaSyntaxError('unbalanced formula {!r}'.format(formula))
+        elif text == ',':
+            if reduce_to_group()[0] != 'call':
+                raise FormulaSyntaxError('comma outside a call in {!r}'.format(formula))
+            expect_operand = True
+        elif text in ('THEN', 'ELSEIF', 'ELSE'):
+            if reduce_to_group()[0] != 'if':
+                raise FormulaSyntaxError('{} outside IF in {!r}'.format(text, formula))
+            expect_operand = True
+        elif text == 'END':
+            group = reduce_to_group()
+            if group[0] != 'if':
+                raise FormulaSyntaxError('END outside IF in {!r}'.format(formula))
+            operators.pop()
+            parts = output[group[1]:]
+            del output[group[1]:]
+            otherwise = parts.pop() if len(parts) % 2 else None
+            output.append(('if', tuple(zip(parts[::2], parts[1::2])), otherwise))
+        else:
+            raise FormulaSyntaxError('unexpected {!r} in {!r}'.format(text, formula))
+
+    if expect_operand:
+        raise FormulaSyntaxError('incomplete formula {!r}'.format(formula))
+    while operators:
+        if operators[-1][0] not in ('unary', 'binary'):
+            raise FormulaSyntaxError('unbalanced formula {!r}'.format(formula))
+        reduce_one()
+    if len(output) != 1:
+        raise FormulaSyntaxError('incomplete formula {!r}'.format(formula))
+    return output[0]
+
+def iter_nodes(node):
+    """Yield node and every node below it, without recursion."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(children(node))
+
+def children(node):
+    """Return the direct sub-nodes of node."""
+    tag = node[0]
+    if tag == 'unary':
+        return [node[2]]
+    elif tag == 'binary':
+        return [node[2], node[3]]
+    elif tag == 'call':
+        return list(node[2])
+    elif tag == 'if':
+        result = [part for branch in node[1] for part in branch]
+        if node[2] is not None:
+            result.append(node[2])
+        return result
+    return []
+
+def with_children(node, parts):
+    """Return node with its direct sub-nodes replaced by parts, in children() order."""
+    tag = node[0]
+    if tag == 'unary':
+        return (tag, node[1], parts[0])
+    elif tag == 'binary':
+        return (tag, node[1], parts[0], parts[1])
+    elif tag == 'call':
+        return (tag, node[1], tuple(parts))
+    elif tag == 'if':
+        count = 2 * len(node[1])
+        return (tag, tuple(zip(parts[0:count:2], parts[1:count:2])), parts[count] if node[2] is not None else None)
+    return node
+
+OPERATIONS = frozenset(['unary', 'binary', 'call', 'if'])
+
+def count_operations(formula):
+    """Count the operators, function calls and conditionals in a formula."""
+    return sum(1 for node in iter_nodes(parse_formula(formula)) if node[0] in OPERATIONS)
+
+# precedence of nodes that never need parentheses
+ATOM_PRECEDENCE = 10
+
+def render_atom(node):
+    """Render a leaf node as formula text."""
+    tag = node[0]
+    if tag == 'number':
+        return node[1]
+    elif tag == 'string':
+        return '"{}"'.format(node[1].replace('"', '""'))
+    elif tag == 'boolean':
+        return 'TRUE' if node[1] else 'FALSE'
+    elif tag == 'null':
+        return 'NULL'
+    elif tag == 'field':
+        return '[{}]'.format(node[1])
+    return node[1]
+
+def render_formula(node):
+    """
+        Render a node tree back into formula text with only the parentheses
+        precedence and associativity require, so that parsing the result
+        gives the same tree. Rendering is iterative like parsing.
+    """
+    # (text, precedence) of rendered nodes, children in order
+    rendered = []
+    stack = [(node, False)]
+    while stack:
+        node, expanded = stack.pop()
+        tag = node[0]
+        if tag not in OPERATIONS:
+            rendered.append((render_atom(node), ATOM_PRECEDENCE))
+            continue
+        parts = children(node)
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(parts))
+            continue
+        finished = rendered[len(rendered) - len(parts):]
+        del rendered[len(rendered) - len(parts):]
+        operands = [text for text, _ in finished]
+        precedences = [precedence for _, precedence in finished]
+        if tag == 'unary':
+            precedence = UNARY_PRECEDENCE[node[1]]
+            operand = operands[0] if precedences[0] >= precedence else '({})'.format(operands[0])
+            if node[1] == 'NOT':
+                text = 'NOT ' + operand
+            else:
+                # a space keeps a double negation from reading as --
+                text = ('- ' if operand.startswith('-') else '-') + operand
+            rendered.append((text, precedence))
+        elif tag == 'binary':
+            op = node[1]
+            precedence = BINARY_PRECEDENCE[op]
+            right_associative = op in RIGHT_ASSOCIATIVE
+            left, right = operands
+            # a negated operand of ^ is parenthesized although it needs not be,
+            # as mathparse does, since Python would read -x ^ 2 the other way
+            if precedences[0] < precedence or (precedences[0] == precedence and right_associative) \
+                    or (op == '^' and parts[0][0] == 'unary'):
+                left = '({})'.format(left)
+            if precedences[1] < precedence or (precedences[1] == precedence and not right_associative) \
+                    or (op == '^' and parts[1][0] == 'unary'):
+                right = '({})'.format(right)
+            rendered.append(('{} {} {}'.format(left, op, right), precedence))
+        elif tag == 'call':
+            rendered.append(('{}({})'.format(node[1], ', '.join(operands)), ATOM_PRECEDENCE))
+        else:
+            text = []
+            for k in range(len(node[1])):
+                text.append('{} {} THEN {}'.format(
+                    'IF' if k == 0 else 'ELSEIF', operands[2 * k], operands[2 * k + 1]))
+            if node[2] is not None:
+                text.append('ELSE ' + operands[-1])
+            text.append('END')
+            rendered.append((' '.join(text), ATOM_PRECEDENCE))
+    return rendered[0][0]
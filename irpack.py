@@ -0,0 +1,478 @@
+#!/usr/bin/python3
+
+"""
+    A compact binary encoding of the translator IR, the objast trees
+    objectify_node builds, that can be read in place through mmap.
+
+    A pack holds an interned string table, a table of numbers, a table of
+    node shapes (class name and field names), one flat array of value
+    records, an array of child indices, and a table of named roots.
+    Identical subtrees are stored once. Opening a pack only reads its
+    header; values are decoded when they are visited, so a worker or cache
+    reader can walk one function of a large library without touching the
+    rest. materialize turns any value back into the exact objast.
+
+    Layout, little-endian u32 words unless noted:
+
+        header   magic 'IRPK', version u16, reserved u16, then the counts
+                 of strings, numbers, shape words, shapes, records, child
+                 indices and roots
+        strings  end offsets, then UTF-8 bytes padded to 4
+        numbers  u64 each, an int in two's complement or a float's bits
+        shapes   start offsets into the shape words, then the words:
+                 class name string, field name strings...
+        records  three words each: tag << 28 | shape, count, payload
+        children value indices
+        roots    (name string, value) pairs
+
+    A scalar record's payload indexes the string or number table. A list
+    record's elements are count child indices starting at payload; a node
+    record's field values likewise, in the order of its shape's fields.
+"""
+
+import argparse
+import mmap
+import struct
+
+import ctxmathparse
+
+MAGIC = b'IRPK'
+VERSION = 1
+HEADER = struct.Struct('<4sHH7I')
+
+TAG_NONE, TAG_FALSE, TAG_TRUE, TAG_INT, TAG_BIGINT, TAG_FLOAT, TAG_STR, TAG_LIST, TAG_NODE = range(9)
+TAG_SHIFT = 28
+SHAPE_MASK = (1 << TAG_SHIFT) - 1
+
+class IRPackError(ValueError):
+    """The data is not a pack this version can read."""
+
+def pad4(length):
+    """Round length up to a multiple of 4."""
+    return (length + 3) & ~3
+
+def float_bits(value):
+    """Return the IEEE 754 bits of a float as an unsigned int."""
+    return struct.unpack('<Q', struct.pack('<d', value))[0]
+
+def bits_float(bits):
+    """Return the float whose IEEE 754 bits are bits."""
+    return struct.unpack('<d', struct.pack('<Q', bits))[0]
+
+class IRPackWriter:
+    """Accumulate roots into a pack, interning strings and numbers and sharing identical subtrees."""
+
+    def __init__(self):
+        self.strings = []
+        self.string_index = {}
+        self.numbers = []
+        self.number_index = {}
+        self.shapes = []
+        self.shape_index = {}
+        self.records = []
+        self.record_index = {}
+        self.children = []
+        self.roots = []
+
+    def intern(self, text):
+        """Return the index of text in the string table, adding it if needed."""
+        index = self.string_index.get(text)
+        if index is None:
+            index = self.string_index[text] = len(self.strings)
+            self.strings.append(text)
+        return index
+
+    def number(self, bits):
+        """Return the index of a 64-bit pattern in the number table."""
+        index = self.number_index.get(bits)
+        if index is None:
+            index = self.number_index[bits] = len(self.numbers)
+            self.numbers.append(bits)
+        return index
+
+    def shape(self, name, fields):
+        """Return the index of the node shape (name, fields)."""
+        key = (name, tuple(fields))
+        index = self.shape_index.get(key)
+        if index is None:
+            index = self.shape_index[key] = len(self.shapes)
+            self.shapes.append([self.intern(name)] + [self.intern(field) for field in fields])
+        return index
+
+    def record(self, tag, shape=0, children=(), payload=0):
+        """Return the index of a record, reusing an identical one."""
+        children = tuple(children)
+        key = (tag, shape, payload, children)
+        index = self.record_index.get(key)
+        if index is None:
+            if tag in (TAG_LIST, TAG_NODE):
+                payload = len(self.children)
+                self.children.extend(children)
+            index = self.record_index[key] = len(self.records) // 3
+            self.records.extend([tag << TAG_SHIFT | shape, len(children), payload])
+        return index
+
+    def scalar(self, value):
+        """Encode a leaf value."""
+        if value is None:
+            return self.record(TAG_NONE)
+        elif value is True or value is False:
+            return self.record(TAG_TRUE if value else TAG_FALSE)
+        elif isinstance(value, int):
+            if -2 ** 63 <= value < 2 ** 63:
+                return self.record(TAG_INT, payload=self.number(value & 0xFFFFFFFFFFFFFFFF))
+            return self.record(TAG_BIGINT, payload=self.intern(str(value)))
+        elif isinstance(value, float):
+            # by bits, so -0.0 and 0.0 stay apart and NaN is shared
+            return self.record(TAG_FLOAT, payload=self.number(float_bits(value)))
+        elif isinstance(value, str):
+            return self.record(TAG_STR, payload=self.intern(value))
+        raise TypeError('cannot pack {!r}'.format(value))
+
+    def add(self, value):
+        """Encode an objast value without recursion and return its index."""
+        # post-order: a container is encoded once all its children are
+        results = []
+        stack = [(value, False)]
+        while stack:
+            item, expanded = stack.pop()
+            if isinstance(item, (list, dict)) and expanded:
+                if isinstance(item, list):
+                    count, tag, shape = len(item), TAG_LIST, 0
+                else:
+                    (name, inner), = item.items()
+                    count, tag, shape = len(inner), TAG_NODE, self.shape(name, inner)
+                values = results[len(results) - count:]
+                del results[len(results) - count:]
+                results.append(self.record(tag, shape, values))
+            elif isinstance(item, list):
+                stack.append((item, True))
+                stack.extend((element, False) for element in reversed(item))
+            elif isinstance(item, dict):
+                if len(item) != 1:
+                    raise TypeError('an objast node has one key, not {}'.format(len(item)))
+                stack.append((item, True))
+                inner = next(iter(item.values()))
+                stack.extend((field_value, False) for field_value in reversed(list(inner.values())))
+            else:
+                results.append(self.scalar(item))
+        return results[0]
+
+    def add_root(self, name, value):
+        """Encode value and record it under name."""
+        self.roots.append((self.intern(name), self.add(value)))
+
+    def to_bytes(self):
+        """Serialize the pack."""
+        encoded = [text.encode('utf-8') for text in self.strings]
+        ends = []
+        end = 0
+        for data in encoded:
+            end += len(data)
+            ends.append(end)
+        blob = b''.join(encoded)
+        shape_starts = []
+        shape_words = []
+        for shape in self.shapes:
+            shape_starts.append(len(shape_words))
+            shape_words.extend(shape)
+        shape_starts.append(len(shape_words))
+
+        def words(values):
+            return struct.pack('<{}I'.format(len(values)), *values)
+
+        return b''.join([
+            HEADER.pack(
+                MAGIC, VERSION, 0, len(self.strings), len(self.numbers), len(shape_words),
+                len(self.shapes), len(self.records) // 3, len(self.children), len(self.roots),
+            ),
+            words(ends),
+            blob, b'\0' * (pad4(len(blob)) - len(blob)),
+            struct.pack('<{}Q'.format(len(self.numbers)), *self.numbers),
+            words(shape_starts), words(shape_words),
+            words(self.records),
+            words(self.children),
+            words([index for root in self.roots for index in root]),
+        ])
+
+class IRList:
+    """A read-only sequence view of a packed list."""
+
+    __slots__ = ('pack', 'index', 'start', 'count')
+
+    def __init__(self, pack, index, start, count):
+        self.pack = pack
+        self.index = index
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.pack.value(self.pack.children[self.start + i])
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.pack.value(self.pack.children[self.start + i])
+
+    def __repr__(self):
+        return 'IRList({} items)'.format(self.count)
+
+class IRNode:
+    """
+        A read-only view of a packed node: type is the AST class name, and
+        fields are read by name like the inner dict of an objast node.
+    """
+
+    __slots__ = ('pack', 'index', 'shape', 'start')
+
+    def __init__(self, pack, index, shape, start):
+        self.pack = pack
+        self.index = index
+        self.shape = shape
+        self.start = start
+
+    @property
+    def type(self):
+        """The AST class name."""
+        return self.pack.shape(self.shape)[0]
+
+    def fields(self):
+        """Return the field names in order."""
+        return self.pack.shape(self.shape)[1]
+
+    def items(self):
+        """Yield (field, value) pairs in order."""
+        children = self.pack.children
+        for i, field in enumerate(self.fields()):
+            yield field, self.pack.value(children[self.start + i])
+
+    def __getitem__(self, field):
+        try:
+            i = self.fields().index(field)
+        except ValueError:
+            raise KeyError(field) from None
+        return self.pack.value(self.pack.children[self.start + i])
+
+    def __contains__(self, field):
+        return field in self.fields()
+
+    def __repr__(self):
+        return 'IRNode({})'.format(self.type)
+
+class IRPack:
+    """
+        Read a pack from a buffer (bytes or an mmap) without decoding it.
+        Only the header is parsed up front; strings and shapes are decoded
+        and cached as they are first used.
+    """
+
+    def __init__(self, buffer):
+        """Check the header and locate the sections of buffer."""
+        self.buffer = buffer
+        if len(buffer) < HEADER.size:
+            raise IRPackError('truncated header')
+        magic, version, _, strings, numbers, shape_words, shapes, records, children, roots = \
+            HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise IRPackError('not a pack')
+        if version != VERSION:
+            raise IRPackError('unsupported version {}'.format(version))
+
+        self.view = view = memoryview(buffer)
+        self.views = []
+
+        def section(offset, count, fmt='I'):
+            size = count * struct.calcsize(fmt)
+            if offset + size > len(buffer):
+                raise IRPackError('truncated pack')
+            self.views.append(view[offset:offset + size].cast(fmt))
+            return self.views[-1], offset + size
+
+        self.string_ends, offset = section(HEADER.size, strings)
+        self.blob_offset = offset
+        offset += pad4(self.string_ends[-1] if strings else 0)
+        self.numbers, offset = section(offset, numbers, 'Q')
+        self.shape_starts, offset = section(offset, shapes + 1)
+        self.shape_words, offset = section(offset, shape_words)
+        self.records, offset = section(offset, 3 * records)
+        self.children, offset = section(offset, children)
+        self.root_table, offset = section(offset, 2 * roots)
+        self.string_cache = {}
+        self.shape_cache = {}
+        self.root_cache = None
+
+    @classmethod
+    def open(cls, path):
+        """Map the pack file at path read-only."""
+        with open(path, 'rb') as source:
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped)
+
+    def close(self):
+        """Release the views and the mapping, if there is one."""
+        for view in self.views + [self.view]:
+            view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def string(self, index):
+        """Return string index of the string table."""
+        text = self.string_cache.get(index)
+        if text is None:
+            start = self.blob_offset + (self.string_ends[index - 1] if index else 0)
+            text = str(self.view[start:self.blob_offset + self.string_ends[index]], 'utf-8')
+            self.string_cache[index] = text
+        return text
+
+    def shape(self, index):
+        """Return (class name, field names) of shape index."""
+        shape = self.shape_cache.get(index)
+        if shape is None:
+            words = [self.string(word) for word in self.shape_words[self.shape_starts[index]:self.shape_starts[index + 1]]]
+            shape = self.shape_cache[index] = (words[0], words[1:])
+        return shape
+
+    def roots(self):
+        """Return the names of the roots, in the order they were added."""
+        return [self.string(self.root_table[i]) for i in range(0, len(self.root_table), 2)]
+
+    def root_index(self, name):
+        """Return the value index of root name."""
+        if self.root_cache is None:
+            self.root_cache = {
+                self.string(self.root_table[i]): self.root_table[i + 1]
+                for i in range(0, len(self.root_table), 2)
+            }
+        return self.root_cache[name]
+
+    def __getitem__(self, name):
+        """Return a lazy view of root name."""
+        return self.value(self.root_index(name))
+
+    def value(self, index):
+        """Return value index: a Python scalar, or an IRList or IRNode view."""
+        if not 0 <= 3 * index < len(self.records):
+            raise IRPackError('bad value index {}'.format(index))
+        word, count, payload = self.records[3 * index:3 * index + 3]
+        tag = word >> TAG_SHIFT
+        if tag == TAG_NODE:
+            return IRNode(self, index, word & SHAPE_MASK, payload)
+        elif tag == TAG_STR:
+            return self.string(payload)
+        elif tag == TAG_LIST:
+            return IRList(self, index, payload, count)
+        elif tag == TAG_INT:
+            bits = self.numbers[payload]
+            return bits - (1 << 64) if bits >= 1 << 63 else bits
+        elif tag == TAG_FLOAT:
+            return bits_float(self.numbers[payload])
+        elif tag == TAG_NONE:
+            return None
+        elif tag == TAG_FALSE:
+            return False
+        elif tag == TAG_TRUE:
+            return True
+        elif tag == TAG_BIGINT:
+            return int(self.string(payload))
+        raise IRPackError('bad tag {}'.format(tag))
+
+    def materialize(self, value):
+        """Turn a view (or a root name) back into the objast it encodes, without recursion."""
+        if isinstance(value, str):
+            value = self[value]
+        if not isinstance(value, (IRList, IRNode)):
+            return value
+
+        records, children, value_of, shape_of = self.records, self.children, self.value, self.shape
+        root = [None]
+        # (container, key, index): decode value index into container[key]
+        stack = [(root, 0, value.index)]
+        while stack:
+            container, key, index = stack.pop()
+            word, count, payload = records[3 * index:3 * index + 3]
+            tag = word >> TAG_SHIFT
+            if tag == TAG_LIST:
+                result = [None] * count
+                stack.extend((result, i, children[payload + i]) for i in range(count))
+            elif tag == TAG_NODE:
+                name, fields = shape_of(word & SHAPE_MASK)
+                inner = dict.fromkeys(fields)
+                stack.extend((inner, field, children[payload + i]) for i, field in enumerate(fields))
+                result = {name: inner}
+            else:
+                result = value_of(index)
+            container[key] = result
+        return root[0]
+
+def pack(roots):
+    """Encode a mapping of names to objast values as pack bytes."""
+    writer = IRPackWriter()
+    for name, value in roots.items():
+        writer.add_root(name, value)
+    return writer.to_bytes()
+
+def write(path, roots):
+    """Write a mapping of names to objast values to a pack file."""
+    with open(path, 'wb') as sink:
+        sink.write(pack(roots))
+
+def module_roots(source, positions=False):
+    """
+        Map each top-level function and class method in source to its
+        FunctionDef objast, methods without self, as add_module indexes them.
+    """
+    return {
+        func.name: {'FunctionDef': func.astfunc}
+        for func in ctxmathparse.functions_from_module(ctxmathparse.objectify_string(source, positions))
+    }
+
+def load_functions(library, names=None):
+    """
+        Return MathParseFunction objects for names (default: every root) of
+        a pack, materializing only those functions.
+    """
+    return [
+        ctxmathparse.MathParseFunction(library.materialize(name)['FunctionDef'])
+        for name in (library.roots() if names is None else names)
+    ]
+
+def main():
+    """Pack the functions of a Python module, or list a pack's roots."""
+    parser = argparse.ArgumentParser(description='Pack translator IR for fast loading.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create = subparsers.add_parser('create')
+    create.add_argument('source')
+    create.add_argument('output')
+    create.add_argument('--positions', action='store_true')
+    show = subparsers.add_parser('list')
+    show.add_argument('pack')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        with open(args.source) as source:
+            roots = module_roots(source.read(), args.positions)
+        data = pack(roots)
+        with open(args.output, 'wb') as sink:
+            sink.write(data)
+        print('{} functions, {} bytes'.format(len(roots), len(data)))
+    else:
+        with IRPack.open(args.pack) as library:
+            for name in library.roots():
+                print(name)
+
+if __name__ == '__main__':
+    main()
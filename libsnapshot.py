@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+"""
+    Precompile the A396 statistical library into a versioned snapshot so
+    translators do not re-parse and re-translate it on every run.
+
+    The build step (python libsnapshot.py build) writes an irpack file with
+    each library function's objast, for linking into callers, and its
+    finished translation with and without minimal parentheses. The snapshot
+    is stamped with hashes of the library source and of the translator
+    modules; when either changes it is stale and is ignored until rebuilt.
+
+    LibrarySnapshot opens nothing until a library function is first
+    referenced, and then maps the file and decodes only that function, so
+    startup does not depend on the library's size.
+"""
+
+import argparse
+import hashlib
+import os
+
+import ctxmathparse
+import irpack
+
+SNAPSHOT_FORMAT = 1
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LIBRARY_SOURCE = os.path.join(HERE, 'A396.py')
+DEFAULT_PATH = os.path.join(HERE, 'A396.snapshot')
+TRANSLATOR_MODULES = ('ctxmathparse.py', 'mathparse.py', 'formulaparse.py', 'irpack.py')
+
+LIBRARY_FUNCTIONS = ('tquantile', 'erf_appx', 'normdev_appx', 'ltqnorm')
+
+class SnapshotError(ValueError):
+    """The snapshot is missing, unreadable, or built from other sources."""
+
+def file_digest(paths):
+    """Return the SHA-1 of the concatenated contents of paths."""
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+def current_version(source_path=LIBRARY_SOURCE):
+    """Return the version stamp a snapshot of source_path built now would carry."""
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'source': file_digest([source_path]),
+        'translator': file_digest([os.path.join(HERE, module) for module in TRANSLATOR_MODULES]),
+    }
+
+def fields_root(name, minimal_parentheses):
+    """Name the snapshot root holding a function's translation."""
+    return 'fields:{}:{}'.format(name, 'minimal' if minimal_parentheses else 'full')
+
+def build(source_path=LIBRARY_SOURCE, output=DEFAULT_PATH, functions=LIBRARY_FUNCTIONS):
+    """Translate functions of source_path and write the snapshot to output."""
+    with open(source_path) as source:
+        text = source.read()
+    roots = {'version': {'Snapshot': current_version(source_path)}}
+    for name, function in irpack.module_roots(text).items():
+        roots['function:' + name] = function
+    for minimal_parentheses in (False, True):
+        for name in functions:
+            mathparse = ctxmathparse.MathParse(minimal_parentheses=minimal_parentheses)
+            mathparse.add_module(text)
+            roots[fields_root(name, minimal_parentheses)] = {'Fields': mathparse.link([name])}
+    irpack.write(output, roots)
+    return roots
+
+class LibrarySnapshot:
+    """
+        A lazily opened snapshot, usable as MathParse's library. Nothing is
+        read until a function is looked up; functions and translations are
+        decoded on first use and cached. With missing_ok, a snapshot that
+        is absent or stale acts as an empty library instead of raising.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, source_path=LIBRARY_SOURCE, check_version=True, missing_ok=False):
+        self.path = path
+        self.source_path = source_path
+        self.check_version = check_version
+        self.missing_ok = missing_ok
+        self.error = None
+        self.pack = None
+        self.names = None
+        self.functions = {}
+        self.translations = {}
+
+    def open(self):
+        """Map the snapshot and check its version, once; returns None for a missing_ok failure."""
+        if self.names is None:
+            try:
+                pack = irpack.IRPack.open(self.path)
+            except (OSError, ValueError) as e:
+                return self.failed(SnapshotError('cannot read {}: {}'.format(self.path, e)))
+            version = pack.materialize('version')['Snapshot']
+            if self.check_version and version != current_version(self.source_path):
+                pack.close()
+                return self.failed(SnapshotError('{} is stale; rebuild it with libsnapshot.py build'.format(self.path)))
+            self.names = frozenset(
+                root[len('function:'):] for root in pack.roots() if root.startswith('function:')
+            )
+            self.pack = pack
+        return self.pack
+
+    def failed(self, error):
+        """Raise error, or with missing_ok remember that there is no library."""
+        if not self.missing_ok:
+            raise error
+        self.error = error
+        self.names = frozenset()
+        return None
+
+    def available(self):
+        """Return whether the snapshot could be opened."""
+        self.open()
+        return self.pack is not None
+
+    def close(self):
+        """Unmap the snapshot; it is reopened if used again."""
+        if self.pack is not None:
+            self.pack.close()
+            self.pack = None
+            self.names = None
+
+    def __contains__(self, name):
+        self.open()
+        return name in self.names
+
+    def function(self, name):
+        """Return a fresh MathParseFunction for library function name."""
+        if name not in self.functions:
+            if name not in self:
+                raise KeyError(name)
+            self.functions[name] = self.pack.materialize('function:' + name)['FunctionDef']
+        return ctxmathparse.MathParseFunction(self.functions[name])
+
+    def fields(self, name, minimal_parentheses=False):
+        """Return the precompiled translation of name, or None if only its objast was kept."""
+        key = fields_root(name, minimal_parentheses)
+        if key not in self.translations:
+            try:
+                self.translations[key] = self.open().materialize(key)['Fields']
+            except (KeyError, AttributeError):
+                self.translations[key] = None
+        translation = self.translations[key]
+        return None if translation is None else dict(translation)
+
+class SourceLibrary:
+    """
+        The library parsed from its source, usable as MathParse's library
+        where the snapshot is missing or stale. It has no precompiled
+        translations, so every function it supplies is translated.
+    """
+
+    def __init__(self, source_path=LIBRARY_SOURCE):
+        self.source_path = source_path
+        with open(source_path) as source:
+            functions = ctxmathparse.functions_from_module(ctxmathparse.objectify_string(source.read()))
+        self.functions = {func.name: func.astfunc for func in functions}
+
+    def __contains__(self, name):
+        return name in self.functions
+
+    def function(self, name):
+        """Return a fresh MathParseFunction for library function name."""
+        return ctxmathparse.MathParseFunction(self.functions[name])
+
+    def fields(self, name, minimal_parentheses=False):
+        """Return None: there is no precompiled translation."""
+        return None
+
+DEFAULT_LIBRARY = None
+SOURCE_LIBRARY = None
+
+def default_library():
+    """Return this process's shared snapshot of DEFAULT_PATH, tolerating its absence."""
+    global DEFAULT_LIBRARY
+    if DEFAULT_LIBRARY is None:
+        DEFAULT_LIBRARY = LibrarySnapshot(missing_ok=True)
+    return DEFAULT_LIBRARY
+
+def current_library():
+    """
+        Return the shared snapshot if it is present and current, otherwise
+        this process's SourceLibrary of A396.py, parsed on first use.
+    """
+    global SOURCE_LIBRARY
+    library = default_library()
+    if library.available():
+        return library
+    if SOURCE_LIBRARY is None:
+        SOURCE_LIBRARY = SourceLibrary()
+    return SOURCE_LIBRARY
+
+def library_mathparse(**options):
+    """
+        Return a MathParse that can link the A396 library: through the
+        snapshot when it is present and current, otherwise by parsing
+        A396.py as before.
+    """
+    library = default_library()
+    if library.available():
+        return ctxmathparse.MathParse(library=library, **options)
+    mathparse = ctxmathparse.MathParse(**options)
+    with open(LIBRARY_SOURCE) as source:
+        mathparse.add_module(source.read())
+    return mathparse
+
+def main():
+    """Build or check the snapshot."""
+    parser = argparse.ArgumentParser(description='Precompile the A396 library snapshot.')
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--output', default=DEFAULT_PATH)
+    args = parser.parse_args()
+    if args.command == 'build':
+        roots = build(output=args.output)
+        print('{}: {} roots, {} bytes'.format(args.output, len(roots), os.path.getsize(args.output)))
+    else:
+        try:
+            LibrarySnapshot(args.output).open()
+        except SnapshotError as e:
+            parser.exit(1, '{}\n'.format(e))
+        print('{} is current'.format(args.output))
+
+if __name__ == '__main__':
+    main()
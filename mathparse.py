@@ -61,6 +61,32 @@ class YieldingVisitor:
 class SymbolFinderVisitor(YieldingVisitor):
     """Traverse an AST expression for symbols."""
 
+    @classmethod
+    def find_symbols(cls, expr):
+        """
+            Collect the names read in expr, visiting each node object once:
+            after forward substitution one node is reached along every path
+            that read its variable, and walking each path would take time
+            exponential in the number of statements.
+        """
+        symbols = set()
+        seen = set()
+        stack = [expr]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            if isinstance(node, ast.Name):
+                symbols.add(node.id)
+            elif isinstance(node, ast.Call):
+                stack.extend(node.args) # function names are not symbols
+            elif isinstance(node, ast.AST):
+                stack.extend(ast.iter_child_nodes(node))
+            elif isinstance(node, list):
+                stack.extend(node)
+        return symbols
+
     @staticmethod
     def visit_name(node):
         """Fetch the symbol from a name node."""
@@ -71,8 +97,63 @@ class SymbolFinderVisitor(YieldingVisitor):
         """Skip function names but look at argument lists."""
         yield cls.visit(node.args)
 
+class RenderMemo:
+    """
+        Rendered strings of AST node objects, for one render session. After
+        forward substitution the same node object appears wherever its
+        variable was read, so remembering its rendering by identity renders
+        each shared subtree once. Nodes are kept alive so their ids are not
+        reused. The memo does not notice nodes changing: invalidate a node
+        (and whatever contains it) after modifying it, or everything.
+    """
+
+    def __init__(self):
+        self.rendered = {}
+
+    def __len__(self):
+        return len(self.rendered)
+
+    def get(self, node):
+        """Return the rendering of node, or None."""
+        entry = self.rendered.get(id(node))
+        return None if entry is None else entry[1]
+
+    def put(self, node, rendering):
+        """Remember and return the rendering of node."""
+        self.rendered[id(node)] = (node, rendering)
+        return rendering
+
+    def invalidate(self, node=None):
+        """Forget the rendering of node, or with no node of everything."""
+        if node is None:
+            self.rendered.clear()
+        else:
+            self.rendered.pop(id(node), None)
+
 class TranslatorVisitor(YieldingVisitor):
-    """Convert an AST into a Tableau string."""
+    """
+        Convert an AST into a Tableau string. The class renders every node
+        from scratch; session() gives a variant that renders each node
+        object once.
+    """
+
+    memo = None
+
+    @classmethod
+    def session(cls, memo=None):
+        """Return a TranslatorVisitor whose renderings are memoized in memo (a new RenderMemo)."""
+        return type(cls.__name__, (cls,), {'memo': RenderMemo() if memo is None else memo})
+
+    @classmethod
+    def visit(cls, node):
+        """Visit a node, rendering it only if the session has not already."""
+        if cls.memo is None or not isinstance(node, ast.AST):
+            yield from super().visit(node)
+            return
+        rendering = cls.memo.get(node)
+        if rendering is None:
+            rendering = cls.memo.put(node, cls.return_string(super().visit(node)))
+        yield rendering
 
     @classmethod
     def return_string(cls, generator):
@@ -90,6 +171,11 @@ class TranslatorVisitor(YieldingVisitor):
         """Translate a number node."""
         yield str(node.n)
 
+    @staticmethod
+    def visit_constant(node):
+        """Translate a constant node (what numbers parse to since Python 3.8)."""
+        yield str(node.value)
+
     @staticmethod
     def binop_token(operator):
         """Lookup the operator's token."""
@@ -111,6 +197,14 @@ class TranslatorVisitor(YieldingVisitor):
             cls.return_string(cls.visit(node.right))
         )
 
+    @classmethod
+    def visit_unaryop(cls, node):
+        """Render a negation."""
+        yield '{}{}'.format(
+            {'USub': '-', 'UAdd': '+', 'Not': 'NOT '}[node.op.__class__.__name__],
+            cls.return_string(cls.visit(node.operand))
+        )
+
     @classmethod
     def visit_call(cls, node):
         """Render a call."""
@@ -130,10 +224,366 @@ class TranslatorVisitor(YieldingVisitor):
     def visit_subscript(cls, node):
         """Render a subscript."""
         if isinstance(node.value, ast.List):
-            yield cls.visit(node.value.elts[node.slice.value.n])
+            yield cls.visit(node.value.elts[subscript_index(node)])
         else:
             raise ValueError("don't know how to subscript {}".format(node.value.__class__.__name__))
 
+def subscript_index(node):
+    """Return the constant index of a subscript, with or without the pre-3.9 Index wrapper."""
+    index = node.slice.value if isinstance(node.slice, ast.Index) else node.slice
+    return index.n if isinstance(index, ast.Num) else index.value
+
+# Binding strength of each operator in the rendered formula, loosest first.
+# Negation and exponentiation share a level so that either nested inside the
+# other is always parenthesized: Tableau and Python disagree about -x^2.
+PRECEDENCE = {
+    'Or': 1,
+    'And': 2,
+    'Not': 3,
+    'Compare': 4,
+    'Add': 5,
+    'Sub': 5,
+    'Mult': 6,
+    'Div': 6,
+    'Mod': 6,
+    'USub': 7,
+    'UAdd': 7,
+    'Pow': 7,
+    'Atom': 9,
+}
+
+def needs_parentheses(parent, child, right=False):
+    """
+        Decide whether an operand of precedence child must be parenthesized
+        under an operator of precedence parent. Operators are left-associative
+        except exponentiation, comparison and the unary operators, whose
+        operands count as right operands.
+    """
+    if child != parent:
+        return child < parent
+    return right or parent in (PRECEDENCE['Pow'], PRECEDENCE['Compare'])
+
+class PrecedenceRenderer:
+    """
+        Render an expression AST with only the parentheses that precedence and
+        associativity require. Nodes are expanded with an explicit stack into
+        a single list of pieces joined once, so rendering is linear in the
+        size of the output and does not recurse on deep trees. With a
+        RenderMemo, each node object is expanded once and its rendering
+        reused wherever it appears again.
+    """
+
+    def __init__(self, name_format='[_{}]', memo=None):
+        """Set how symbol names are rendered, and optionally the memo to render with."""
+        self.name_format = name_format
+        self.memo = memo
+
+    def render(self, node):
+        """Render node to a string."""
+        if self.memo is None:
+            pieces = []
+            stack = [node]
+            while stack:
+                item = stack.pop()
+                if isinstance(item, str):
+                    pieces.append(item)
+                else:
+                    stack.extend(reversed(self.expand(item)))
+            return ''.join(pieces)
+
+        # (node, start) marks where node's pieces began, to join and remember them once done
+        pieces = []
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                pieces.append(item)
+            elif isinstance(item, tuple):
+                done, start = item
+                pieces[start:] = [self.memo.put(done, ''.join(pieces[start:]))]
+            else:
+                rendering = self.memo.get(item)
+                if rendering is not None:
+                    pieces.append(rendering)
+                else:
+                    stack.append((item, len(pieces)))
+                    stack.extend(reversed(self.expand(item)))
+        return ''.join(pieces)
+
+    def expand(self, node):
+        """Return the strings and child nodes making up node, in output order."""
+        return getattr(self, 'expand_' + node.__class__.__name__.lower())(node)
+
+    @staticmethod
+    def binop_token(operator):
+        """Lookup the operator's token."""
+        return TranslatorVisitor.binop_token(operator)
+
+    @staticmethod
+    def precedence(node):
+        """Return how tightly the rendered node binds."""
+        if isinstance(node, ast.BinOp):
+            return PRECEDENCE[node.op.__class__.__name__]
+        elif isinstance(node, ast.UnaryOp):
+            return PRECEDENCE[node.op.__class__.__name__]
+        elif isinstance(node, ast.Compare):
+            return PRECEDENCE['And'] if len(node.ops) > 1 else PRECEDENCE['Compare']
+        elif isinstance(node, ast.BoolOp):
+            return PRECEDENCE[node.op.__class__.__name__]
+        elif isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool) and node.value < 0:
+            return PRECEDENCE['USub']
+        return PRECEDENCE['Atom']
+
+    def operand(self, node, parent, right=False):
+        """Return node as an operand of an operator of precedence parent."""
+        if needs_parentheses(parent, self.precedence(node), right):
+            return ['(', node, ')']
+        return [node]
+
+    def expand_expr(self, node):
+        """Render an expression statement."""
+        return [node.value]
+
+    def expand_name(self, node):
+        """Render a name."""
+        return [self.name_format.format(node.id)]
+
+    @staticmethod
+    def expand_num(node):
+        """Render a number."""
+        return [str(node.n)]
+
+    @staticmethod
+    def expand_constant(node):
+        """Render a constant."""
+        return [str(node.value)]
+
+    def expand_binop(self, node):
+        """Render a binary operation."""
+        precedence = self.precedence(node)
+        return (
+            self.operand(node.left, precedence) +
+            [' {} '.format(self.binop_token(node.op))] +
+            self.operand(node.right, precedence, True)
+        )
+
+    def expand_unaryop(self, node):
+        """Render a unary operation."""
+        token = {'USub': '-', 'UAdd': '+', 'Not': 'NOT '}[node.op.__class__.__name__]
+        return [token] + self.operand(node.operand, self.precedence(node), True)
+
+    def expand_compare(self, node):
+        """Render a comparison; chains become a conjunction of pairwise comparisons."""
+        pieces = []
+        left = node.left
+        for cmpop, right in zip(node.ops, node.comparators):
+            if pieces:
+                pieces.append(' AND ')
+            pieces.extend(self.operand(left, PRECEDENCE['Compare']))
+            pieces.append(' {} '.format(CMPOP_TOKENS[cmpop.__class__.__name__]))
+            pieces.extend(self.operand(right, PRECEDENCE['Compare'], True))
+            left = right
+        return pieces
+
+    def expand_boolop(self, node):
+        """Render AND/OR over all the values."""
+        precedence = self.precedence(node)
+        token = ' {} '.format(node.op.__class__.__name__.upper())
+        pieces = []
+        for i, value in enumerate(node.values):
+            if i:
+                pieces.append(token)
+            pieces.extend(self.operand(value, precedence, i > 0))
+        return pieces
+
+    def separated(self, nodes, separator=', '):
+        """Interleave nodes with a separator."""
+        pieces = []
+        for i, node in enumerate(nodes):
+            if i:
+                pieces.append(separator)
+            pieces.append(node)
+        return pieces
+
+    def expand_call(self, node):
+        """Render a call."""
+        return ['{}('.format(node.func.id)] + self.separated(node.args) + [')']
+
+    def expand_list(self, node):
+        """Render a list."""
+        return ['['] + self.separated(node.elts) + [']']
+
+    def expand_subscript(self, node):
+        """Render a constant subscript of a list literal as the element itself."""
+        if isinstance(node.value, ast.List):
+            element = node.value.elts[subscript_index(node)]
+            return self.operand(element, PRECEDENCE['Atom'] - 1)
+        raise ValueError("don't know how to subscript {}".format(node.value.__class__.__name__))
+
+CMPOP_TOKENS = {
+    'Lt': '<',
+    'LtE': '<=',
+    'Gt': '>',
+    'GtE': '>=',
+    'Eq': '==',
+    'NotEq': '!=',
+}
+
+ASSOCIATIVE_OPERATORS = (ast.Add, ast.Mult)
+
+def set_slot(container, key, value):
+    """Store value at a list index or node field."""
+    if isinstance(container, list):
+        container[key] = value
+    else:
+        setattr(container, key, value)
+
+def get_slot(container, key):
+    """Fetch the value at a list index or node field."""
+    if isinstance(container, list):
+        return container[key]
+    return getattr(container, key)
+
+def flatten_chain(node, left_only=False, shared=()):
+    """
+        Return the operands of a chain of one associative operator, left to
+        right. With left_only, parenthesized groups on the right are kept whole;
+        so are nodes whose ids are in shared.
+    """
+    op_class = node.op.__class__
+    top = node
+
+    def links(item):
+        return item is top or (
+            isinstance(item, ast.BinOp) and isinstance(item.op, op_class) and id(item) not in shared
+        )
+
+    if left_only:
+        operands = []
+        while links(node):
+            operands.append(node.right)
+            node = node.left
+        operands.append(node)
+        return operands[::-1]
+
+    operands = []
+    pending = [node]
+    while pending:
+        item = pending.pop()
+        if links(item):
+            pending.append(item.right)
+            pending.append(item.left)
+        else:
+            operands.append(item)
+    return operands
+
+def build_balanced(operands, op_class, lo=0, hi=None):
+    """Combine operands[lo:hi] with op_class into a tree of logarithmic depth."""
+    if hi is None:
+        hi = len(operands)
+    if hi - lo == 1:
+        return operands[lo]
+    mid = (lo + hi) // 2
+    return ast.BinOp(
+        left=build_balanced(operands, op_class, lo, mid),
+        op=op_class(),
+        right=build_balanced(operands, op_class, mid, hi)
+    )
+
+def build_left_deep(operands, op_class):
+    """Combine operands with op_class the way Python parses a chain."""
+    tree = operands[0]
+    for operand in operands[1:]:
+        tree = ast.BinOp(left=tree, op=op_class(), right=operand)
+    return tree
+
+def is_exact_operand(node):
+    """Integer literals are the only operands whose sums and products never round."""
+    return isinstance(node, ast.Constant) and type(node.value) is int
+
+def shared_nodes(expr):
+    """
+        Return the ids of the node objects reached from more than one parent
+        in expr, as forward substitution leaves them, and a list of every
+        node to keep them alive. Each node is visited once.
+    """
+    parents = {id(expr): 0}
+    nodes = [expr]
+    stack = [expr]
+    while stack:
+        for child in ast.iter_child_nodes(stack.pop()):
+            if id(child) not in parents:
+                parents[id(child)] = 0
+                nodes.append(child)
+                stack.append(child)
+            parents[id(child)] += 1
+    return frozenset(key for key, count in parents.items() if count > 1), nodes
+
+def reassociate(expr, strict_fp=False):
+    """
+        Rebuild every chain of + or * in expr as a balanced tree, so that a
+        chain of n terms is log(n) deep rather than n. Reassociating changes
+        floating point rounding, so with strict_fp only chains made entirely
+        of integer literals are rebalanced and all others keep Python's
+        left-to-right grouping. Since fold_expression already collapses
+        those chains to a constant, strict mode leaves translator output as
+        it was; it is there so callers can ask for reassociation either way.
+
+        A node object shared by several parents, as substitution_wrapper
+        shares them, is rebuilt once and stays shared, and chains are not
+        flattened through it, so the work follows the distinct nodes rather
+        than the paths to them. The traversal uses an explicit stack so it
+        never recurses down the chains it is flattening.
+    """
+    shared, alive = shared_nodes(expr)
+    # id of each node already handled -> (node, what replaced it)
+    done = {}
+    root = [expr]
+    stack = [(root, 0)]
+    while stack:
+        item = stack.pop()
+        if len(item) == 4:
+            container, key, operands, op_class = item
+            if strict_fp and not all(is_exact_operand(operand) for operand in operands):
+                chain = build_left_deep(operands, op_class)
+            else:
+                chain = build_balanced(operands, op_class)
+            original = get_slot(container, key)
+            chain = ast.copy_location(chain, original)
+            done[id(original)] = (original, chain)
+            set_slot(container, key, chain)
+            continue
+
+        container, key = item
+        node = get_slot(container, key)
+        if id(node) in done:
+            set_slot(container, key, done[id(node)][1])
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ASSOCIATIVE_OPERATORS):
+            operands = flatten_chain(node, strict_fp, shared)
+            stack.append((container, key, operands, node.op.__class__))
+            stack.extend((operands, i) for i in range(len(operands)))
+        elif isinstance(node, ast.AST):
+            done[id(node)] = (node, node)
+            for field, value in ast.iter_fields(node):
+                if isinstance(value, list):
+                    stack.extend(
+                        (value, i) for i, item in enumerate(value) if isinstance(item, ast.AST)
+                    )
+                elif isinstance(value, ast.AST):
+                    stack.append((node, field))
+    return root[0]
+
+def expression_depth(expr):
+    """Measure the nesting depth of an expression tree without recursing."""
+    deepest = 0
+    stack = [(expr, 1)]
+    while stack:
+        node, depth = stack.pop()
+        deepest = max(deepest, depth)
+        stack.extend((child, depth + 1) for child in ast.iter_child_nodes(node))
+    return deepest
+
 class StaticMathParse:
     """StaticMathParse holds testable stateless functions used in a MathParse context."""
 
@@ -143,6 +593,57 @@ class StaticMathParse:
         for stmt in module.body:
             yield stmt
 
+    @staticmethod
+    def split_assignments(stmts):
+        """
+            Rewrite tuple assignments (a, b = x, y) and chained assignments
+            (a = b = x) as one single-target Assign per name, so each name
+            gets its own statement. Chained names after the first copy the
+            first rather than repeat its value. When a tuple's values read a
+            name the same statement assigns, they are first copied to
+            temporaries _elt_<line>_<k> so every value sees the old bindings.
+            Other statements, including unpacking a call, pass through.
+        """
+        for stmt in stmts:
+            if not isinstance(stmt, ast.Assign):
+                yield stmt
+            elif isinstance(stmt.targets[0], ast.Tuple) and isinstance(stmt.value, (ast.Tuple, ast.List)) \
+                    and len(stmt.targets) == 1 and len(stmt.targets[0].elts) == len(stmt.value.elts) \
+                    and all(isinstance(target, ast.Name) for target in stmt.targets[0].elts):
+                names = [target.id for target in stmt.targets[0].elts]
+                values = stmt.value.elts
+                if set(names) & set().union(*[SymbolFinderVisitor.find_symbols(value) for value in values]):
+                    temporaries = ['_elt_{}_{}'.format(stmt.lineno, k) for k in range(len(names))]
+                    for temporary, value in zip(temporaries, values):
+                        yield ast.copy_location(
+                            ast.Assign(targets=[ast.Name(id=temporary, ctx=ast.Store())], value=value), stmt
+                        )
+                    values = [ast.Name(id=temporary, ctx=ast.Load()) for temporary in temporaries]
+                for name, value in zip(names, values):
+                    yield ast.copy_location(
+                        ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())], value=value), stmt
+                    )
+            elif len(stmt.targets) > 1 and all(isinstance(target, ast.Name) for target in stmt.targets):
+                first = stmt.targets[0]
+                yield ast.copy_location(ast.Assign(targets=[first], value=stmt.value), stmt)
+                for target in stmt.targets[1:]:
+                    yield ast.copy_location(
+                        ast.Assign(targets=[target], value=ast.Name(id=first.id, ctx=ast.Load())), stmt
+                    )
+            else:
+                yield stmt
+
+    @staticmethod
+    def output_expressions(name, stmt):
+        """
+            Map the output fields of a return statement to their expressions:
+            _<name> for a single value, _<name>_out_<k> for each element of a
+            returned tuple.
+        """
+        if isinstance(stmt.value, ast.Tuple):
+            return {'_{}_out_{}'.format(name, k): elt for k, elt in enumerate(stmt.value.elts)}
+        return {'_{}'.format(name): stmt.value}
+
     @staticmethod
     def find_rhs_symbols(stmt):
         """Given an ast.Statement, return symbols in the right-hand side."""
@@ -170,11 +671,26 @@ class StaticMathParse:
         return Context(stmt, cls)
 
     @staticmethod
-    def render_expression(expr):
-        """Convert an expression AST into a Tableau expression string."""
-        translator_visitor = TranslatorVisitor()
+    def render_expression(expr, minimal_parentheses=False, memo=None):
+        """
+            Convert an expression AST into a Tableau expression string, either
+            fully parenthesized or with only the parentheses it needs. Node
+            objects shared within expr, as substitution_wrapper leaves them,
+            are rendered once. Pass the same RenderMemo when rendering several
+            substituted statements so the subtrees they share are too.
+        """
+        if memo is None:
+            memo = RenderMemo()
+        if minimal_parentheses:
+            return PrecedenceRenderer(memo=memo).render(expr)
+        translator_visitor = TranslatorVisitor.session(memo)
         return translator_visitor.return_string(translator_visitor.visit(expr))
 
+    @staticmethod
+    def reassociate_expression(expr, strict_fp=False):
+        """Balance the sum and product chains in an expression AST (see reassociate)."""
+        return reassociate(expr, strict_fp)
+
     @staticmethod
     def find_substitution_context(symbol, context):
         """Figure out what context the symbol was defined in. -1 is not found."""
@@ -192,6 +708,8 @@ class StaticMathParse:
 
             def visit_Name(self, node):
                 """Lookup this name in the context and substitute if possible."""
+                if not isinstance(node.ctx, ast.Load):
+                    return node # assignment targets stay names
                 location = cls.find_substitution_context(node.id, context)
                 if location >= 0:
                     return context[location].statement.value
@@ -202,12 +720,65 @@ class StaticMathParse:
 
     @classmethod
     def substitution_wrapper(cls, stmts):
-        """Perform all possible forward-substitutions on this statement sequence."""
+        """
+            Perform all possible forward-substitutions on this statement
+            sequence. A statement is substituted before its own bindings join
+            the context, so x = x + 1 reads the previous x.
+        """
         ctx = [cls.update_context(next(stmts))]
         yield ctx[0].statement
         for stmt in stmts:
+            stmt = cls.context_substitute(stmt, ctx)
             ctx.append(cls.update_context(stmt))
-            yield cls.context_substitute(stmt, ctx)
+            yield stmt
+
+    @staticmethod
+    def assigned_names(stmt):
+        """
+            Return the names an assignment binds outright, or None if it is
+            not an assignment to plain names (a subscript, say), which has to
+            be treated as live.
+        """
+        if not isinstance(stmt, ast.Assign):
+            return None
+        names = set()
+        for target in stmt.targets:
+            elts = target.elts if isinstance(target, (ast.Tuple, ast.List)) else [target]
+            if not all(isinstance(elt, ast.Name) for elt in elts):
+                return None
+            names.update(elt.id for elt in elts)
+        return names
+
+    @classmethod
+    def eliminate_dead_stores(cls, stmts, outputs=None):
+        """
+            Drop the assignments whose values are never read, walking the
+            statements backwards with the set of live names.
+
+            After substitution_wrapper most intermediate bindings have been
+            absorbed into the statements that read them, so they are dead
+            unless they are outputs. outputs names the variables the caller
+            wants; None keeps the final binding of every name, as for a
+            module. Statements other than plain assignments (returns,
+            subscript stores) are always kept and the names they read are live.
+        """
+        stmts = list(stmts)
+        if outputs is None:
+            outputs = set().union(*[cls.assigned_names(stmt) or set() for stmt in stmts])
+        live = set(outputs)
+        kept = []
+        for stmt in reversed(stmts):
+            names = cls.assigned_names(stmt)
+            if names is None:
+                live |= SymbolFinderVisitor.find_symbols(stmt)
+            elif names & live:
+                live -= names
+                live |= cls.find_rhs_symbols(stmt)
+            else:
+                continue
+            kept.append(stmt)
+        kept.reverse()
+        return kept
 
 class MathParse:
     """MathParse turns Python functions into Tableau calculations.
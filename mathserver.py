@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+
+"""Serve ctxmathparse translations over HTTP/JSON to the editor front end."""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+
+import ctxmathparse
+import libsnapshot
+
+TRANSLATION_OPTIONS = ('minimal_parentheses', 'content_addressed', 'reassociate', 'eliminate_dead_stores')
+
+def translate_source(source, options=()):
+    """
+        Translate every function in source with ctxmathparse.MathParse,
+        linking calls to the A396 library: precompiled when its snapshot is
+        built and current, parsed from A396.py otherwise. This runs in a
+        worker process, so it takes and returns only plain data.
+    """
+    mathparse = ctxmathparse.MathParse(library=libsnapshot.current_library(), **dict(options))
+    mathparse.parse_string(source)
+    return mathparse.translate()
+
+def normalize_options(options):
+    """Turn a request's options into a hashable, order-independent key part."""
+    options = options or {}
+    if not isinstance(options, dict):
+        raise TypeError('options must be an object, not {}'.format(type(options).__name__))
+    for option, value in options.items():
+        if option not in TRANSLATION_OPTIONS:
+            raise ValueError('unknown option {}'.format(option))
+        if not isinstance(value, bool):
+            raise TypeError('option {} must be true or false, not {!r}'.format(option, value))
+    return tuple(sorted(options.items()))
+
+class Superseded(Exception):
+    """A newer request from the same editor session replaced this one."""
+
+class BadRequest(ValueError):
+    """The request could not be read, so the rest of the stream cannot be framed either."""
+
+class TranslationService:
+    """
+        Translate sources off the event loop, sharing work between requests.
+
+        Identical concurrent requests wait on a single translation, finished
+        translations are kept in an LRU cache, and a new request from an
+        editor session cancels that session's previous request if it is still
+        waiting. A cancelled request stops waiting, but the translation it
+        started keeps running for any other requests sharing it and is
+        cached when it completes; once no request waits on a translation
+        that the executor has not started yet, it is dropped instead.
+    """
+
+    def __init__(self, executor=None, cache_size=256, translator=translate_source):
+        """Set up the cache; executor None means a thread pool of the service's own."""
+        self.executor = executor
+        self.cache_size = cache_size
+        self.translator = translator
+        self.cache = collections.OrderedDict()
+        # key -> (executor future, asyncio future), and how many requests wait on each
+        self.pending = {}
+        self.waiters = collections.Counter()
+        self.sessions = {}
+        # requests cancelled because their session sent a newer one
+        self.superseded = set()
+        self.stats = collections.Counter()
+
+    def cache_get(self, key):
+        """Look up a finished translation, marking it recently used."""
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def cache_put(self, key, value):
+        """Store a finished translation, evicting the least recently used."""
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def start_translation(self, key):
+        """Return the shared future computing key, starting it if needed."""
+        if key not in self.pending:
+            self.stats['translations'] += 1
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor()
+            # submitted directly rather than through run_in_executor, so that
+            # release can tell a translation still queued from a running one
+            submitted = self.executor.submit(self.translator, *key)
+            future = asyncio.wrap_future(submitted)
+            self.pending[key] = (submitted, future)
+
+            def finished(done):
+                """Cache the result and forget the in-flight entry."""
+                if key in self.pending and self.pending[key][1] is done:
+                    del self.pending[key]
+                if not done.cancelled() and done.exception() is None:
+                    self.cache_put(key, done.result())
+
+            future.add_done_callback(finished)
+        else:
+            self.stats['coalesced'] += 1
+        return self.pending[key][1]
+
+    def release(self, key):
+        """Stop waiting on key's translation, cancelling it if nobody else waits and it has not started."""
+        self.waiters[key] -= 1
+        if self.waiters[key]:
+            return
+        del self.waiters[key]
+        if key in self.pending and self.pending[key][0].cancel():
+            self.stats['abandoned'] += 1
+            del self.pending[key]
+
+    async def translate(self, source, options=None, session=None):
+        """Translate source, superseding any earlier request from session."""
+        key = (source, normalize_options(options))
+        if key in self.cache:
+            self.stats['cache_hits'] += 1
+            return self.cache_get(key)
+
+        if session is not None:
+            previous = self.sessions.get(session)
+            if previous is not None and not previous.done():
+                self.stats['superseded'] += 1
+                self.superseded.add(previous)
+                previous.cancel()
+            self.sessions[session] = asyncio.current_task()
+
+        future = self.start_translation(key)
+        self.waiters[key] += 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # anything else cancelling the request, such as shutdown, goes on as cancellation
+            if asyncio.current_task() in self.superseded:
+                raise Superseded(session)
+            raise
+        finally:
+            self.superseded.discard(asyncio.current_task())
+            self.release(key)
+            if session is not None and self.sessions.get(session) is asyncio.current_task():
+                del self.sessions[session]
+
+class TranslationServer:
+    """A minimal HTTP/1.1 front end: POST /translate with {"source", "session", "options"}."""
+
+    def __init__(self, service):
+        self.service = service
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8396):
+        """Start listening; port 0 picks a free port."""
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Stop listening and wait for the listener to close."""
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    async def read_request(reader):
+        """
+            Read one request, returning (method, path, body) or None at end of
+            stream; raise BadRequest if the request line or length is malformed.
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        parts = request_line.decode('latin-1').split(' ', 2)
+        if len(parts) != 3:
+            raise BadRequest('malformed request line {!r}'.format(request_line[:80]))
+        method, path, _ = parts
+        length = 0
+        while True:
+            header = await reader.readline()
+            if header in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = header.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                value = value.strip()
+                if not value.isdigit():
+                    raise BadRequest('malformed Content-Length {!r}'.format(value[:80]))
+                length = int(value)
+        body = await reader.readexactly(length) if length else b''
+        return method, path, body
+
+    @staticmethod
+    def write_response(writer, status, payload):
+        """Send a JSON response."""
+        body = json.dumps(payload).encode('utf-8')
+        writer.write(
+            'HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+                status, len(body)
+            ).encode('latin-1') + body
+        )
+
+    async def respond(self, method, path, body):
+        """Route a request to the service, returning (status, payload)."""
+        if path == '/stats' and method == 'GET':
+            return '200 OK', dict(self.service.stats)
+        if path != '/translate' or method != 'POST':
+            return '404 Not Found', {'error': 'POST /translate'}
+        try:
+            request = json.loads(body.decode('utf-8'))
+            if not isinstance(request, dict):
+                raise TypeError('request must be an object, not {}'.format(type(request).__name__))
+            if not isinstance(request.get('source'), str):
+                raise TypeError('source must be a string')
+            if isinstance(request.get('session'), (list, dict)):
+                raise TypeError('session must be a string or number')
+            fields = await self.service.translate(
+                request['source'], request.get('options'), request.get('session')
+            )
+        except Superseded:
+            return '409 Conflict', {'error': 'superseded'}
+        except (ValueError, KeyError, TypeError, SyntaxError) as e:
+            return '400 Bad Request', {'error': '{}: {}'.format(e.__class__.__name__, e)}
+        except Exception as e: # e.g. RecursionError on a deeply nested source; the connection stays usable
+            return '500 Internal Server Error', {'error': '{}: {}'.format(e.__class__.__name__, e)}
+        return '200 OK', {'fields': fields}
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one keep-alive connection."""
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except BadRequest as e:
+                    self.write_response(writer, '400 Bad Request', {'error': 'BadRequest: {}'.format(e)})
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                self.write_response(writer, *await self.respond(*request))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(host, port, workers, cache_size):
+    """Run the server until interrupted."""
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        server = TranslationServer(TranslationService(executor, cache_size))
+        port = await server.start(host, port)
+        print('serving translations on http://{}:{}/translate'.format(host, port))
+        await server.server.serve_forever()
+
+def main():
+    """Parse the command line and serve."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8396)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache-size', type=int, default=256)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.workers, args.cache_size))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,573 @@
+#!/usr/bin/python3
+
+"""
+    Interval analysis over translated fields. Given the ranges a function's
+    arguments are declared to lie in, such as 0 < p < 1 and n >= 1, bound
+    what every field can evaluate to on a row and simplify whatever the
+    bounds decide: comparisons fold to TRUE or FALSE and the branches they
+    guard to one side, AND, OR and NOT fold, ABS of a value of known sign
+    becomes the value or its negation, SIGN becomes a constant, MIN and MAX
+    of separated values become one operand, and arithmetic on constants is
+    folded. Fields that only fed removed branches are dropped.
+
+    Bounds hold for the floating-point values SQL computes, not just for the
+    real results: an open bound is stored as the next float inside it, +,
+    -, * and / are bounded by applying the same operation to the bounds
+    (rounding is monotone), and library functions such as EXP are widened
+    by an ULP either way. NULL is tracked separately, so a comparison only
+    becomes a constant when neither side can be NULL, and dividing by a
+    range containing zero, which is NULL in SQL, makes the result nullable.
+    Declared arguments are taken to be non-NULL.
+
+    Rewrites never change what a row evaluates to while its arguments are
+    within the declared ranges; rows outside them may get other results.
+    The analysis is per field, not path-sensitive: a field computed for one
+    side of a branch is bounded over every row, not just the rows that take
+    the branch.
+
+    python rangeanalysis.py A396.py tquantile --range 'n >= 1' --range '0 < p < 1'
+    reports the per-row cost of the translation before and after.
+"""
+
+import argparse
+import math
+import re
+
+import costmodel
+import ctxmathparse
+import formulaparse
+
+INF = math.inf
+BOTH = frozenset([True, False])
+NEITHER = frozenset()
+
+class Range:
+    """
+        What a formula can evaluate to on a row: a number in [low, high]
+        (no number when low > high), one of truths, or NULL if nullable.
+        The default range is anything at all.
+    """
+
+    __slots__ = ('low', 'high', 'truths', 'nullable')
+
+    def __init__(self, low=-INF, high=INF, truths=BOTH, nullable=True):
+        self.low = low
+        self.high = high
+        self.truths = frozenset(truths)
+        self.nullable = nullable
+
+    @classmethod
+    def numbers(cls, low, high, nullable=False):
+        return cls(low, high, NEITHER, nullable)
+
+    @classmethod
+    def boolean(cls, truths, nullable=False):
+        return cls(INF, -INF, truths, nullable)
+
+    @property
+    def numeric(self):
+        """Whether the formula can be a number."""
+        return self.low <= self.high
+
+    def point(self):
+        """Return the one number the formula always evaluates to, or None."""
+        if self.low == self.high and not self.truths and not self.nullable and math.isfinite(self.low):
+            return self.low
+        return None
+
+    def decided(self):
+        """Return the one truth value the formula always evaluates to, or None."""
+        if len(self.truths) == 1 and not self.numeric and not self.nullable:
+            return next(iter(self.truths))
+        return None
+
+    def outcomes(self):
+        """Return the possible truth values, with None for NULL; a number may be either."""
+        outcomes = set(self.truths) if self.truths or not self.numeric else set(BOTH)
+        if self.nullable:
+            outcomes.add(None)
+        return outcomes
+
+    def union(self, other):
+        return Range(min(self.low, other.low), max(self.high, other.high),
+                     self.truths | other.truths, self.nullable or other.nullable)
+
+    def intersection(self, other):
+        return Range(max(self.low, other.low), min(self.high, other.high),
+                     self.truths & other.truths, self.nullable and other.nullable)
+
+    def __eq__(self, other):
+        return isinstance(other, Range) and all(
+            getattr(self, slot) == getattr(other, slot) for slot in self.__slots__
+        )
+
+    def __repr__(self):
+        return 'Range({!r}, {!r}, {}, {!r})'.format(self.low, self.high, set(self.truths) or 'set()', self.nullable)
+
+NULL_ONLY = Range(INF, -INF, NEITHER, True)
+
+def span(values, nullable):
+    """The numbers between the smallest and largest of values; a NaN among them is NULL in SQLite."""
+    if any(math.isnan(value) for value in values):
+        return Range.numbers(-INF, INF, True)
+    return Range.numbers(min(values), max(values), nullable)
+
+def outward(result, floor=-INF):
+    """Widen a numeric range by an ULP each way, for libm functions that may round either way."""
+    if not result.numeric:
+        return result
+    return Range.numbers(max(math.nextafter(result.low, -INF), floor), math.nextafter(result.high, INF),
+                         result.nullable)
+
+def guarded(function, value):
+    """Apply a math function to a bound, as infinity where it overflows and NaN outside its domain."""
+    try:
+        return function(value)
+    except OverflowError:
+        return INF
+    except ValueError:
+        return math.nan
+
+def power_bound(base, exponent):
+    """math.pow on bounds, with overflow signed like the true result."""
+    try:
+        return math.pow(base, exponent)
+    except OverflowError:
+        return -INF if base < 0 and exponent % 2 == 1 else INF
+    except ValueError:
+        return math.nan
+
+def negate(a):
+    return Range.numbers(-a.high, -a.low, a.nullable) if a.numeric else Range.numbers(INF, -INF, a.nullable)
+
+def arithmetic(op, a, b):
+    """Bound a + b, a - b, a * b, a / b or a % b."""
+    nullable = a.nullable or b.nullable
+    if not (a.numeric and b.numeric):
+        return Range.numbers(INF, -INF, nullable)
+    if op == '+':
+        return span([a.low + b.low, a.high + b.high], nullable)
+    elif op == '-':
+        return span([a.low - b.high, a.high - b.low], nullable)
+    elif op == '*':
+        return span([x * y for x in (a.low, a.high) for y in (b.low, b.high)], nullable)
+    elif b.low <= 0 <= b.high:
+        # division by zero is NULL
+        return Range.numbers(-INF, INF, True)
+    elif op == '/':
+        return span([x / y for x in (a.low, a.high) for y in (b.low, b.high)], nullable)
+    return Range.numbers(-INF, INF, nullable)
+
+def power(a, b):
+    """Bound a ^ b, exactly for integer exponents of any base and otherwise only for bases above zero."""
+    nullable = a.nullable or b.nullable
+    if not (a.numeric and b.numeric):
+        return Range.numbers(INF, -INF, nullable)
+    if b.low == b.high and math.isfinite(b.low) and b.low.is_integer():
+        k = b.low
+        if k == 0:
+            return Range.numbers(1.0, 1.0, nullable)
+        if k < 0 and a.low <= 0 <= a.high:
+            return Range.numbers(-INF, INF, True)
+        bounds = [power_bound(a.low, k), power_bound(a.high, k)]
+        even = k % 2 == 0
+        if even and a.low < 0 < a.high:
+            bounds.append(0.0)
+        return outward(span(bounds, nullable), 0.0 if even or a.low >= 0 else -INF)
+    if a.low > 0 or (a.low == 0 and b.low > 0):
+        return outward(span([power_bound(x, y) for x in (a.low, a.high) for y in (b.low, b.high)], nullable), 0.0)
+    return Range.numbers(-INF, INF, True)
+
+def monotone(function, floor=-INF, exact=False):
+    """Bound a one-argument function that never decreases, defined everywhere."""
+    def bound(a):
+        result = Range.numbers(guarded(function, a.low), guarded(function, a.high), a.nullable) \
+            if a.numeric else Range.numbers(INF, -INF, a.nullable)
+        return result if exact else outward(result, floor)
+    return bound
+
+def domain(function, low, strict, exact=False):
+    """Bound a one-argument non-decreasing function that is NULL below low (or at it, if strict)."""
+    def bound(a):
+        outside = a.low < low or (strict and a.low == low)
+        inside_low = math.nextafter(low, INF) if strict else low
+        if not a.numeric or a.high < inside_low:
+            return Range.numbers(INF, -INF, True)
+        result = Range.numbers(guarded(function, max(a.low, inside_low)), guarded(function, a.high),
+                               a.nullable or outside)
+        return result if exact else outward(result)
+    return bound
+
+def sign(a):
+    signum = lambda value: float((value > 0) - (value < 0))
+    if not a.numeric:
+        return Range.numbers(INF, -INF, a.nullable)
+    return Range.numbers(signum(a.low), signum(a.high), a.nullable)
+
+def absolute(a):
+    if not a.numeric or a.low >= 0:
+        return a
+    if a.high <= 0:
+        return negate(a)
+    return Range.numbers(0.0, max(-a.low, a.high), a.nullable)
+
+def periodic(low, high):
+    """Bound SIN or COS: within [low, high], and NULL for an infinite argument."""
+    def bound(a):
+        return Range.numbers(low, high, a.nullable or math.isinf(a.low) or math.isinf(a.high))
+    return bound
+
+def extremum(choose):
+    """Bound MIN or MAX of two values."""
+    def bound(a, b):
+        nullable = a.nullable or b.nullable
+        if not (a.numeric and b.numeric):
+            return Range.numbers(INF, -INF, nullable)
+        return Range.numbers(choose(a.low, b.low), choose(a.high, b.high), nullable)
+    return bound
+
+def whole(function):
+    return lambda value: value if math.isinf(value) else float(function(value))
+
+# Tableau functions by name, bounding their result from their arguments' ranges
+FUNCTIONS = {
+    'ABS': absolute,
+    'SIGN': sign,
+    # IEEE square roots are correctly rounded
+    'SQRT': domain(math.sqrt, 0.0, False, exact=True),
+    'LN': domain(math.log, 0.0, True),
+    'LOG': domain(math.log10, 0.0, True),
+    'EXP': monotone(math.exp, 0.0),
+    'ATAN': monotone(math.atan),
+    'FLOOR': monotone(whole(math.floor), exact=True),
+    'CEILING': monotone(whole(math.ceil), exact=True),
+    'SIN': periodic(-1.0, 1.0),
+    'COS': periodic(-1.0, 1.0),
+    'POWER': power,
+    'POW': power,
+    'MIN': extremum(min),
+    'MAX': extremum(max),
+}
+
+# comparisons with the operands swapped
+FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '==', '==': '==', '!=': '!=', '<>': '!='}
+
+def compare(op, a, b):
+    """Bound the truth of a comparison."""
+    nullable = a.nullable or b.nullable
+    if a.truths or b.truths:
+        return Range.boolean(BOTH, nullable)
+    if not (a.numeric and b.numeric):
+        return Range.boolean(NEITHER, nullable)
+    if op in ('>', '>='):
+        op, a, b = FLIPPED[op], b, a
+    if op == '<':
+        truths = {True} if a.low < b.high else set()
+        truths |= {False} if a.high >= b.low else set()
+    elif op == '<=':
+        truths = {True} if a.low <= b.high else set()
+        truths |= {False} if a.high > b.low else set()
+    else:
+        overlap = a.low <= b.high and b.low <= a.high
+        always = a.low == a.high == b.low == b.high
+        truths = ({True} if overlap else set()) | (set() if always else {False})
+        if op in ('!=', '<>'):
+            truths = {not truth for truth in truths}
+    return Range.boolean(truths, nullable)
+
+def logic(op, a, b=None):
+    """Bound AND, OR or NOT under SQL's three-valued logic."""
+    if op == 'NOT':
+        results = {None if x is None else not x for x in a.outcomes()}
+    else:
+        results = set()
+        for x in a.outcomes():
+            for y in b.outcomes():
+                if op == 'AND':
+                    results.add(False if False in (x, y) else None if None in (x, y) else True)
+                else:
+                    results.add(True if True in (x, y) else None if None in (x, y) else False)
+    return Range.boolean(results - {None}, None in results)
+
+def number_node(value):
+    """Build the literal for a finite number, as an integer where it is one."""
+    text = str(int(abs(value))) if value.is_integer() and abs(value) < 2 ** 53 else repr(abs(value))
+    return ('unary', '-', ('number', text)) if value < 0 else ('number', text)
+
+def is_literal(node, value):
+    return node[0] == 'number' and float(node[1]) == value
+
+CONSTANT_TAGS = frozenset(['number', 'string', 'boolean', 'null'])
+
+class RangeAnalysis:
+    """
+        Bound and simplify the fields of a translation, given ranges, a
+        dictionary of column (argument) name to the Range it is declared to
+        lie in. After simplify, ranges maps each field to its bounds and
+        rewritten names the fields whose formula changed.
+    """
+
+    def __init__(self, ranges=None):
+        self.columns = dict(ranges or {})
+        self.ranges = {}
+        self.rewritten = set()
+
+    def leaf(self, node):
+        """Return the range of an operand."""
+        tag = node[0]
+        if tag == 'number':
+            value = float(node[1])
+            # integers beyond 2^53 are exact in SQLite but not as floats
+            if abs(value) >= 2 ** 53 and not any(c in node[1] for c in '.eE'):
+                return Range.numbers(-INF, INF)
+            return Range.numbers(value, value)
+        elif tag == 'boolean':
+            return Range.boolean({node[1]})
+        elif tag == 'null':
+            return NULL_ONLY
+        elif tag == 'string':
+            return Range(nullable=False)
+        elif tag == 'field':
+            return self.ranges.get(node[1], Range())
+        return self.columns.get(node[1], Range())
+
+    def simplify_tree(self, tree):
+        """Return the simplified tree and its range, bottom up and without recursion."""
+        done = []
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node[0] not in formulaparse.OPERATIONS:
+                done.append((node, self.leaf(node)))
+                continue
+            parts = formulaparse.children(node)
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(parts))
+                continue
+            finished = done[len(done) - len(parts):]
+            del done[len(done) - len(parts):]
+            done.append(self.rewrite(node, [part for part, _ in finished], [bound for _, bound in finished]))
+        return done[0]
+
+    def rewrite(self, node, parts, ranges):
+        """Bound node from its simplified parts and their ranges, and simplify it; returns (node, range)."""
+        tag = node[0]
+        if tag == 'if':
+            return self.rewrite_if(node, parts, ranges)
+        node = formulaparse.with_children(node, parts)
+        if tag == 'unary':
+            if node[1] == 'NOT':
+                result = logic('NOT', ranges[0])
+            else:
+                result = negate(ranges[0])
+                if parts[0][0] == 'unary' and parts[0][1] == '-':
+                    node = parts[0][2]
+        elif tag == 'binary':
+            op, left, right = node[1], parts[0], parts[1]
+            if op in ('AND', 'OR'):
+                result = logic(op, *ranges)
+                # TRUE AND x and FALSE OR x are x, NULL included
+                if left == ('boolean', op == 'AND'):
+                    node = right
+                elif right == ('boolean', op == 'AND'):
+                    node = left
+            elif op in FLIPPED:
+                result = compare(op, *ranges)
+            elif op == '^':
+                result = power(*ranges)
+                if is_literal(right, 1):
+                    node = left
+            else:
+                result = arithmetic(op, *ranges)
+                if op in ('*', '/') and is_literal(right, 1):
+                    node = left
+                elif op == '*' and is_literal(left, 1):
+                    node = right
+        else:
+            name = node[1]
+            bound = FUNCTIONS.get(name)
+            try:
+                result = bound(*ranges) if bound is not None else Range()
+            except TypeError:
+                # called with another number of arguments
+                result = Range()
+            node = self.rewrite_call(node, ranges) or node
+        return self.constant(node, result), result
+
+    @staticmethod
+    def rewrite_call(node, ranges):
+        """Return a cheaper equivalent of a function call the ranges allow, or None."""
+        name, args = node[1], node[2]
+        if name == 'ABS' and len(args) == 1:
+            if ranges[0].low >= 0:
+                return args[0]
+            elif ranges[0].high <= 0:
+                return ('unary', '-', args[0])
+        elif name in ('POWER', 'POW') and len(args) == 2 and is_literal(args[1], 1):
+            return args[0]
+        elif name in ('MIN', 'MAX') and len(args) == 2 and not (ranges[0].nullable or ranges[1].nullable):
+            a, b = ranges
+            if a.high <= b.low:
+                return args[0] if name == 'MIN' else args[1]
+            elif b.high <= a.low:
+                return args[1] if name == 'MIN' else args[0]
+        return None
+
+    @staticmethod
+    def constant(node, result):
+        """Replace node by a literal if result says it is always the same non-NULL value."""
+        if node[0] in CONSTANT_TAGS or (node[0] == 'unary' and node[2][0] == 'number'):
+            return node
+        truth = result.decided()
+        if truth is not None:
+            return ('boolean', truth)
+        value = result.point()
+        if value is not None:
+            return number_node(value)
+        return node
+
+    def rewrite_if(self, node, parts, ranges):
+        """
+            Drop the branches whose condition is never TRUE, stop at the
+            first one that always is, and collapse an IF whose remaining
+            branches all give the same value.
+        """
+        count = 2 * len(node[1])
+        if node[2] is not None:
+            otherwise, otherwise_range = parts[count], ranges[count]
+        else:
+            otherwise, otherwise_range = ('null',), NULL_ONLY
+        branches = []
+        result = None
+        for k in range(0, count, 2):
+            condition, condition_range = parts[k], ranges[k]
+            if condition_range.decided() is True:
+                otherwise, otherwise_range = parts[k + 1], ranges[k + 1]
+                break
+            if True in condition_range.truths or condition_range.numeric:
+                branches.append((condition, parts[k + 1]))
+                result = ranges[k + 1] if result is None else result.union(ranges[k + 1])
+        result = otherwise_range if result is None else result.union(otherwise_range)
+        if all(value == otherwise for _, value in branches):
+            node = otherwise
+        else:
+            node = ('if', tuple(branches), None if otherwise == ('null',) else otherwise)
+        return self.constant(node, result), result
+
+    def simplify(self, fields, roots=None):
+        """
+            Return fields with every formula the ranges decide simplified, in
+            the same order; formulas that do not parse are kept as they are.
+            With roots, only the fields the root fields still need are kept.
+        """
+        result = dict(fields)
+        for name in ctxmathparse.field_dependency_order(fields):
+            try:
+                tree = formulaparse.parse_formula(fields[name])
+            except formulaparse.FormulaSyntaxError:
+                self.ranges[name] = Range()
+                continue
+            node, self.ranges[name] = self.simplify_tree(tree)
+            if node != tree:
+                result[name] = formulaparse.render_formula(node)
+                self.rewritten.add(name)
+        if roots is not None:
+            result = ctxmathparse.reachable_fields(result, roots)
+        return result
+
+DECLARATION_OPERATOR = re.compile(r'\s*(<=|>=|==|=|<|>)\s*')
+
+def bound_range(op, value):
+    """The numbers x with x op value, open bounds moved to the next float inside."""
+    if op == '<':
+        return Range.numbers(-INF, math.nextafter(value, -INF))
+    elif op == '<=':
+        return Range.numbers(-INF, value)
+    elif op == '>':
+        return Range.numbers(math.nextafter(value, INF), INF)
+    elif op == '>=':
+        return Range.numbers(value, INF)
+    return Range.numbers(value, value)
+
+def parse_declaration(text):
+    """Parse a range like '0 < p < 1', 'n >= 1' or '2 == k' into (name, Range)."""
+    parts = DECLARATION_OPERATOR.split(text.strip())
+    operands, ops = parts[0::2], parts[1::2]
+    names = []
+    values = []
+    for operand in operands:
+        try:
+            values.append(float(operand))
+        except ValueError:
+            names.append(operand)
+            values.append(None)
+    if len(names) != 1 or not names[0].isidentifier() or len(operands) not in (2, 3):
+        raise ValueError('cannot parse range {!r}'.format(text))
+    position = values.index(None)
+    result = Range.numbers(-INF, INF)
+    for k, op in enumerate(ops):
+        if k < position:
+            result = result.intersection(bound_range(FLIPPED[op], values[k]))
+        else:
+            result = result.intersection(bound_range(op, values[k + 1]))
+    if not result.numeric:
+        raise ValueError('range {!r} is empty'.format(text))
+    return names[0], result
+
+def declare(*declarations):
+    """Return the column ranges for declarations; several for one name are intersected."""
+    ranges = {}
+    for declaration in declarations:
+        name, bound = parse_declaration(declaration)
+        ranges[name] = ranges[name].intersection(bound) if name in ranges else bound
+        if not ranges[name].numeric:
+            raise ValueError('the ranges declared for {} do not overlap'.format(name))
+    return ranges
+
+def simplify(fields, ranges, roots=None):
+    """Simplify fields under ranges, a dictionary from RangeAnalysis or declare(); see RangeAnalysis.simplify."""
+    return RangeAnalysis(ranges).simplify(fields, roots)
+
+def main():
+    """Report what declared argument ranges save on the functions of a Python module."""
+    parser = argparse.ArgumentParser(description='Simplify translated functions under declared argument ranges.')
+    parser.add_argument('module', nargs='?', default='A396.py')
+    parser.add_argument('functions', nargs='*')
+    parser.add_argument('--range', action='append', default=[], dest='ranges', metavar='DECLARATION',
+                        help="an argument range such as '0 < p < 1' (repeatable)")
+    parser.add_argument('--minimal-parentheses', action='store_true')
+    parser.add_argument('--show', action='store_true', help='print the rewritten fields')
+    args = parser.parse_args()
+    try:
+        ranges = declare(*args.ranges)
+    except ValueError as e:
+        parser.error(str(e))
+
+    mathparse = ctxmathparse.MathParse(minimal_parentheses=args.minimal_parentheses)
+    with open(args.module) as source:
+        mathparse.add_module(source.read())
+    functions = args.functions or sorted(mathparse.function_index)
+    fields = mathparse.link(functions)
+    roots = [root for name in functions for root in costmodel.function_roots(fields, name)]
+    analysis = RangeAnalysis(ranges)
+    simplified = analysis.simplify(fields, roots)
+
+    model = costmodel.CostModel()
+    before = model.function_costs(fields, functions)
+    after = model.function_costs(simplified, functions)
+    for name in functions:
+        own_roots = costmodel.function_roots(fields, name)
+        print('{}: cost {:.1f} -> {:.1f}, fields {} -> {}'.format(
+            name, before[name], after[name],
+            len(ctxmathparse.reachable_fields(fields, own_roots)),
+            len(ctxmathparse.reachable_fields(simplified, own_roots)),
+        ))
+    print('{} formulas rewritten'.format(len(analysis.rewritten)))
+    if args.show:
+        for name in simplified:
+            if name in analysis.rewritten:
+                print('{} = {}'.format(name, simplified[name]))
+
+if __name__ == '__main__':
+    main()
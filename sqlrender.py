@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+
+"""
+    Render translated fields as SQL so a computation can run in the source
+    database rather than in Tableau.
+
+    The input is the same field dictionary MathParse.translate produces. Each
+    formula is parsed back with formulaparse and rendered as a SQL expression:
+    IF becomes CASE WHEN, ^ becomes POWER, and / always divides as REAL.
+    Fields used once are inlined into their consumer; fields shared by several
+    consumers are computed once, in a chain of CTEs layered by dependency
+    depth, so each CTE only adds columns whose inputs an earlier one made.
+"""
+
+import argparse
+import math
+import random
+import sqlite3
+import time
+
+import ctxmathparse
+import formulaparse
+
+BINARY_OPERATORS = {
+    '+': '+', '-': '-', '*': '*',
+    '=': '=', '==': '=', '!=': '<>', '<>': '<>',
+    '<': '<', '<=': '<=', '>': '>', '>=': '>=',
+    'AND': 'AND', 'OR': 'OR',
+}
+
+ATOMS = frozenset(['number', 'string', 'boolean', 'null', 'column', 'field'])
+
+def quote_identifier(name):
+    """Quote a SQL identifier."""
+    return '"{}"'.format(name.replace('"', '""'))
+
+def quote_string(value):
+    """Quote a SQL string literal."""
+    return "'{}'".format(value.replace("'", "''"))
+
+class SQLRenderer:
+    """
+        Render formula trees as SQL expressions. Field references render as
+        column names unless the field is in inline, in which case its own
+        formula is substituted. Bare identifiers, which translated argument
+        fields use as placeholders, are looked up in columns.
+    """
+
+    def __init__(self, fields, inline=(), columns=None):
+        """Parse fields once and set which are substituted rather than referenced."""
+        self.trees = {name: formulaparse.parse_formula(formula) for name, formula in fields.items()}
+        self.inline = frozenset(inline)
+        self.columns = columns or {}
+
+    def render_field(self, name):
+        """Render the formula of field name."""
+        return self.render(self.trees[name])
+
+    def render(self, node):
+        """Render node to SQL without recursing on deep trees."""
+        pieces = []
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                pieces.append(item)
+            else:
+                stack.extend(reversed(self.expand(item)))
+        return ''.join(pieces)
+
+    def expand(self, node):
+        """Return the strings and child nodes making up node, in output order."""
+        return getattr(self, 'expand_' + node[0])(node)
+
+    @staticmethod
+    def separated(nodes, separator=', '):
+        """Interleave nodes with separator."""
+        result = []
+        for i, node in enumerate(nodes):
+            if i:
+                result.append(separator)
+            result.append(node)
+        return result
+
+    @staticmethod
+    def expand_number(node):
+        return [node[1]]
+
+    @staticmethod
+    def expand_string(node):
+        return [quote_string(node[1])]
+
+    @staticmethod
+    def expand_boolean(node):
+        return ['TRUE' if node[1] else 'FALSE']
+
+    @staticmethod
+    def expand_null(node):
+        return ['NULL']
+
+    def expand_column(self, node):
+        return [self.columns.get(node[1], quote_identifier(node[1]))]
+
+    def expand_field(self, node):
+        if node[1] in self.inline:
+            tree = self.trees[node[1]]
+            return [tree] if tree[0] in ATOMS else ['(', tree, ')']
+        return [quote_identifier(node[1])]
+
+    @staticmethod
+    def expand_unary(node):
+        return ['(', node[1] if node[1] == '-' else 'NOT ', node[2], ')']
+
+    def expand_binary(self, node):
+        op, left, right = node[1:]
+        if op == '^':
+            return ['POWER(', left, ', ', right, ')']
+        elif op == '/':
+            return ['(CAST(', left, ' AS REAL) / ', right, ')']
+        elif op == '%':
+            return ['MOD(', left, ', ', right, ')']
+        return ['(', left, ' {} '.format(BINARY_OPERATORS[op]), right, ')']
+
+    def expand_call(self, node):
+        name, args = node[1:]
+        if name == 'LOG' and len(args) == 2:
+            # Tableau's LOG(x, base) is SQL's LOG(base, x)
+            args = (args[1], args[0])
+        return [name, '('] + self.separated(args) + [')']
+
+    def expand_if(self, node):
+        result = ['CASE']
+        for cond, value in node[1]:
+            result.extend([' WHEN ', cond, ' THEN ', value])
+        if node[2] is not None:
+            result.extend([' ELSE ', node[2]])
+        result.append(' END')
+        return result
+
+def count_references(fields, roots):
+    """Count how many times each field is referenced by the others and by roots."""
+    counts = dict.fromkeys(fields, 0)
+    for formula in list(fields.values()) + ['[{}]'.format(root) for root in roots]:
+        for name in ctxmathparse.FIELD_REFERENCE.findall(formula):
+            counts[name] += 1
+    return counts
+
+def nesting_depth(tree, field_depth):
+    """
+        Return how deeply tree nests as SQL, where field_depth(name) is the
+        depth a reference to field name adds (1 unless it is inlined).
+    """
+    depths = {}
+    stack = [(tree, False)]
+    while stack:
+        node, done = stack.pop()
+        below = formulaparse.children(node)
+        if done:
+            own = field_depth(node[1]) if node[0] == 'field' else 1
+            depths[id(node)] = own + max([depths[id(child)] for child in below], default=0)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in below)
+    return depths[id(tree)]
+
+# SQLite's parser stack holds about 100 entries; rendered parentheses and CASEs take
+# more than one per level of the formula tree, so stay well below that
+INLINE_DEPTH = 20
+
+def render_query(fields, outputs, source, columns=None, keep=(), materialized=False, inline_depth=INLINE_DEPTH):
+    """
+        Build a SELECT computing outputs over the rows of source.
+
+        outputs maps result column aliases to field names (a list of field
+        names keeps their names). columns maps the bare argument placeholders
+        to SQL expressions over source, defaulting to same-named columns, and
+        keep lists source columns to pass through to the result.
+
+        SQLite and PostgreSQL flatten a CTE used once into its consumer,
+        which copies shared fields back into every use; over a long chain
+        that grows exponentially. materialized marks the CTEs AS MATERIALIZED
+        so each is computed once, for deeply nested translations. A field
+        is not inlined if that would nest its consumer deeper than
+        inline_depth, which keeps the expressions within what SQL parsers
+        accept.
+    """
+    if not isinstance(outputs, dict):
+        outputs = {name: name for name in outputs}
+    fields = ctxmathparse.reachable_fields(fields, outputs.values())
+    renderer = SQLRenderer(fields, columns=columns)
+    counts = count_references(fields, outputs.values())
+    inline = set(
+        name for name, tree in renderer.trees.items() if counts[name] <= 1 or tree[0] in ATOMS
+    )
+    depths = {}
+    for name in ctxmathparse.field_dependency_order(fields):
+        depths[name] = nesting_depth(
+            renderer.trees[name], lambda ref: depths[ref] if ref in inline and ref in depths else 1
+        )
+        if depths[name] > inline_depth and renderer.trees[name][0] not in ATOMS:
+            inline.discard(name)
+    renderer.inline = frozenset(inline)
+
+    # the CTE after which each field's value can be read
+    available = {}
+    layers = []
+    for name in ctxmathparse.field_dependency_order(fields):
+        ready = max(
+            [available[dep] for dep in ctxmathparse.referenced_fields(fields[name]) if dep in fields],
+            default=0,
+        )
+        if name in inline:
+            available[name] = ready
+        else:
+            available[name] = ready + 1
+            while len(layers) < ready + 1:
+                layers.append([])
+            layers[ready].append(name)
+
+    hint = 'MATERIALIZED ' if materialized else ''
+    ctes = ['step_0 AS {}(SELECT * FROM {})'.format(hint, source)]
+    for i, layer in enumerate(layers, 1):
+        ctes.append('step_{} AS {}(SELECT step_{}.*, {} FROM step_{})'.format(
+            i, hint, i - 1,
+            ', '.join(
+                '{} AS {}'.format(renderer.render_field(name), quote_identifier(name))
+                for name in layer
+            ),
+            i - 1,
+        ))
+    selected = [quote_identifier(column) for column in keep] + [
+        '{} AS {}'.format(renderer.render(('field', name)), quote_identifier(alias))
+        for alias, name in outputs.items()
+    ]
+    return 'WITH {} SELECT {} FROM step_{}'.format(', '.join(ctes), ', '.join(selected), len(layers))
+
+SQL_MATH_FUNCTIONS = {
+    'SQRT': (1, math.sqrt),
+    'LN': (1, math.log),
+    'EXP': (1, math.exp),
+    'POWER': (2, math.pow),
+    'MOD': (2, math.fmod),
+    'SIGN': (1, lambda x: (x > 0) - (x < 0)),
+    'SIN': (1, math.sin),
+    'COS': (1, math.cos),
+    'TAN': (1, math.tan),
+    'ATAN': (1, math.atan),
+    'FLOOR': (1, math.floor),
+    'CEILING': (1, math.ceil),
+    'PI': (0, lambda: math.pi),
+}
+
+def register_math_functions(connection):
+    """
+        Give an SQLite connection the math functions the renderer emits, for
+        SQLite builds compiled without SQLITE_ENABLE_MATH_FUNCTIONS.
+    """
+    try:
+        connection.execute('SELECT SQRT(4), POWER(2, 2), LN(1), PI(), SIGN(-1)')
+    except sqlite3.OperationalError:
+        for name, (nargs, func) in SQL_MATH_FUNCTIONS.items():
+            def guarded(*args, func=func):
+                if any(arg is None for arg in args):
+                    return None
+                try:
+                    return func(*args)
+                except (ValueError, ZeroDivisionError, OverflowError):
+                    return None
+            connection.create_function(name, nargs, guarded, deterministic=True)
+
+def benchmark(rows, seed=396):
+    """
+        Compare computing A396.tquantile inside SQLite with fetching the
+        inputs and computing it in Python, over a table of rows rows.
+    """
+    import A396
+    import libsnapshot
+
+    fields = libsnapshot.library_mathparse(minimal_parentheses=True).link(['tquantile'])
+    query = render_query(fields, {'t': '_tquantile'}, 'samples', keep=['id'])
+
+    connection = sqlite3.connect(':memory:')
+    register_math_functions(connection)
+    connection.execute('CREATE TABLE samples (id INTEGER PRIMARY KEY, n INTEGER, p REAL)')
+    generator = random.Random(seed)
+    connection.executemany('INSERT INTO samples (n, p) VALUES (?, ?)', (
+        (generator.randint(1, 40), generator.uniform(0.001, 0.999)) for _ in range(rows)
+    ))
+
+    start = time.perf_counter()
+    in_database = connection.execute(query).fetchall()
+    database_seconds = time.perf_counter() - start
+
+    library = A396.A396()
+
+    def tquantile(n, p):
+        """Evaluate like Tableau, where a failing computation gives NULL."""
+        try:
+            return library.tquantile(n, p)
+        except (ValueError, ZeroDivisionError, OverflowError):
+            return None
+
+    start = time.perf_counter()
+    in_python = [
+        (row_id, tquantile(n, p))
+        for row_id, n, p in connection.execute('SELECT id, n, p FROM samples')
+    ]
+    python_seconds = time.perf_counter() - start
+
+    compared = [
+        (got, expected)
+        for (_, got), (_, expected) in zip(sorted(in_database), sorted(in_python))
+        if got is not None and expected is not None
+    ]
+    worst = max(
+        [abs(expected - got) / max(1.0, abs(expected)) for got, expected in compared], default=0.0
+    )
+    print('rows: {}'.format(rows))
+    print('query: {} bytes, {} CTEs'.format(len(query), query.count(' AS (SELECT')))
+    print('sqlite: {:.3f}s ({:.0f} rows/s)'.format(database_seconds, rows / database_seconds))
+    print('python: {:.3f}s ({:.0f} rows/s)'.format(python_seconds, rows / python_seconds))
+    print('compared: {} rows, {} NULL in either'.format(len(compared), rows - len(compared)))
+    print('max relative difference: {:.3g}'.format(worst))
+
+def main():
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description='Benchmark in-database evaluation of A396.tquantile.')
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+    benchmark(args.rows)
+
+if __name__ == '__main__':
+    main()
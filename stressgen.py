@@ -0,0 +1,448 @@
+#!/usr/bin/python3
+
+"""
+    Generate random numeric Python programs and check that both translators
+    keep their meaning, and measure how translation scales with their size.
+
+    ProgramGenerator writes two kinds of program from a seed: straight-line
+    module code, which is all mathparse.StaticMathParse accepts, and sets of
+    functions with if/else blocks, early returns and calls between them for
+    ctxmathparse.MathParse. Size, nesting depth, how often a name is
+    reassigned and how many calls each function makes are all tunable.
+
+    The translations are evaluated over a table of random inputs in SQLite
+    with sqlrender, the way the test suite checks hand-written translations,
+    and compared row by row with running the program itself. Rows where
+    Python overflows or the values leave a sane range are not compared, and
+    formulas too large or too deep to evaluate are counted separately.
+
+    python stressgen.py --programs 200 checks equivalence;
+    python stressgen.py --scaling 10,20,40,80 logs the time and output size
+    of translating ever larger programs.
+"""
+
+import argparse
+import ast
+import math
+import random
+import sqlite3
+import sys
+import time
+
+import ctxmathparse
+import mathparse
+import sqlrender
+
+ARGUMENTS = ('a', 'b', 'c')
+
+# functions both translators map to Tableau, and Python's meaning for them
+PYTHON_FUNCTIONS = {
+    'abs': abs,
+    'sqrt': math.sqrt,
+    'exp': math.exp,
+}
+
+# values beyond this are not compared: overflow there is not the translator's fault
+MAGNITUDE_LIMIT = 1e100
+
+class Program:
+    """Generated source, its entry point and argument names, and the names it outputs."""
+
+    def __init__(self, source, entry, arguments, outputs=()):
+        self.source = source
+        self.entry = entry
+        self.arguments = tuple(arguments)
+        self.outputs = tuple(outputs)
+
+    def statements(self):
+        """Count the statements in the source, not counting function definitions."""
+        return sum(
+            isinstance(node, ast.stmt) and not isinstance(node, ast.FunctionDef)
+            for node in ast.walk(ast.parse(self.source))
+        )
+
+class ProgramGenerator:
+    """
+        Random programs from a seed. statements is the length of each body,
+        depth the nesting of expressions and of if blocks, redefinition the
+        chance an assignment rebinds an existing name, branching the chance
+        a statement is an if, returns the chance an if branch returns early,
+        helpers the number of functions besides the entry point and fanout
+        the number of calls each function makes to the ones before it.
+    """
+
+    def __init__(self, seed=0, statements=8, depth=3, redefinition=0.3, branching=0.2,
+                 returns=0.2, helpers=2, fanout=2):
+        self.random = random.Random(seed)
+        self.statements = statements
+        self.depth = depth
+        self.redefinition = redefinition
+        self.branching = branching
+        self.returns = returns
+        self.helpers = helpers
+        self.fanout = fanout
+
+    def constant(self):
+        """Return a small float literal."""
+        return repr(round(self.random.uniform(-2, 2), 2))
+
+    def expression(self, names, depth):
+        """Return the source of a random expression over names, nested up to depth."""
+        choice = self.random.random()
+        if depth <= 0 or choice < 0.2:
+            return self.random.choice(names) if self.random.random() < 0.8 else self.constant()
+        x = self.expression(names, depth - 1)
+        y = self.expression(names, depth - 1)
+        return self.random.choice([
+            '({} + {})', '({} - {})', '({} * {})', '({} - {})',
+            '({} / (1 + {} * {}))'.format('{0}', '{1}', '{1}'),
+            'sqrt(1 + {0} * {0})', 'abs({} - {})', 'exp(-abs({}))', '({} ** 2)', '-{}',
+        ]).format(x, y)
+
+    def condition(self, names):
+        """Return a comparison between two expressions."""
+        return '{} {} {}'.format(
+            self.expression(names, 1), self.random.choice(['<', '<=', '>', '>=']), self.expression(names, 1)
+        )
+
+    def target(self, names, locals_):
+        """Pick the name to assign, an existing local or a fresh one, once its value is generated."""
+        if locals_ and self.random.random() < self.redefinition:
+            return self.random.choice(locals_)
+        name = 'v{}'.format(len(locals_))
+        while name in names:
+            name += '_'
+        locals_.append(name)
+        names.append(name)
+        return name
+
+    def block(self, names, count, depth, indent, allow_new=True, callees=(), calls=0):
+        """
+            Return count statements as lines, with calls more assigning the
+            result of a call to one of callees, (name, arity) pairs. Inside
+            if blocks only existing names are reassigned, so every name is
+            bound on every path.
+        """
+        lines = []
+        own = []
+        call_positions = set(self.random.sample(range(count + calls), calls)) if callees else set()
+        for i in range(count + len(call_positions)):
+            if i in call_positions:
+                callee, arity = self.random.choice(callees)
+                value = '{}({})'.format(callee, ', '.join(self.expression(names, 1) for _ in range(arity)))
+                lines.append('{}{} = {}'.format(indent, self.target(names, own), value))
+            elif depth > 0 and self.random.random() < self.branching:
+                lines.append('{}if {}:'.format(indent, self.condition(names)))
+                lines.extend(self.branch(names, depth - 1, indent + '    '))
+                lines.append('{}else:'.format(indent))
+                lines.extend(self.branch(names, depth - 1, indent + '    '))
+            else:
+                value = self.expression(names, self.depth)
+                target = self.target(names, own) if allow_new else self.random.choice(names)
+                lines.append('{}{} = {}'.format(indent, target, value))
+        return lines
+
+    def branch(self, names, depth, indent):
+        """Return the body of one arm of an if: a few reassignments, maybe a return."""
+        lines = self.block(names, self.random.randint(1, 2), depth, indent, allow_new=False)
+        if self.random.random() < self.returns:
+            lines.append('{}return {}'.format(indent, self.expression(names, self.depth)))
+        return lines
+
+    def function(self, name, arguments, callees):
+        """Return the source of one function calling callees, (name, arity) pairs."""
+        names = list(arguments)
+        lines = self.block(names, self.statements, self.depth, '    ', callees=callees, calls=self.fanout)
+        lines.append('    return {}'.format(self.expression(names, self.depth)))
+        return 'def {}({}):\n{}\n'.format(name, ', '.join(arguments), '\n'.join(lines))
+
+    def program(self):
+        """Return a Program of helpers and an entry function f calling them."""
+        functions = []
+        callees = []
+        for k in range(self.helpers):
+            arguments = ARGUMENTS[:self.random.randint(1, len(ARGUMENTS))]
+            name = 'h{}'.format(k)
+            functions.append(self.function(name, arguments, callees))
+            callees.append((name, len(arguments)))
+        functions.append(self.function('f', ARGUMENTS, callees))
+        return Program('\n'.join(functions), 'f', ARGUMENTS)
+
+    def straight_line(self):
+        """Return a Program of module-level assignments whose final value is out."""
+        names = list(ARGUMENTS)
+        lines = []
+        own = []
+        for _ in range(self.statements):
+            value = self.expression(names, self.depth)
+            lines.append('{} = {}'.format(self.target(names, own), value))
+        lines.append('out = {}'.format(self.expression(names, self.depth)))
+        return Program('\n'.join(lines) + '\n', None, ARGUMENTS, ['out'])
+
+def translate_functions(program, minimal_parentheses=True):
+    """Translate a function Program with ctxmathparse; returns the fields and the result field."""
+    translator = ctxmathparse.MathParse(minimal_parentheses=minimal_parentheses)
+    translator.add_module(program.source)
+    return translator.link([program.entry]), '_' + program.entry
+
+def expanded_size(node):
+    """Count the nodes of an AST as rendered, where shared subtrees repeat, without expanding it."""
+    sizes = {}
+    stack = [(node, False)]
+    while stack:
+        item, done = stack.pop()
+        if id(item) in sizes:
+            continue
+        children = list(ast.iter_child_nodes(item))
+        if done:
+            sizes[id(item)] = 1 + sum(sizes[id(child)] for child in children)
+        else:
+            stack.append((item, True))
+            stack.extend((child, False) for child in children if id(child) not in sizes)
+    return sizes[id(node)]
+
+def translate_straight_line(program, size_limit=200000, every_name=False, minimal_parentheses=True):
+    """
+        Translate a straight-line Program with StaticMathParse: substitute
+        every statement forward, drop dead stores and render the outputs,
+        or with every_name the final value of every name. Returns the
+        fields, or None if an output would render larger than size_limit
+        nodes (substitution can double it with every statement).
+    """
+    parse = mathparse.StaticMathParse
+    stmts = list(parse.split_assignments(parse.unwrap_module_statements(ast.parse(program.source))))
+    outputs = None if every_name else set(program.outputs)
+    stmts = parse.eliminate_dead_stores(parse.substitution_wrapper(iter(stmts)), outputs)
+    fields = {'_{}'.format(name): name for name in program.arguments}
+    memo = mathparse.RenderMemo()
+    for stmt in stmts:
+        if expanded_size(stmt.value) > size_limit:
+            return None
+        for name in parse.assigned_names(stmt):
+            fields['_{}'.format(name)] = parse.render_expression(
+                stmt.value, minimal_parentheses=minimal_parentheses, memo=memo
+            )
+    return fields
+
+class Comparison:
+    """Row counts and the worst error from comparing a translation with Python."""
+
+    def __init__(self):
+        self.programs = 0
+        self.rows = 0
+        self.compared = 0
+        self.skipped = 0
+        self.unevaluated = 0
+        self.mismatches = []
+        self.worst = 0.0
+
+    def add(self, other):
+        """Accumulate another Comparison into this one."""
+        self.programs += other.programs
+        self.rows += other.rows
+        self.compared += other.compared
+        self.skipped += other.skipped
+        self.unevaluated += other.unevaluated
+        self.mismatches.extend(other.mismatches)
+        self.worst = max(self.worst, other.worst)
+
+    def summary(self, label):
+        """Return a line describing the comparison."""
+        return '{}: {} programs, {} rows compared, {} skipped, {} programs unevaluated, ' \
+            '{} mismatches, worst relative error {:.3g}'.format(
+                label, self.programs, self.compared, self.skipped, self.unevaluated,
+                len(self.mismatches), self.worst
+            )
+
+def python_values(program, rows):
+    """Run program on each row of arguments; None where Python fails or leaves the comparable range."""
+    namespace = dict(PYTHON_FUNCTIONS)
+    code = compile(program.source, '<generated>', 'exec')
+    if program.entry is not None:
+        exec(code, namespace)
+        entry = namespace[program.entry]
+    values = []
+    for row in rows:
+        try:
+            if program.entry is not None:
+                value = entry(*row)
+            else:
+                scope = dict(namespace, **dict(zip(program.arguments, row)))
+                exec(code, scope)
+                value = scope[program.outputs[0]]
+        except (ValueError, ZeroDivisionError, OverflowError):
+            value = None
+        if value is not None and not (math.isfinite(value) and abs(value) < MAGNITUDE_LIMIT):
+            value = None
+        values.append(value)
+    return values
+
+class EquivalenceChecker:
+    """Evaluate translations in SQLite over a fixed table of random argument rows."""
+
+    def __init__(self, rows=50, seed=396, tolerance=1e-9):
+        self.connection = sqlite3.connect(':memory:')
+        sqlrender.register_math_functions(self.connection)
+        self.connection.execute('CREATE TABLE inputs (id INTEGER PRIMARY KEY, {})'.format(
+            ', '.join('{} REAL'.format(name) for name in ARGUMENTS)
+        ))
+        generator = random.Random(seed)
+        self.rows = [tuple(generator.uniform(-2, 2) for _ in ARGUMENTS) for _ in range(rows)]
+        self.connection.executemany('INSERT INTO inputs VALUES (?, {})'.format(
+            ', '.join('?' for _ in ARGUMENTS)
+        ), [(i,) + row for i, row in enumerate(self.rows)])
+        self.tolerance = tolerance
+
+    def close(self):
+        self.connection.close()
+
+    def sql_values(self, fields, result):
+        """Evaluate field result for every row, or return None if SQLite cannot."""
+        query = sqlrender.render_query(fields, {'result': result}, 'inputs', keep=['id'], materialized=True)
+        try:
+            return [value for _, value in sorted(self.connection.execute(query).fetchall())]
+        except (sqlite3.OperationalError, RecursionError):
+            return None
+
+    def compare(self, program, fields, result):
+        """Compare the translation's value of result with Python's, row by row."""
+        comparison = Comparison()
+        comparison.programs = 1
+        comparison.rows = len(self.rows)
+        got = None if fields is None else self.sql_values(fields, result)
+        if got is None:
+            comparison.unevaluated = 1
+            return comparison
+        for row, value, expected in zip(self.rows, got, python_values(program, self.rows)):
+            if expected is None:
+                comparison.skipped += 1
+                continue
+            comparison.compared += 1
+            error = math.inf if value is None else abs(value - expected) / max(1.0, abs(expected))
+            comparison.worst = max(comparison.worst, error)
+            if error > self.tolerance:
+                comparison.mismatches.append((program, row, value, expected))
+        return comparison
+
+    def check_modes(self, program, translate):
+        """
+            Compare translate(minimal_parentheses)'s (fields, result) with
+            Python in both parentheses modes, as one program; rows are
+            counted once per mode.
+        """
+        comparison = Comparison()
+        for minimal_parentheses in (False, True):
+            comparison.add(self.compare(program, *translate(minimal_parentheses)))
+        comparison.programs = 1
+        comparison.unevaluated = min(comparison.unevaluated, 1)
+        return comparison
+
+    def check_functions(self, program):
+        """Check a function Program through ctxmathparse.MathParse."""
+        return self.check_modes(program, lambda minimal: translate_functions(program, minimal))
+
+    def check_straight_line(self, program):
+        """Check a straight-line Program through mathparse.StaticMathParse."""
+        return self.check_modes(program, lambda minimal: (
+            translate_straight_line(program, minimal_parentheses=minimal), '_' + program.outputs[0]
+        ))
+
+def check(programs, seed=0, rows=50, **options):
+    """Generate and check programs of each kind; returns the straight-line and function Comparisons."""
+    checker = EquivalenceChecker(rows)
+    static, functions = Comparison(), Comparison()
+    try:
+        for k in range(programs):
+            generator = ProgramGenerator(seed + k, **options)
+            static.add(checker.check_straight_line(generator.straight_line()))
+            functions.add(checker.check_functions(generator.program()))
+    finally:
+        checker.close()
+    return static, functions
+
+def scaling(sizes, seed=0, trials=5, **options):
+    """
+        Time translating programs of each size (statements per body) and
+        measure the output: straight-line programs keeping every name, and
+        function programs. Returns rows of (size, kind, statements, seconds,
+        fields, characters), each the mean over trials programs.
+    """
+    results = []
+    for size in sizes:
+        for kind in ('straight_line', 'functions'):
+            totals = [0, 0.0, 0, 0]
+            for trial in range(trials):
+                generator = ProgramGenerator(seed + trial, statements=size, **options)
+                program = generator.straight_line() if kind == 'straight_line' else generator.program()
+                start = time.perf_counter()
+                if kind == 'straight_line':
+                    fields = translate_straight_line(program, size_limit=math.inf, every_name=True)
+                else:
+                    fields, _ = translate_functions(program)
+                elapsed = time.perf_counter() - start
+                sample = (program.statements(), elapsed, len(fields), sum(map(len, fields.values())))
+                totals = [total + value for total, value in zip(totals, sample)]
+            statements, elapsed, count, characters = [total / trials for total in totals]
+            results.append((size, kind, statements, elapsed, count, characters))
+    return results
+
+def growth(results):
+    """Return the log-log slope of time and of output size between successive sizes of each kind."""
+    slopes = []
+    for kind in ('straight_line', 'functions'):
+        rows = [row for row in results if row[1] == kind]
+        for before, after in zip(rows, rows[1:]):
+            ratio = math.log(after[2] / before[2])
+            slopes.append((
+                kind, before[0], after[0],
+                math.log(max(after[3], 1e-9) / max(before[3], 1e-9)) / ratio,
+                math.log(after[5] / before[5]) / ratio,
+            ))
+    return slopes
+
+def main():
+    """Check random programs or log scaling curves."""
+    parser = argparse.ArgumentParser(description='Stress the translators with random programs.')
+    parser.add_argument('--programs', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rows', type=int, default=50)
+    parser.add_argument('--statements', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--redefinition', type=float, default=0.3)
+    parser.add_argument('--branching', type=float, default=0.2)
+    parser.add_argument('--returns', type=float, default=0.2)
+    parser.add_argument('--helpers', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=2)
+    parser.add_argument('--scaling', metavar='SIZES', help='comma-separated statement counts to time')
+    parser.add_argument('--trials', type=int, default=5)
+    args = parser.parse_args()
+
+    options = dict(
+        depth=args.depth, redefinition=args.redefinition, branching=args.branching,
+        returns=args.returns, helpers=args.helpers, fanout=args.fanout,
+    )
+    if args.scaling:
+        sizes = [int(size) for size in args.scaling.split(',')]
+        results = scaling(sizes, args.seed, args.trials, **options)
+        print('{:>6} {:>14} {:>10} {:>10} {:>8} {:>12}'.format(
+            'size', 'kind', 'statements', 'seconds', 'fields', 'characters'))
+        for size, kind, statements, elapsed, count, characters in results:
+            print('{:>6} {:>14} {:>10.1f} {:>10.4f} {:>8.1f} {:>12.0f}'.format(
+                size, kind, statements, elapsed, count, characters))
+        for kind, before, after, time_slope, size_slope in growth(results):
+            print('{} {} -> {}: time ~ n^{:.2f}, output ~ n^{:.2f}'.format(
+                kind, before, after, time_slope, size_slope))
+        return
+
+    static, functions = check(args.programs, args.seed, args.rows, statements=args.statements, **options)
+    failed = False
+    for label, comparison in (('StaticMathParse', static), ('MathParse', functions)):
+        print(comparison.summary(label))
+        for program, row, value, expected in comparison.mismatches[:3]:
+            failed = True
+            print('  {} gave {!r}, Python {!r}:\n{}'.format(row, value, expected, program.source))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
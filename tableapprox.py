@@ -0,0 +1,320 @@
+#!/usr/bin/python3
+
+"""
+    Replace an expensive one-argument function over a bounded domain with a
+    piecewise polynomial that Tableau can evaluate cheaply.
+
+    The domain is bisected until a Chebyshev interpolant of the requested
+    degree meets the error bound on every segment. The function is sampled a
+    whole grid at a time, so a vectorized function (one taking and returning
+    sequences, such as a numpy ufunc) is called once per grid rather than
+    once per point. The result is emitted as Python source and translated by
+    ctxmathparse like any other function, in one of two forms: a balanced
+    tree of conditional expressions over the segment breakpoints with a
+    Horner polynomial at each leaf, or a branch-free sum of every segment's
+    polynomial weighted by SIGN-built indicators of its interval.
+"""
+
+import argparse
+import ast
+import inspect
+import math
+import sys
+
+import ctxmathparse
+import formulaparse
+import libsnapshot
+
+def grid(lo, hi, count):
+    """Return count evenly spaced points covering [lo, hi], ends included."""
+    step = (hi - lo) / (count - 1)
+    return [lo + i * step for i in range(count - 1)] + [hi]
+
+def sample(func, points, vectorized=False):
+    """Evaluate func on points, with a single call if it is vectorized."""
+    if vectorized:
+        return list(func(points))
+    return [func(x) for x in points]
+
+def chebyshev_monomial_coefficients(func, lo, hi, degree, vectorized=False):
+    """
+        Interpolate func at the Chebyshev nodes of [lo, hi] and return the
+        coefficients of the interpolant as a polynomial in (x - midpoint),
+        lowest order first.
+    """
+    count = degree + 1
+    mid = (lo + hi) / 2
+    half = (hi - lo) / 2
+    angles = [math.pi * (j + 0.5) / count for j in range(count)]
+    values = sample(func, [mid + half * math.cos(angle) for angle in angles], vectorized)
+    series = [
+        2 / count * sum(value * math.cos(k * angle) for value, angle in zip(values, angles))
+        for k in range(count)
+    ]
+    series[0] /= 2
+
+    # expand sum(series[k] * T_k(s)) into powers of s with the T_k recurrence
+    result = [0.0] * count
+    previous, current = [1.0], [0.0, 1.0]
+    for k in range(count):
+        term = previous if k == 0 else current
+        for power, coefficient in enumerate(term):
+            result[power] += series[k] * coefficient
+        if k >= 1:
+            following = [0.0] + [2 * c for c in current]
+            for power, coefficient in enumerate(previous):
+                following[power] -= coefficient
+            previous, current = current, following
+
+    # s = (x - mid) / half
+    return [coefficient / half ** power for power, coefficient in enumerate(result)]
+
+def evaluate_polynomial(coefficients, u):
+    """Evaluate coefficients (lowest order first) at u by Horner's rule."""
+    result = 0.0
+    for coefficient in reversed(coefficients):
+        result = result * u + coefficient
+    return result
+
+class Segment:
+    """One piece of a piecewise approximation: a polynomial in (x - mid) on [lo, hi]."""
+
+    def __init__(self, lo, hi, coefficients, error):
+        self.lo = lo
+        self.hi = hi
+        self.mid = (lo + hi) / 2
+        self.coefficients = coefficients
+        self.error = error
+
+    def __call__(self, x):
+        return evaluate_polynomial(self.coefficients, x - self.mid)
+
+    def horner_source(self, arg):
+        """Return the Horner form of this segment's polynomial as a Python expression."""
+        u = '({} - {!r})'.format(arg, self.mid)
+        formula = repr(self.coefficients[-1])
+        for coefficient in reversed(self.coefficients[:-1]):
+            formula = '{!r} + {} * ({})'.format(coefficient, u, formula)
+        return formula
+
+class PiecewiseApproximation:
+    """
+        A piecewise polynomial approximation of func on [lo, hi], made by
+        bisecting until every segment's sampled error is within tolerance.
+    """
+
+    def __init__(self, func, lo, hi, tolerance, degree=4, relative=False, samples=64, max_segments=512,
+                 vectorized=False):
+        """
+            Fit the segments, raising ValueError if max_segments is not
+            enough. vectorized says func takes and returns sequences.
+        """
+        self.func = func
+        self.vectorized = vectorized
+        self.lo = lo
+        self.hi = hi
+        self.tolerance = tolerance
+        self.degree = degree
+        self.relative = relative
+        self.samples = samples
+        self.segments = []
+
+        pending = [(lo, hi)]
+        while pending:
+            seg_lo, seg_hi = pending.pop()
+            segment = self.fit_segment(seg_lo, seg_hi)
+            if segment.error <= tolerance:
+                self.segments.append(segment)
+            elif len(self.segments) + len(pending) + 2 > max_segments:
+                raise ValueError('{} segments of degree {} do not reach {}'.format(
+                    max_segments, degree, tolerance
+                ))
+            else:
+                split = (seg_lo + seg_hi) / 2
+                pending.extend([(split, seg_hi), (seg_lo, split)])
+        self.segments.sort(key=lambda segment: segment.lo)
+
+    def max_sample_error(self, points, approximations):
+        """Return the largest absolute or relative error of approximations at points."""
+        if self.relative:
+            return max(
+                abs(approximation - exact) / max(abs(exact), 1e-300)
+                for approximation, exact in zip(approximations, sample(self.func, points, self.vectorized))
+            )
+        return max(
+            abs(approximation - exact)
+            for approximation, exact in zip(approximations, sample(self.func, points, self.vectorized))
+        )
+
+    def fit_segment(self, lo, hi):
+        """Fit one segment and measure its error on a grid of samples."""
+        coefficients = chebyshev_monomial_coefficients(self.func, lo, hi, self.degree, self.vectorized)
+        segment = Segment(lo, hi, coefficients, 0.0)
+        points = grid(lo, hi, self.samples)
+        segment.error = self.max_sample_error(points, [segment(x) for x in points])
+        return segment
+
+    def find_segment(self, x):
+        """Return the segment covering x."""
+        lo, hi = 0, len(self.segments) - 1
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if x < self.segments[middle].hi:
+                hi = middle
+            else:
+                lo = middle + 1
+        return self.segments[lo]
+
+    def __call__(self, x):
+        return self.find_segment(x)(x)
+
+    def max_error(self, samples=None):
+        """Measure the maximum error over a dense grid spanning the whole domain."""
+        points = grid(self.lo, self.hi, samples or self.samples * len(self.segments) * 4)
+        return self.max_sample_error(points, [self(x) for x in points])
+
+    def expression_source(self, arg):
+        """
+            Return a Python expression selecting the segment for arg by binary
+            search over the breakpoints, so a row does log2(segments)
+            comparisons before its Horner polynomial.
+        """
+        # build bottom-up so deep splits do not recurse
+        nodes = [(segment.horner_source(arg), segment.lo) for segment in self.segments]
+        while len(nodes) > 1:
+            merged = []
+            for i in range(0, len(nodes) - 1, 2):
+                (left, lo), (right, split) = nodes[i], nodes[i + 1]
+                merged.append(('({}) if {} < {!r} else ({})'.format(left, arg, split, right), lo))
+            if len(nodes) % 2:
+                merged.append(nodes[-1])
+            nodes = merged
+        return nodes[0][0]
+
+    def branch_free_statements(self, arg, total='y'):
+        """
+            Return Python statements summing every segment's polynomial times
+            an indicator of its interval, (sign(arg - lo) - sign(arg - hi)) / 2,
+            into total, one statement per segment so the sum does not nest.
+            The outer segments extend to infinity. At a breakpoint both
+            neighbours weigh a half, and since both are within the error
+            bound there, so is their average.
+        """
+        if len(self.segments) == 1:
+            return ['{} = {}'.format(total, self.segments[0].horner_source(arg))]
+        statements = []
+        for k, segment in enumerate(self.segments):
+            lower = 'sign({} - {!r})'.format(arg, segment.lo) if k > 0 else '1'
+            upper = 'sign({} - {!r})'.format(arg, segment.hi) if k < len(self.segments) - 1 else '-1'
+            statements.append('{} = {}({} - {}) * 0.5 * ({})'.format(
+                total, '{} + '.format(total) if k else '', lower, upper, segment.horner_source(arg)
+            ))
+        return statements
+
+    def source(self, name, arg='x', branch_free=False):
+        """
+            Return the approximation as a Python function definition, by
+            default a tree of conditionals and with branch_free a sum over
+            all the segments that calls sign. The branch-free form evaluates
+            every segment on every row, so it only pays off with few segments.
+        """
+        if branch_free:
+            body = self.branch_free_statements(arg) + ['return y']
+            return 'def {}({}):\n{}\n'.format(name, arg, '\n'.join('    ' + line for line in body))
+        return 'def {}({}):\n    return {}\n'.format(name, arg, self.expression_source(arg))
+
+    def translate(self, name, arg='x', minimal_parentheses=True, branch_free=False):
+        """Translate the approximation into Tableau fields with ctxmathparse."""
+        mathparse = ctxmathparse.MathParse(minimal_parentheses=minimal_parentheses)
+        mathparse.parse_string(self.source(name, arg, branch_free))
+        return mathparse.translate()
+
+def count_operations(fields, roots=None):
+    """
+        Count the operators, function calls and conditionals in the fields
+        reachable from roots, i.e. the static size of the computation.
+    """
+    if roots is not None:
+        fields = ctxmathparse.reachable_fields(fields, roots)
+    return sum(formulaparse.count_operations(formula) for formula in fields.values())
+
+def row_operations(approximation, branch_free_fields=None):
+    """
+        Count the operations one row evaluates: the comparisons down the
+        tree, then Horner. A branch-free translation, given as its fields,
+        evaluates all of its operations on every row.
+    """
+    if branch_free_fields is not None:
+        return count_operations(branch_free_fields)
+    return math.ceil(math.log2(len(approximation.segments))) + 3 * approximation.degree
+
+def report(name, approximation, exact_fields, approx_fields, branch_free=False):
+    """Return lines comparing an approximation with the exact translation."""
+    exact_root = '_{}'.format(name)
+    return [
+        'segments: {} of degree {}'.format(len(approximation.segments), approximation.degree),
+        'max {} error: {:.3g} (bound {:.3g})'.format(
+            'relative' if approximation.relative else 'absolute',
+            approximation.max_error(), approximation.tolerance,
+        ),
+        'exact: {} fields, {} operations, {} characters'.format(
+            len(ctxmathparse.reachable_fields(exact_fields, [exact_root])),
+            count_operations(exact_fields, [exact_root]),
+            sum(len(formula) for formula in exact_fields.values()),
+        ),
+        'approximation: {} fields, {} operations, {} per row, {} characters'.format(
+            len(approx_fields), count_operations(approx_fields),
+            row_operations(approximation, approx_fields if branch_free else None),
+            sum(len(formula) for formula in approx_fields.values()),
+        ),
+    ]
+
+def a396_function(name, bindings):
+    """Return A396.name with bindings applied as a function of its one remaining argument."""
+    import A396
+
+    method = getattr(A396.A396, name)
+    parameters = list(inspect.signature(method).parameters)
+    if parameters and parameters[0] == 'self':
+        method = method.__get__(A396.A396())
+        parameters = parameters[1:]
+    free = [parameter for parameter in parameters if parameter not in bindings]
+    if len(free) != 1:
+        raise ValueError('{} must have exactly one unbound argument, not {}'.format(name, free))
+    return (lambda x: method(**dict(bindings, **{free[0]: x}))), free[0]
+
+def main():
+    """Approximate an A396 function from the command line and print the report and formula."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('function', nargs='?', default='tquantile')
+    parser.add_argument('--bind', action='append', default=[], metavar='ARG=VALUE')
+    parser.add_argument('--lo', type=float, default=0.0005)
+    parser.add_argument('--hi', type=float, default=0.013)
+    parser.add_argument('--tolerance', type=float, default=1e-6)
+    parser.add_argument('--degree', type=int, default=4)
+    parser.add_argument('--relative', action='store_true')
+    parser.add_argument('--branch-free', action='store_true')
+    args = parser.parse_args()
+    if not args.bind and args.function == 'tquantile':
+        args.bind = ['n=5']
+
+    bindings = {}
+    for binding in args.bind:
+        arg, _, value = binding.partition('=')
+        bindings[arg] = ast.literal_eval(value)
+    func, free = a396_function(args.function, bindings)
+
+    mathparse = libsnapshot.library_mathparse(minimal_parentheses=True)
+    exact = mathparse.specialize(args.function, bindings)
+    name = ctxmathparse.specialization_name(args.function, bindings)
+
+    approximation = PiecewiseApproximation(
+        func, args.lo, args.hi, args.tolerance, args.degree, args.relative
+    )
+    fields = approximation.translate(name + '_approx', free, branch_free=args.branch_free)
+    for line in report(name, approximation, exact, fields, args.branch_free):
+        print(line)
+    ctxmathparse.write_fields(fields.items(), sys.stdout)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+import unittest
+import math
+
+import accuracy
+
+class TestAccuracy(unittest.TestCase):
+
+    def test_axes_and_regions(self):
+        p = accuracy.Axis('p', 0.0, 1.0, 4, breaks=(0.5,))
+        self.assertEqual(p.values(), [0.125, 0.375, 0.625, 0.875])
+        n = accuracy.Axis('n', 1, 100, 10, integer=True, breaks=(2, 5))
+        # the breaks are always sampled, so every region has points
+        self.assertTrue({1, 2, 5, 100} <= set(n.values(0.3)))
+
+        routine = accuracy.Routine('f', None, [n, p])
+        regions = routine.regions()
+        self.assertEqual(sorted(regions), [
+            ((1, 2), (0.0, 0.5)), ((1, 2), (0.5, 1.0)),
+            ((2, 5), (0.0, 0.5)), ((2, 5), (0.5, 1.0)),
+            ((5, 100), (0.0, 0.5)), ((5, 100), (0.5, 1.0)),
+        ])
+        self.assertEqual(regions[((5, 100), (0.5, 1.0))][1], [0.625, 0.875])
+        self.assertIn(100, regions[((5, 100), (0.5, 1.0))][0])
+        # chunks cover the grid exactly once
+        points = [
+            (n_value, p_value) for _, values in accuracy.chunks(routine, chunk=5)
+            for n_value in values[0] for p_value in values[1]
+        ]
+        self.assertEqual(sorted(points), sorted((x, y) for x in n.values() for y in p.values()))
+
+    def test_region_statistics(self):
+        statistics = accuracy.RegionStatistics(None)
+        statistics.add_point((1,), 1.0 + 2 * math.ulp(1.0), 1.0)
+        statistics.add_point((2,), None, 3.0)
+        statistics.add_point((3,), math.inf, None, 'OverflowError')
+        self.assertEqual((statistics.points, statistics.compared), (3, 1))
+        self.assertEqual((statistics.both_null, statistics.sql_only_null, statistics.python_only_null), (1, 1, 0))
+        self.assertEqual(statistics.both_null_causes, {'OverflowError': 1})
+        self.assertEqual(statistics.max_ulp, 2.0)
+        self.assertEqual(statistics.worst[0], (1,))
+
+        other = accuracy.RegionStatistics(None)
+        other.add_point((4,), 2.5, 2.0)
+        other.add_point((5,), None, math.nan)
+        statistics.merge(other)
+        self.assertEqual((statistics.points, statistics.max_abs), (5, 0.5))
+        self.assertEqual(statistics.both_null_causes, {'OverflowError': 1, 'non-finite': 1})
+        self.assertEqual(statistics.worst, ((4,), 2.5, 2.0))
+
+    def test_tquantile_sweep(self):
+        regions, _ = accuracy.sweep('tquantile', scale=0.02, workers=0)
+        pooled, _ = accuracy.sweep('tquantile', scale=0.02, workers=2, chunk=100)
+        self.assertEqual(
+            [(s.region, s.points, s.compared, s.max_ulp) for s in regions],
+            [(s.region, s.points, s.compared, s.max_ulp) for s in pooled],
+        )
+        self.assertGreater(sum(s.compared for s in regions), 300)
+        # the translation evaluates the same operations in the same order
+        self.assertEqual(max(s.max_ulp for s in regions), 0)
+        self.assertEqual(sum(s.sql_only_null + s.python_only_null for s in regions), 0)
+        # A396.py stands in x = 99 for the normal deviate, which overflows EXP on both sides
+        # where y > 0.05 + a; only n in [3, 100) reaches that branch on this grid
+        for s in regions:
+            if not 3 <= s.region[0][0] < 100:
+                self.assertEqual(s.both_null, 0, s.region)
+            self.assertEqual(set(s.both_null_causes), {'OverflowError'} if s.both_null else set())
+        both_null = sum(s.both_null for s in regions)
+        self.assertGreater(both_null, 0)
+        lines = accuracy.report('tquantile', regions, 1.0)
+        self.assertEqual(
+            lines[len(regions) + 4], 'NULL on both sides, not compared: {} ({:.1%}), {} OverflowError'.format(
+                both_null, both_null / sum(s.points for s in regions), both_null,
+            ))
+        self.assertTrue(lines[len(regions) + 5].startswith('warning: only '))
+
+        # simplifying under ranges the whole grid lies in changes nothing
+        simplified, _ = accuracy.sweep('tquantile', scale=0.02, workers=0, ranges=['n >= 1', '0 < p < 1'])
+        self.assertEqual(
+            [(s.region, s.points, s.compared, s.max_ulp) for s in regions],
+            [(s.region, s.points, s.compared, s.max_ulp) for s in simplified],
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+import unittest
+import ast
+import io
+import json
+
+import astgen
+
+SOURCE = """
+def f(a):
+    def g(b):
+        return b + 1
+    return g(a) * 2
+
+x = f(3)
+"""
+
+class TestAstgen(unittest.TestCase):
+
+    def test_walk_matches_ast_walk(self):
+        tree = ast.parse(SOURCE)
+        self.assertEqual(
+            sorted(id(node) for _, node in astgen.walk_depth(tree)),
+            sorted(id(node) for node in ast.walk(tree))
+        )
+        self.assertEqual(max(depth for depth, _ in astgen.walk_depth(tree, max_depth=2)), 2)
+
+        # deeper than the recursion limit
+        deep = ast.Constant(value=1)
+        for _ in range(5000):
+            deep = ast.UnaryOp(op=ast.USub(), operand=deep)
+        self.assertEqual(max(depth for depth, _ in astgen.walk_depth(ast.Expression(body=deep))), 5001)
+
+    def test_text_and_filters(self):
+        sink = io.StringIO()
+        written = astgen.dump(ast.parse(SOURCE), sink, types=['FunctionDef', 'BinOp'])
+        self.assertEqual(written, 4)
+        self.assertEqual(sink.getvalue().splitlines(), [
+            "  FunctionDef name='f' @2",
+            "    FunctionDef name='g' @3",
+            "        BinOp op='Add' @4",
+            "      BinOp op='Mult' @5",
+        ])
+
+    def test_jsonl(self):
+        sink = io.StringIO()
+        astgen.dump(ast.parse('y = x.real + None'), sink, 'jsonl', chunk=2)
+        records = [json.loads(line) for line in sink.getvalue().splitlines()]
+        self.assertEqual(records[0], {'depth': 0, 'type': 'Module'})
+        self.assertIn({'depth': 3, 'type': 'Attribute', 'attr': 'real', 'lineno': 1}, records)
+        self.assertIn({'depth': 3, 'type': 'Constant', 'value': None, 'lineno': 1}, records)
+
+    def test_statistics(self):
+        statistics = astgen.TreeStatistics()
+        astgen.dump(ast.parse(SOURCE), io.StringIO(), statistics=statistics)
+        self.assertEqual(statistics.counts['FunctionDef'], 2)
+        self.assertEqual(statistics.max_depth, 6)
+        self.assertEqual(
+            statistics.function_sizes.most_common(),
+            [('f@2', sum(1 for _ in ast.walk(ast.parse(SOURCE).body[0]))), ('g@3', 9)]
+        )
+
+if __name__ == '__main__':
+    unittest.main()
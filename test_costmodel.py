@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+import unittest
+
+import costmodel
+import ctxmathparse
+import mathparse
+
+class TestCostModel(unittest.TestCase):
+
+    def test_operation_counts(self):
+        self.assertEqual(
+            costmodel.operation_counts('IF [_a] < 0 THEN -[_a] ELSEIF [_a] > 1 THEN SQRT([_a]) ELSE [_a] ^ 2 / 3 END'),
+            {'branch': 2, 'compare': 2, 'add': 1, 'transcendental': 1, 'pow': 1, 'div': 1}
+        )
+        # lower-case Python names and ** as mathparse.TranslatorVisitor renders them
+        self.assertEqual(costmodel.operation_counts('(exp([_x]) ** 2)'), {'transcendental': 1, 'pow': 1})
+        self.assertEqual(costmodel.operation_counts('ABS([_x]) * 2'), {'call': 1, 'mul': 1})
+        # a negated operand of ^, as the translators write (-x)**2 in either parentheses style
+        for formula in ['-[_a] ^ [_b]', '(-[_x] ** 2)', '(-[_x]) ^ 2', '-([_x] ^ 2)']:
+            self.assertEqual(costmodel.operation_counts(formula), {'pow': 1, 'add': 1}, formula)
+        self.assertEqual(costmodel.operation_counts('2 ^ -[_a] ^ 3 * 2'), {'pow': 2, 'add': 1, 'mul': 1})
+        for minimal_parentheses in (False, True):
+            mathparse_ctx = ctxmathparse.MathParse(minimal_parentheses=minimal_parentheses)
+            mathparse_ctx.add_module('def f(a, b):\n    return (-a) ** b - -a ** 2\n')
+            model = costmodel.CostModel({'add': 1, 'pow': 5})
+            self.assertEqual(model.function_costs(mathparse_ctx.link(['f']), ['f']), {'f': 13})
+
+    def test_field_and_transitive_costs(self):
+        model = costmodel.CostModel({'add': 1, 'mul': 2})
+        fields = {
+            '_a': 'x',
+            '_b': '[_a] * [_a]',
+            '_c': '[_b] + [_a]',
+            '_d': '[_b] * [_c]',
+        }
+        self.assertEqual(model.field_costs(fields), {'_a': 0, '_b': 2, '_c': 1, '_d': 2})
+        # _b is shared by _c and _d but evaluated once
+        self.assertEqual(model.transitive_costs(fields), {'_a': 0, '_b': 2, '_c': 3, '_d': 5})
+        self.assertEqual(model.roots_cost(fields, ['_c']), 3)
+
+    def test_score_translations(self):
+        source = 'def f(a):\n    b = a * a\n    return b + b\n\ndef g(a):\n    return f(a) + f(a + 1)\n'
+        mathparse_ctx = ctxmathparse.MathParse()
+        mathparse_ctx.add_module(source)
+        fields = mathparse_ctx.link(['f', 'g'])
+        model = costmodel.CostModel({'add': 1, 'mul': 2})
+        self.assertEqual(model.function_costs(fields, ['f', 'g']), {'f': 3, 'g': 8})
+        self.assertTrue(model.report(fields, ['f', 'g'])[1].startswith('function g: 8.0'))
+
+        rendered = mathparse.StaticMathParse.render_expression(mathparse.ast.parse('a * b ** 2', mode='eval').body)
+        self.assertEqual(model.formula_cost(rendered), 2 + model.weights['pow'])
+
+        self.assertEqual(model.formula_cost('sum(x for x in y)'), 0)
+        self.assertEqual(model.unparsed, {'sum(x for x in y)'})
+
+    def test_weight_profiles(self):
+        # a transcendental against the multiplications that could replace it
+        cheap, expensive = '[_x] * [_x] * [_x] * [_x]', 'EXP([_x])'
+        hyper = costmodel.CostModel()
+        self.assertEqual(hyper.weights, costmodel.HYPER_WEIGHTS)
+        self.assertGreater(hyper.formula_cost(expensive), hyper.formula_cost(cheap))
+        sqlite = costmodel.CostModel(profile='sqlite')
+        self.assertLess(sqlite.formula_cost(expensive), sqlite.formula_cost(cheap))
+        self.assertEqual(costmodel.CostModel({'pow': 3}, 'sqlite').weights, dict(costmodel.SQLITE_WEIGHTS, pow=3))
+
+    def test_calibrate(self):
+        weights = costmodel.calibrate(rows=2000, repeat=1)
+        self.assertEqual(set(weights), set(costmodel.OPERATION_CLASSES))
+        self.assertEqual(weights['add'], 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,8 +2,11 @@
 
 import unittest
 import ast
+import concurrent.futures
+import io
 
 import ctxmathparse
+import libsnapshot
 
 class TestMathParse(unittest.TestCase):
 
@@ -124,32 +127,535 @@ def f(a, x, y):
             }
         )
 
-#    def test_if(self):
-#        f = """
-#def f(a, x, y):
-#    a = x * y
-#    if x > 9:
-#        a += 8
-#    else:
-#        a = a
-#    return a + 7
-#"""
-#
-#        mpctx = ctxmathparse.MathParse()
-#        mpctx.parse_string(f)
-#        print(mpctx.objast)
-#        self.assertEqual(mpctx.translate(), {
-#                "_f_arg_a": "a",
-#                "_f_arg_x": "x",
-#                "_f_arg_y": "y",
-#                "_f_stmt_0": "([_f_arg_x] * [_f_arg_y])",
-#                "_f_stmt_1_t": "([_f_stmt_0] + 8)",
-#                "_f_stmt_1_f": "[_f_stmt_0]",
-#                "_f_stmt_1": "IF ([_f_arg_x] > 9) THEN [_f_stmt_1_t] ELSE [_f_stmt_1_f] END",
-#                "_f_stmt_2": "([_f_stmt_1] + 7)",
-#                "_f": "[_f_stmt_2]"
-#            }
-#        )
+    def test_if(self):
+        f = """
+def f(a, x, y):
+    a = x * y
+    if x > 9:
+        a += 8
+    else:
+        a = a
+    return a + 7
+"""
+
+        mpctx = ctxmathparse.MathParse()
+        mpctx.parse_string(f)
+        self.assertEqual(mpctx.translate(), {
+                "_f_arg_a": "a",
+                "_f_arg_x": "x",
+                "_f_arg_y": "y",
+                "_f_stmt_0": "([_f_arg_x] * [_f_arg_y])",
+                "_f_stmt_1": "([_f_arg_x] > 9)",
+                "_f_stmt_1_then_stmt_0": "([_f_stmt_0] + 8)",
+                "_f_stmt_1_else_stmt_0": "[_f_stmt_0]",
+                "_f_stmt_1_var_a": "IF [_f_stmt_1] THEN [_f_stmt_1_then_stmt_0] ELSE [_f_stmt_1_else_stmt_0] END",
+                "_f_stmt_2": "([_f_stmt_1_var_a] + 7)",
+                "_f": "[_f_stmt_2]"
+            }
+        )
+
+    def test_if_early_return_and_constant_condition(self):
+        f = """
+def g(n, p):
+    if n < 1:
+        raise ValueError("Invalid argument")
+    elif n == 2:
+        return p * 2
+    k = 3
+    if k > 2:
+        p = p + k
+    return p / n
+"""
+
+        mpctx = ctxmathparse.MathParse()
+        mpctx.parse_string(f)
+        self.assertEqual(mpctx.translate(), {
+                "_g_arg_n": "n",
+                "_g_arg_p": "p",
+                "_g_stmt_0": "([_g_arg_n] < 1)",
+                "_g_stmt_0_then_stmt_0": "NULL",
+                "_g_stmt_0_else_stmt_0": "([_g_arg_n] == 2)",
+                "_g_stmt_0_else_stmt_0_then_stmt_0": "([_g_arg_p] * 2)",
+                "_g_stmt_0_returned": "IF [_g_stmt_0] THEN TRUE ELSE [_g_stmt_0_else_stmt_0] END",
+                "_g_stmt_0_return": "IF [_g_stmt_0] THEN [_g_stmt_0_then_stmt_0] ELSE [_g_stmt_0_else_stmt_0_then_stmt_0] END",
+                "_g_stmt_1": "3",
+                "_g_stmt_2_then_stmt_0": "([_g_arg_p] + 3)",
+                "_g_stmt_3": "IF [_g_stmt_0_returned] THEN [_g_stmt_0_return] ELSE ([_g_stmt_2_then_stmt_0] / [_g_arg_n]) END",
+                "_g": "[_g_stmt_3]"
+            }
+        )
+
+    def test_if_shares_branch_fields(self):
+        f = """
+def h(x):
+    if x > 0:
+        y = x * 2
+        z = x * 3
+    else:
+        y = x
+    return y + z + y
+"""
+
+        mpctx = ctxmathparse.MathParse()
+        mpctx.parse_string(f)
+        translated = mpctx.translate()
+        self.assertEqual(translated["_h_stmt_0_var_y"], "IF [_h_stmt_0] THEN [_h_stmt_0_then_stmt_0] ELSE [_h_stmt_0_else_stmt_0] END")
+        self.assertEqual(translated["_h_stmt_0_var_z"], "IF [_h_stmt_0] THEN [_h_stmt_0_then_stmt_1] ELSE NULL END")
+        self.assertEqual(translated["_h_stmt_1"], "(([_h_stmt_0_var_y] + [_h_stmt_0_var_z]) + [_h_stmt_0_var_y])")
+
+    def test_specialize(self):
+        f = """
+def f(n, p):
+    if n < 1 or p <= 0:
+        return 0
+    a = 1 / (n - 0.5)
+    if n == 2:
+        return p * a
+    return p / a + n
+"""
+
+        mpctx = ctxmathparse.MathParse()
+        mpctx.parse_string(f)
+        self.assertEqual(mpctx.specialize('f', {'n': 2}), {
+                "_f_n_2_arg_p": "p",
+                "_f_n_2_stmt_0": "([_f_n_2_arg_p] <= 0)",
+                "_f_n_2_stmt_0_then_stmt_0": "0",
+                "_f_n_2_stmt_2_then_stmt_0": "IF [_f_n_2_stmt_0] THEN [_f_n_2_stmt_0_then_stmt_0] ELSE ([_f_n_2_arg_p] * 0.6666666666666666) END",
+                "_f_n_2": "[_f_n_2_stmt_2_then_stmt_0]"
+            }
+        )
+        self.assertEqual(mpctx.specialize('f', {'n': 5, 'p': 0.5}), {
+                "_f_n_5_p_0p5_stmt_3": "7.25",
+                "_f_n_5_p_0p5": "[_f_n_5_p_0p5_stmt_3]"
+            }
+        )
+
+        self.assertEqual(set(mpctx.specializations), {('f', (('n', 2),)), ('f', (('n', 5), ('p', 0.5)))})
+        mpctx.specializations[('f', (('n', 2),))]['_f_n_2'] = 'cached'
+        self.assertEqual(mpctx.specialize('f', {'n': 2})['_f_n_2'], 'cached')
+
+        with self.assertRaises(KeyError):
+            mpctx.specialize('f', {'q': 1})
+
+        # n < 1 decides the guard though p is unknown, so only its return is left
+        self.assertEqual(libsnapshot.library_mathparse().specialize('tquantile', {'n': 0}), {
+                "_tquantile_n_0_stmt_0_then_stmt_0": "NULL",
+                "_tquantile_n_0": "[_tquantile_n_0_stmt_0_then_stmt_0]"
+            }
+        )
+        for source, expected in [('p < 1 < 0', False), ('n > 1 and p', False), ('p or n == 0', True)]:
+            expr = ctxmathparse.objectify_string(source)['Module']['body'][0]['Expr']['value']
+            self.assertIs(ctxmathparse.fold_expression(expr, {'n': 0}), expected)
+        with self.assertRaises(ctxmathparse.NotConstant):
+            ctxmathparse.fold_expression(ctxmathparse.objectify_string('p < 1 < n')['Module']['body'][0]['Expr']['value'], {'n': 2})
+
+    def test_hoist_parameter_expressions(self):
+        f = """
+def f(n, p):
+    a = 1 / (n - 0.5)
+    b = 48 / a ** 2
+    x = a * p
+    y = x ** (2 / n)
+    if y > 0.05 + a:
+        y = y * b
+    return sqrt(n * y) + p
+"""
+
+        mpctx = ctxmathparse.MathParse()
+        mpctx.parse_string(f)
+        mpctx.mark_parameters('f', ['n'], '{{FIXED : MIN({})}}')
+        self.assertEqual(mpctx.translate(), {
+                "_f_arg_n": "n",
+                "_f_arg_p": "p",
+                "_f_stmt_0": "{FIXED : MIN((1 / ([_f_arg_n] - 0.5)))}",
+                "_f_stmt_1": "{FIXED : MIN((48 / ([_f_stmt_0] ^ 2)))}",
+                "_f_stmt_2": "([_f_stmt_0] * [_f_arg_p])",
+                "_f_stmt_3_param_0": "{FIXED : MIN((2 / [_f_arg_n]))}",
+                "_f_stmt_3": "([_f_stmt_2] ^ [_f_stmt_3_param_0])",
+                "_f_stmt_4_param_0": "{FIXED : MIN((0.05 + [_f_stmt_0]))}",
+                "_f_stmt_4": "([_f_stmt_3] > [_f_stmt_4_param_0])",
+                "_f_stmt_4_then_stmt_0": "([_f_stmt_3] * [_f_stmt_1])",
+                "_f_stmt_4_var_y": "IF [_f_stmt_4] THEN [_f_stmt_4_then_stmt_0] ELSE [_f_stmt_3] END",
+                "_f_stmt_5": "(SQRT(([_f_arg_n] * [_f_stmt_4_var_y])) + [_f_arg_p])",
+                "_f": "[_f_stmt_5]"
+            }
+        )
+
+        mpctx.mark_parameters('f', ['n'])
+        self.assertEqual(mpctx.translate()["_f_stmt_3_param_0"], "(2 / [_f_arg_n])")
+
+        with self.assertRaises(KeyError):
+            mpctx.mark_parameters('f', ['q'])
+
+    def test_find_dependencies(self):
+        expr = ctxmathparse.objectify_string("sqrt(a * n) + b")['Module']['body'][0]['Expr']['value']
+        scope = {'a': frozenset({'n'}), 'n': frozenset({'n'}), 'b': frozenset({'n', 'p'})}
+        self.assertEqual(ctxmathparse.find_dependencies(expr, scope), {'n', 'p'})
+        self.assertEqual(ctxmathparse.find_dependencies(expr['BinOp']['left'], scope), {'n'})
+
+    def test_translate_string_stream(self):
+        f = """
+def f1(x):
+    return x + 9
+
+y = 5
+
+def f2(x):
+    return x * 99
+"""
+        mpctx = ctxmathparse.MathParse()
+        stream = mpctx.translate_string_stream(f)
+        self.assertEqual(next(stream), ("_f1_arg_x", "x"))
+        self.assertEqual(list(stream), [
+                ("_f1_stmt_0", "([_f1_arg_x] + 9)"),
+                ("_f1", "[_f1_stmt_0]"),
+                ("_f2_arg_x", "x"),
+                ("_f2_stmt_0", "([_f2_arg_x] * 99)"),
+                ("_f2", "[_f2_stmt_0]")
+            ]
+        )
+        self.assertEqual(mpctx.objast, None)
+
+        module = ast.parse(f)
+        functions = ctxmathparse.iter_module_functions(module)
+        self.assertEqual(next(functions).name, "f1")
+        self.assertEqual(module.body[0], None)
+        self.assertTrue(isinstance(module.body[2], ast.FunctionDef))
+
+        mpctx.parse_string(f)
+        streamed = list(mpctx.translate_stream())
+        # nothing streamed is retained, while translate keeps its results
+        self.assertEqual([func.translations for func in mpctx.function_list], [{}, {}])
+        self.assertEqual(streamed, list(mpctx.translate().items()))
+        self.assertEqual([len(func.translations) for func in mpctx.function_list], [1, 1])
+
+        sink = io.StringIO()
+        self.assertEqual(ctxmathparse.write_fields(mpctx.translate_string_stream(f), sink), 6)
+        self.assertEqual(sink.getvalue().splitlines()[:3], [
+                "_f1_arg_x: x",
+                "_f1_stmt_0: ([_f1_arg_x] + 9)",
+                "_f1: [_f1_stmt_0]"
+            ]
+        )
+
+    def test_minimal_parentheses(self):
+        f = """
+def f(q, p):
+    a = (q * 2 + 1) * q + -p ** 2
+    if a > 0 and not p < q - 1:
+        a = a - (q - p)
+    return a / (q * p)
+"""
+
+        mpctx = ctxmathparse.MathParse(minimal_parentheses=True)
+        mpctx.parse_string(f)
+        self.assertEqual(mpctx.translate(), {
+                "_f_arg_q": "q",
+                "_f_arg_p": "p",
+                "_f_stmt_0": "([_f_arg_q] * 2 + 1) * [_f_arg_q] + -([_f_arg_p] ^ 2)",
+                "_f_stmt_1": "[_f_stmt_0] > 0 AND NOT [_f_arg_p] < [_f_arg_q] - 1",
+                "_f_stmt_1_then_stmt_0": "[_f_stmt_0] - ([_f_arg_q] - [_f_arg_p])",
+                "_f_stmt_1_var_a": "IF [_f_stmt_1] THEN [_f_stmt_1_then_stmt_0] ELSE [_f_stmt_0] END",
+                "_f_stmt_2": "[_f_stmt_1_var_a] / ([_f_arg_q] * [_f_arg_p])",
+                "_f": "[_f_stmt_2]"
+            }
+        )
+
+        mathparse = ctxmathparse.ASTMathParse('t')
+        mathparse.minimal_parentheses = True
+        mathparse.parse_string('x = (99 + b) * b + c')
+        self.assertEqual(mathparse.translate_statements(), {
+                '_t:stmt0': '(99 + [_t:b]) * [_t:b] + [_t:c]',
+                '_t:x': '[_t:stmt0]'
+            }
+        )
+
+    def test_reassociate(self):
+        mpctx = ctxmathparse.MathParse(minimal_parentheses=True, reassociate=True)
+        mpctx.parse_string('def f(a, b):\n    return a + b + 1 + a * b * 2 * a - b\n')
+        self.assertEqual(mpctx.translate()['_f_stmt_0'], '[_f_arg_a] + [_f_arg_b] + (1 + [_f_arg_a] * [_f_arg_b] * (2 * [_f_arg_a])) - [_f_arg_b]')
+
+        # a sum too deep to translate as Python groups it
+        f = 'def f(x):\n    y = {}\n    return y * 2\n'.format(' + '.join('x * {}'.format(k) for k in range(2000)))
+        with self.assertRaises(RecursionError):
+            ctxmathparse.MathParse().parse_string(f)
+        for minimal_parentheses in (False, True):
+            mpctx = ctxmathparse.MathParse(minimal_parentheses=minimal_parentheses, reassociate=True)
+            mpctx.add_module(f)
+            fields = mpctx.link(['f'])
+            self.assertEqual(fields['_f_stmt_0'].count('[_f_arg_x] * '), 2000)
+            self.assertEqual(fields['_f'], '[_f_stmt_1]')
+
+    def test_eliminate_dead_stores(self):
+        f = """
+def f(a):
+    b = a * 2
+    b = a * 3
+    c = b + 1
+    if b > 1:
+        b = b + 1
+    return b
+"""
+        translated = {}
+        for eliminate_dead_stores in (False, True):
+            mpctx = ctxmathparse.MathParse(eliminate_dead_stores=eliminate_dead_stores)
+            mpctx.parse_string(f)
+            translated[eliminate_dead_stores] = mpctx.translate()
+        # the other statements keep their numbers
+        self.assertEqual(set(translated[False]) - set(translated[True]), {'_f_stmt_0', '_f_stmt_2'})
+        self.assertEqual(translated[True]['_f_stmt_3'], '([_f_stmt_1] > 1)')
+
+    def test_link_reachable_functions(self):
+        mpctx = ctxmathparse.MathParse()
+        mpctx.add_module("""
+def h(a):
+    return sin(a) ** 2 + cos(a) ** 2
+
+def unused(q):
+    return q
+""")
+        mpctx.add_module("""
+class K:
+    def m(self, a):
+        return self.h(a) * h(1 - a) + h(a)
+""")
+        self.assertEqual(mpctx.call_graph(), {'h': [], 'unused': [], 'm': ['h']})
+        self.assertEqual(mpctx.reachable_functions(['m']), ['h', 'm'])
+        self.assertEqual(mpctx.link(['m']), {
+                "_m_arg_a": "a",
+                "_m_h_1_arg_a": "[_m_arg_a]",
+                "_m_h_1_stmt_0": "((SIN([_m_h_1_arg_a]) ^ 2) + (COS([_m_h_1_arg_a]) ^ 2))",
+                "_m_h_1": "[_m_h_1_stmt_0]",
+                "_m_h_2_arg_a": "(1 - [_m_arg_a])",
+                "_m_h_2_stmt_0": "((SIN([_m_h_2_arg_a]) ^ 2) + (COS([_m_h_2_arg_a]) ^ 2))",
+                "_m_h_2": "[_m_h_2_stmt_0]",
+                "_m_stmt_0": "(([_m_h_1] * [_m_h_2]) + [_m_h_1])",
+                "_m": "[_m_stmt_0]"
+            }
+        )
+        self.assertEqual(mpctx.function_index['unused'].fields, {})
+
+        with self.assertRaises(KeyError):
+            mpctx.link(['missing'])
+
+        mpctx.add_module("""
+def r(x):
+    return s(x)
+
+def s(x):
+    return r(x - 1)
+""")
+        with self.assertRaises(ValueError):
+            mpctx.link(['r'])
+
+    def test_content_addressed_fields(self):
+        f = """
+def f(x, y):
+    a = x * y
+    return a + 5
+
+def g(x, y):
+    b = x * y
+    return b + 5 + x
+"""
+        mpctx = ctxmathparse.MathParse(content_addressed=True)
+        mpctx.parse_string(f)
+        self.assertEqual(mpctx.translate(), {
+                "_c_11f6ad8ec52a": "x",
+                "_c_95cb0bfd2977": "y",
+                "_c_5287e28dd499": "([_c_11f6ad8ec52a] * [_c_95cb0bfd2977])",
+                "_c_7d515cd0a7ee": "([_c_5287e28dd499] + 5)",
+                "_c_4587e284c980": "(([_c_5287e28dd499] + 5) + [_c_11f6ad8ec52a])",
+                "_f": "[_c_7d515cd0a7ee]",
+                "_g": "[_c_4587e284c980]"
+            }
+        )
+
+        mpctx = ctxmathparse.MathParse(content_addressed=True)
+        mpctx.parse_string(f.replace("b + 5 + x", "b - 1"))
+        translated = mpctx.translate()
+        self.assertEqual(translated["_f"], "[_c_7d515cd0a7ee]")
+        self.assertEqual(translated["_c_7d515cd0a7ee"], "([_c_5287e28dd499] + 5)")
+
+    def test_content_address_statements(self):
+        mathparse = ctxmathparse.ASTMathParse('t')
+        mathparse.parse_string('x = 99 * b\ny = x * 38 + 15')
+        fields, names = ctxmathparse.content_address_fields(mathparse.translate_statements(), ['_t:y'])
+        self.assertEqual(names['_t:x'], names['_t:stmt0'])
+        self.assertEqual(fields, {
+                names['_t:stmt0']: '(99 * [_t:b])',
+                names['_t:stmt1']: '(([{}] * 38) + 15)'.format(names['_t:x']),
+                '_t:y': '[{}]'.format(names['_t:stmt1'])
+            }
+        )
+        self.assertEqual(ctxmathparse.field_dependency_order({'_a': '[_b] + [_c]', '_c': '[_b]', '_b': '1'}), ['_b', '_c', '_a'])
+
+    def test_provenance(self):
+        f = """def f(a, b):
+    x = a * 2
+    if a > b:
+        x = x + \\
+            b
+    return helper(x) + 1
+
+def helper(y):
+    return y * y
+"""
+
+        mpctx = ctxmathparse.MathParse(track_provenance=True)
+        mpctx.add_module(f)
+        fields = mpctx.link(['f'])
+        self.assertEqual(
+            {name: sorted(mpctx.provenance[name]) for name in fields}, {
+                "_f_arg_a": [(1, 1)],
+                "_f_arg_b": [(1, 1)],
+                "_f_stmt_0": [(2, 2)],
+                "_f_stmt_1": [(3, 3)],
+                "_f_stmt_1_then_stmt_0": [(4, 5)],
+                "_f_stmt_1_var_x": [(3, 5)],
+                "_f_helper_1_arg_y": [(6, 6)],
+                "_f_helper_1_stmt_0": [(9, 9)],
+                "_f_helper_1": [(9, 9)],
+                "_f_stmt_2": [(6, 6)],
+                "_f": [(6, 6)],
+            }
+        )
+
+        report = mpctx.provenance_report(fields, f)
+        self.assertEqual(report[-1].split(), ['1', '0', 'ops', '2', 'chars', '2', 'fields', 'def', 'f(a,', 'b):'])
+        self.assertIn('return helper(x) + 1', ''.join(report))
+
+        self.assertEqual(ctxmathparse.MathParse().objast, None)
+        plain = ctxmathparse.MathParse()
+        plain.parse_string(f)
+        plain.translate()
+        self.assertEqual(plain.provenance, {})
+
+    def test_provenance_merges(self):
+        fields = {'_a': '[_x] * 2', '_b': '[_x] * 2', '_c': '[_a]'}
+        provenance = {
+            '_a': frozenset([(1, 1)]), '_b': frozenset([(4, 5)]), '_c': frozenset([(9, 9)])
+        }
+        merged, names = ctxmathparse.content_address_fields(fields)
+        self.assertEqual(
+            ctxmathparse.merge_provenance(provenance, names, fields),
+            {names['_a']: frozenset([(1, 1), (4, 5)])}
+        )
+
+        costs = ctxmathparse.line_costs(
+            {'_a': '[_x] * 2 + 1', '_b': 'SQRT([_a])', '_z': '1'},
+            {'_a': frozenset([(1, 1), (2, 3)]), '_b': frozenset([(2, 3)])}
+        )
+        self.assertEqual(costs, {
+            (1, 1): {'fields': 1, 'operations': 2, 'length': 12},
+            (2, 3): {'fields': 2, 'operations': 3, 'length': 22},
+            None: {'fields': 1, 'operations': 0, 'length': 1},
+        })
+
+    def test_pure_translation(self):
+        source = (
+            'def h(a):\n'
+            '    b = a * a\n'
+            '    if b > 1:\n'
+            '        return b\n'
+            '    return 1 - b\n'
+            'def g(x):\n'
+            '    return h(x) + h(x + 1)\n'
+        )
+        mpctx = ctxmathparse.MathParse()
+        mpctx.add_module(source)
+        expected = mpctx.link(['g'])
+        g = mpctx.function_index['g']
+        translation = g.translation()
+        # the result is immutable, leaves the function's own state alone and is memoized
+        self.assertEqual(dict(translation.fields), expected)
+        self.assertEqual(translation.result_fields, ('_g_stmt_0',))
+        self.assertEqual((g.localvars, g.fields, g.call_sites), ({}, {}, {}))
+        self.assertIs(g.translation(), translation)
+        self.assertEqual(mpctx.link(['g']), expected)
+        # a setting the translation depends on gets its own entry
+        g.minimal_parentheses = True
+        self.assertIsNot(g.translation(), translation)
+        self.assertEqual(g.translation().fields[-1], ('_g', '[_g_stmt_0]'))
+
+        # so does a redefined callee
+        mpctx.add_module('def h(a):\n    return a - 100\n')
+        fields = mpctx.link(['g'])
+        self.assertEqual(fields['_g_h_1_stmt_0'], '([_g_h_1_arg_a] - 100)')
+        self.assertNotIn('_g_h_1_stmt_0_then_stmt_0', fields)
+
+    def test_translate_on_executor(self):
+        source = ''.join(
+            'def f{0}(x, y):\n'
+            '    z = x * {0} + y\n'
+            '    if z > y:\n'
+            '        z = z - y\n'
+            '    return z / (1 + x)\n'.format(k)
+            for k in range(6)
+        )
+        mpctx = ctxmathparse.MathParse(minimal_parentheses=True)
+        mpctx.parse_string(source)
+        expected = list(mpctx.translate().items())
+        for pool in (concurrent.futures.ThreadPoolExecutor, concurrent.futures.ProcessPoolExecutor):
+            mpctx = ctxmathparse.MathParse(minimal_parentheses=True)
+            mpctx.parse_string(source)
+            with pool(2) as executor:
+                self.assertEqual(list(mpctx.translate(executor).items()), expected)
+            # results from the pool are memoized on the functions
+            self.assertEqual(
+                [len(func.translations) for func in mpctx.function_list], [1] * len(mpctx.function_list)
+            )
+
+    def test_multiple_outputs(self):
+        f = """
+def cumgam(x, a):
+    if x <= 0:
+        return 0, 1
+    s = x * a + 1
+    cum = s / (s + 1)
+    return cum, 1 - cum
+
+def chi2(x, df):
+    a = lo = df * 0.5
+    cum, ccum = cumgam(x * 0.5, a)
+    a, lo = lo + 1, a
+    return cum - ccum + a * lo
+"""
+
+        mpctx = ctxmathparse.MathParse(minimal_parentheses=True)
+        mpctx.add_module(f)
+        self.assertEqual(mpctx.link(['cumgam']), {
+                "_cumgam_arg_x": "x",
+                "_cumgam_arg_a": "a",
+                "_cumgam_stmt_0": "[_cumgam_arg_x] <= 0",
+                "_cumgam_stmt_0_then_stmt_0_out_0": "0",
+                "_cumgam_stmt_0_then_stmt_0_out_1": "1",
+                "_cumgam_stmt_1": "[_cumgam_arg_x] * [_cumgam_arg_a] + 1",
+                "_cumgam_stmt_2": "[_cumgam_stmt_1] / ([_cumgam_stmt_1] + 1)",
+                "_cumgam_stmt_3_out_0": "IF [_cumgam_stmt_0] THEN [_cumgam_stmt_0_then_stmt_0_out_0] ELSE [_cumgam_stmt_2] END",
+                "_cumgam_stmt_3_out_1": "IF [_cumgam_stmt_0] THEN [_cumgam_stmt_0_then_stmt_0_out_1] ELSE 1 - [_cumgam_stmt_2] END",
+                "_cumgam_out_0": "[_cumgam_stmt_3_out_0]",
+                "_cumgam_out_1": "[_cumgam_stmt_3_out_1]",
+            }
+        )
+
+        fields = mpctx.link(['chi2'])
+        # one clone of cumgam serves both unpacked outputs
+        self.assertEqual(len([name for name in fields if name.endswith('_stmt_2')]), 1)
+        self.assertEqual(fields['_chi2_stmt_0'], '[_chi2_arg_df] * 0.5')
+        self.assertEqual(fields['_chi2_stmt_2_elt_0'], '[_chi2_stmt_0] + 1')
+        self.assertEqual(fields['_chi2_stmt_2_elt_1'], '[_chi2_stmt_0]')
+        self.assertEqual(
+            fields['_chi2_stmt_3'],
+            '[_chi2_cumgam_1_out_0] - [_chi2_cumgam_1_out_1] + [_chi2_stmt_2_elt_0] * [_chi2_stmt_2_elt_1]'
+        )
+
+        with self.assertRaises(ValueError):
+            ctxmathparse.MathParse().parse_string('def f(a):\n    if a:\n        return a, a\n    return a\n')
+        mpctx = ctxmathparse.MathParse()
+        mpctx.add_module('def g(a):\n    return a, a\n\ndef h(a):\n    return g(a) + 1\n')
+        with self.assertRaises(ValueError):
+            mpctx.link(['h'])
 
     def test_find_modified_symbols(self):
         f = """
@@ -233,9 +739,9 @@ return x + 5
 
     def test_bind_symbols_in_context(self):
         ctx0 = ctxmathparse.ASTMathParse('ctx0')
-        ctx0.symbols.add('a')
+        ctx0.add_symbols({'a'})
         ctx1 = ctx0.create_child_context('ctx1')
-        ctx1.symbols.add('b')
+        ctx1.add_symbols({'b'})
         self.assertEqual(ctx0.qualified_context_name, 'ctx0')
         self.assertEqual(ctx1.qualified_context_name, 'ctx0:ctx1')
         self.assertEqual(ctx0.resolve_symbol('a'), '_ctx0:a')
@@ -244,6 +750,43 @@ return x + 5
         with self.assertRaises(KeyError):
             ctx0.resolve_symbol('b')
 
+    def test_resolve_symbol_cache(self):
+        root = ctxmathparse.ASTMathParse('root')
+        root.add_symbols({'a'})
+        context = root
+        for depth in range(2000):
+            context = context.create_child_context('c{}'.format(depth))
+        self.assertEqual(context.resolve_symbol('a'), '_root:a')
+        self.assertIs(context.resolve_symbol('a'), context.resolved['a'])
+        with self.assertRaises(AttributeError):
+            root.symbols.add('b') # changes go through the context, which counts them
+
+        # defining the symbol closer in invalidates the cached resolution
+        version = context.version
+        context.parent.add_symbols({'a'})
+        self.assertEqual(context.version, version + 1)
+        self.assertEqual(context.resolve_symbol('a'), context.parent.symbol_prefix + 'a')
+        context.parent.symbols = set()
+        self.assertEqual(context.resolve_symbol('a'), '_root:a')
+        root.discard_symbols({'a'})
+        with self.assertRaises(KeyError):
+            context.resolve_symbol('a')
+
+        # changes in other branches, or below, keep the cache
+        root.add_symbols({'a'})
+        self.assertEqual(context.resolve_symbol('a'), '_root:a')
+        cache, version = context.resolved, context.version
+        sibling = root.create_child_context('sibling')
+        sibling.add_symbols({'a'})
+        context.create_child_context('leaf').symbols = {'a'}
+        self.assertEqual(sibling.resolve_symbol('a'), '_root:sibling:a')
+        self.assertEqual(context.resolve_symbol('a'), '_root:a')
+        self.assertIs(context.resolved, cache)
+        self.assertEqual(context.version, version)
+        root.add_symbols({'b'})
+        self.assertEqual(context.resolve_symbol('a'), '_root:a')
+        self.assertIsNot(context.resolved, cache)
+
     def test_separate_out_statements(self):
         mathparse = ctxmathparse.ASTMathParse()
         mathparse.parse_string("x + 5")
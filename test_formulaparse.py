@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+import unittest
+
+import formulaparse
+
+class TestFormulaParse(unittest.TestCase):
+
+    def test_precedence(self):
+        self.assertEqual(formulaparse.parse_formula('[_a] + 2 * [_b]'), (
+            'binary', '+', ('field', '_a'), ('binary', '*', ('number', '2'), ('field', '_b'))
+        ))
+        # Tableau negates before it exponentiates
+        self.assertEqual(formulaparse.parse_formula('-x ^ 2'), (
+            'binary', '^', ('unary', '-', ('column', 'x')), ('number', '2')
+        ))
+        self.assertEqual(formulaparse.parse_formula('-(x ^ 2)'), (
+            'unary', '-', ('binary', '^', ('column', 'x'), ('number', '2'))
+        ))
+        self.assertEqual(formulaparse.parse_formula('2 ^ -x ^ 3'), (
+            'binary', '^', ('number', '2'), ('binary', '^', ('unary', '-', ('column', 'x')), ('number', '3'))
+        ))
+        self.assertEqual(formulaparse.parse_formula('a - b - c'), (
+            'binary', '-', ('binary', '-', ('column', 'a'), ('column', 'b')), ('column', 'c')
+        ))
+        self.assertEqual(formulaparse.parse_formula('NOT a == 1 OR b'), (
+            'binary', 'OR',
+            ('unary', 'NOT', ('binary', '==', ('column', 'a'), ('number', '1'))),
+            ('column', 'b'),
+        ))
+
+    def test_calls_and_conditionals(self):
+        self.assertEqual(formulaparse.parse_formula('IF [_c] THEN SQRT((x)) ELSE PI() END'), (
+            'if',
+            ((('field', '_c'), ('call', 'SQRT', (('column', 'x'),))),),
+            ('call', 'PI', ()),
+        ))
+        self.assertEqual(formulaparse.parse_formula('IF a THEN NULL ELSEIF b THEN "x""y" END'), (
+            'if',
+            ((('column', 'a'), ('null',)), (('column', 'b'), ('string', 'x"y'))),
+            None,
+        ))
+        self.assertEqual(formulaparse.parse_formula('LOG(x, 2)'), (
+            'call', 'LOG', (('column', 'x'), ('number', '2'))
+        ))
+
+    def test_deep_formula(self):
+        formula = '(' * 2000 + 'x' + ' + 1)' * 2000
+        tree = formulaparse.parse_formula(formula)
+        self.assertEqual(sum(1 for _ in formulaparse.iter_nodes(tree)), 4001)
+
+    def test_count_operations(self):
+        self.assertEqual(formulaparse.count_operations('[_a]'), 0)
+        self.assertEqual(formulaparse.count_operations('-[_a] * SQRT(2) + 1'), 4)
+        self.assertEqual(formulaparse.count_operations('IF [_c] > 0 THEN [_a] ELSE NULL END'), 2)
+
+    def test_render_round_trip(self):
+        for formula in [
+            '-(x ^ 2)', '(-x) ^ 2', '2 ^ (-x)', '2 ^ 3 ^ 4', '(2 ^ 3) ^ 4', 'a - (b - c)', 'a * -b', '- -x',
+            'NOT (a AND b) OR c', '(NOT a) == 1', 'IF [_c] > 0 THEN "x""y" ELSEIF b THEN NULL ELSE TRUE END',
+            'LOG(x, 2) / (PI() * 2)',
+        ]:
+            self.assertEqual(formulaparse.render_formula(formulaparse.parse_formula(formula)), formula)
+        self.assertEqual(formulaparse.render_formula(formulaparse.parse_formula('((a + b)) * (c)')), '(a + b) * c')
+        self.assertEqual(formulaparse.render_formula(formulaparse.parse_formula('-x ^ 2')), '(-x) ^ 2')
+        # the translators' renderings of (-x)**2 and -x**2 in both parentheses styles
+        for formula, rendered in [('(-[_x] ^ 2)', '(-[_x]) ^ 2'), ('(-[_x]) ^ 2', '(-[_x]) ^ 2'),
+                                  ('-([_x] ^ 2)', '-([_x] ^ 2)')]:
+            tree = formulaparse.parse_formula(formula)
+            self.assertEqual(formulaparse.render_formula(tree), rendered)
+            self.assertEqual(formulaparse.parse_formula(rendered), tree)
+        formula = '(' * 2000 + 'x' + ' - 1)' * 2000
+        self.assertEqual(formulaparse.render_formula(formulaparse.parse_formula(formula)), 'x' + ' - 1' * 2000)
+
+    def test_syntax_errors(self):
+        for formula in ['(a', 'a)', 'a +', 'IF a THEN b', 'a, b', '$']:
+            with self.assertRaises(formulaparse.FormulaSyntaxError):
+                formulaparse.parse_formula(formula)
+
+if __name__ == '__main__':
+    unittest.main()
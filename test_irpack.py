@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import tempfile
+
+import ctxmathparse
+import irpack
+
+SOURCE = """
+def f(a, b):
+    return a * b + 1.5
+
+class Library:
+    def g(self, x):
+        if x < -0.0:
+            return f(x, 2 ** 70)
+        return f(x, None)
+"""
+
+class TestIRPack(unittest.TestCase):
+
+    def test_round_trip(self):
+        roots = irpack.module_roots(SOURCE, positions=True)
+        library = irpack.IRPack(irpack.pack(roots))
+        self.assertEqual(library.roots(), ['f', 'g'])
+        for name in roots:
+            self.assertEqual(library.materialize(name), roots[name])
+
+        value = {'X': {'values': [None, True, False, 0, -1, 2 ** 70, -0.0, 0.0, 1e300, 'é'], 'empty': []}}
+        materialized = irpack.IRPack(irpack.pack({'v': value})).materialize('v')
+        self.assertEqual(materialized, value)
+        self.assertEqual(repr(materialized['X']['values'][6]), '-0.0')
+        self.assertIs(materialized['X']['values'][1], True)
+
+        with self.assertRaises(TypeError):
+            irpack.pack({'bad': {'X': {'value': b'bytes'}}})
+
+    def test_lazy_views(self):
+        library = irpack.IRPack(irpack.pack(irpack.module_roots(SOURCE)))
+        node = library['g']
+        self.assertEqual(node.type, 'FunctionDef')
+        self.assertEqual(node.fields()[:2], ['name', 'args'])
+        self.assertEqual(node['name'], 'g')
+        body = node['body']
+        self.assertEqual(len(body), 2)
+        self.assertEqual(body[-1].type, 'Return')
+        self.assertEqual(
+            library.materialize(body[1]),
+            {'Return': {'value': library.materialize(body[1]['value'])}}
+        )
+        self.assertEqual(body[1]['value']['func']['id'], 'f')
+        with self.assertRaises(KeyError):
+            node['missing']
+
+    def test_shared_subtrees(self):
+        one = irpack.pack({'a': ctxmathparse.objectify_string('x * y + 1')})
+        two = irpack.pack({
+            'a': ctxmathparse.objectify_string('x * y + 1'),
+            'b': ctxmathparse.objectify_string('x * y + 1'),
+        })
+        # the second copy only costs a root entry and its name
+        self.assertLessEqual(len(two) - len(one), 12)
+
+    def test_mmap_and_translate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'library.irpk')
+            irpack.write(path, irpack.module_roots(SOURCE))
+            with irpack.IRPack.open(path) as library:
+                mathparse = ctxmathparse.MathParse()
+                mathparse.index_functions(irpack.load_functions(library))
+                packed = mathparse.link(['g'])
+
+        mathparse = ctxmathparse.MathParse()
+        mathparse.add_module(SOURCE)
+        self.assertEqual(packed, mathparse.link(['g']))
+
+        with self.assertRaises(irpack.IRPackError):
+            irpack.IRPack(b'IRPX' + bytes(40))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import ctxmathparse
+import libsnapshot
+
+class TestLibrarySnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'A396.snapshot')
+        libsnapshot.build(output=self.path, functions=['tquantile', 'normdev_appx'])
+        with open(libsnapshot.LIBRARY_SOURCE) as source:
+            self.source = source.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def source_mathparse(self, **options):
+        mathparse = ctxmathparse.MathParse(**options)
+        mathparse.add_module(self.source)
+        return mathparse
+
+    def test_link_matches_source(self):
+        library = libsnapshot.LibrarySnapshot(self.path)
+        self.assertIsNone(library.pack)
+        for minimal_parentheses in (False, True):
+            mathparse = ctxmathparse.MathParse(minimal_parentheses=minimal_parentheses, library=library)
+            self.assertEqual(
+                mathparse.link(['tquantile', 'ltqnorm']),
+                self.source_mathparse(minimal_parentheses=minimal_parentheses).link(['tquantile', 'ltqnorm'])
+            )
+        # tquantile came precompiled; ltqnorm had no translation and was linked from its objast
+        self.assertEqual(mathparse.library_functions, {'ltqnorm'})
+        self.assertEqual(
+            mathparse.specialize('tquantile', {'n': 5}),
+            self.source_mathparse(minimal_parentheses=True).specialize('tquantile', {'n': 5})
+        )
+
+    def test_calls_into_library(self):
+        source = 'def q(p):\n    return normdev_appx(p) * 2\n'
+        mathparse = ctxmathparse.MathParse(library=libsnapshot.LibrarySnapshot(self.path))
+        mathparse.parse_string(source)
+        fields = mathparse.translate()
+
+        expected = ctxmathparse.MathParse()
+        expected.add_module(self.source + '\n' + source)
+        self.assertEqual(fields, expected.link(['q']))
+
+        # a local definition shadows the library
+        mathparse = ctxmathparse.MathParse(library=libsnapshot.LibrarySnapshot(self.path))
+        mathparse.parse_string('def normdev_appx(p):\n    return p\n\n' + source)
+        self.assertEqual(mathparse.translate()['_normdev_appx_stmt_0'], '[_normdev_appx_arg_p]')
+
+    def test_stale_and_missing(self):
+        changed = os.path.join(self.directory, 'A396.py')
+        with open(changed, 'w') as sink:
+            sink.write(self.source + '\n# changed\n')
+        with self.assertRaises(libsnapshot.SnapshotError):
+            'tquantile' in libsnapshot.LibrarySnapshot(self.path, source_path=changed)
+
+        missing = libsnapshot.LibrarySnapshot(os.path.join(self.directory, 'missing'), missing_ok=True)
+        self.assertFalse(missing.available())
+        mathparse = ctxmathparse.MathParse(library=missing)
+        mathparse.parse_string('def q(p):\n    return tquantile(5, p)\n')
+        self.assertEqual(mathparse.translate()['_q_stmt_0'], 'tquantile(5, [_q_arg_p])')
+
+    def test_source_fallback(self):
+        source = 'def q(p):\n    return normdev_appx(p) * 2\n'
+        expected = ctxmathparse.MathParse(library=libsnapshot.LibrarySnapshot(self.path))
+        expected.parse_string(source)
+        mathparse = ctxmathparse.MathParse(library=libsnapshot.SourceLibrary())
+        mathparse.parse_string(source)
+        self.assertEqual(mathparse.translate(), expected.translate())
+
+        saved = libsnapshot.DEFAULT_LIBRARY, libsnapshot.SOURCE_LIBRARY
+        try:
+            libsnapshot.DEFAULT_LIBRARY = libsnapshot.LibrarySnapshot(self.path)
+            self.assertIs(libsnapshot.current_library(), libsnapshot.DEFAULT_LIBRARY)
+            libsnapshot.DEFAULT_LIBRARY = libsnapshot.LibrarySnapshot(
+                os.path.join(self.directory, 'missing'), missing_ok=True)
+            self.assertIsInstance(libsnapshot.current_library(), libsnapshot.SourceLibrary)
+        finally:
+            libsnapshot.DEFAULT_LIBRARY, libsnapshot.SOURCE_LIBRARY = saved
+
+if __name__ == '__main__':
+    unittest.main()
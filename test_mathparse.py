@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import unittest
+import unittest.mock
 import ast
 
 import mathparse
@@ -65,6 +66,187 @@ class TestMathParse(unittest.TestCase):
             'some_goofy_tuple_thing([_x], [_y], [_z])'
         )
 
+    def test_render_minimal_parentheses(self):
+        cases = {
+            'x = 99 * b': '99 * [_b]',
+            'y = x + 17 * dag + yo / ribbit + frobnitz': '[_x] + 17 * [_dag] + [_yo] / [_ribbit] + [_frobnitz]',
+            'y = a - (b - c) - (d + e)': '[_a] - ([_b] - [_c]) - ([_d] + [_e])',
+            'y = a / (b * c) * d': '[_a] / ([_b] * [_c]) * [_d]',
+            'y = -x ** 2 + (-x) ** 2': '-([_x] ** 2) + (-[_x]) ** 2',
+            'y = x ** y ** z': '[_x] ** ([_y] ** [_z])',
+            'y = f(a + b, (c + d) * 2)': 'f([_a] + [_b], ([_c] + [_d]) * 2)',
+            'y = a < b + 1 or not c and d': '[_a] < [_b] + 1 OR NOT [_c] AND [_d]',
+        }
+        for source, expected in cases.items():
+            stmt = ast.parse(source).body[0]
+            self.assertEqual(
+                mathparse.StaticMathParse.render_expression(stmt.value, minimal_parentheses=True),
+                expected
+            )
+
+        horner = ast.parse('(((((c0*q+c1)*q+c2)*q+c3)*q+c4)*q+c5)/((((d0*q+d1)*q+d2)*q+d3)*q+1)').body[0].value
+        self.assertLess(
+            len(mathparse.StaticMathParse.render_expression(horner, minimal_parentheses=True)),
+            len(mathparse.StaticMathParse.render_expression(horner))
+        )
+
+    def test_render_deep_chain_without_recursion(self):
+        chain = ast.Name(id='x0', ctx=ast.Load())
+        for i in range(1, 20000):
+            chain = ast.BinOp(left=chain, op=ast.Sub(), right=ast.Name(id='x{}'.format(i), ctx=ast.Load()))
+        rendered = mathparse.StaticMathParse.render_expression(chain, minimal_parentheses=True)
+        self.assertTrue(rendered.startswith('[_x0] - [_x1] - '))
+        self.assertNotIn('(', rendered)
+
+    def test_render_negation(self):
+        stmt = ast.parse('y = -7.5 * q + -x').body[0]
+        self.assertEqual(mathparse.StaticMathParse.render_expression(stmt.value), '((-7.5 * [_q]) + -[_x])')
+
+    def test_reassociate_balances_chains(self):
+        stmt = ast.parse('y = ' + ' + '.join('x{}'.format(i) for i in range(900))).body[0]
+        self.assertGreaterEqual(mathparse.expression_depth(stmt.value), 900)
+        with self.assertRaises(RecursionError):
+            mathparse.StaticMathParse.render_expression(stmt.value)
+
+        balanced = mathparse.StaticMathParse.reassociate_expression(stmt.value)
+        self.assertLessEqual(mathparse.expression_depth(balanced), 12)
+        rendered = mathparse.StaticMathParse.render_expression(balanced)
+        self.assertEqual(rendered.count('[_x'), 900)
+        self.assertTrue(rendered.startswith('((((((((([_x0] + ([_x1] + [_x2]))'))
+
+        stmt = ast.parse('y = f(a + b + c + d, a * b * c * d * e) - (x + y + z)').body[0]
+        self.assertEqual(
+            mathparse.StaticMathParse.render_expression(
+                mathparse.StaticMathParse.reassociate_expression(stmt.value)
+            ),
+            '(f((([_a] + [_b]) + ([_c] + [_d])), (([_a] * [_b]) * ([_c] * ([_d] * [_e])))) - ([_x] + ([_y] + [_z])))'
+        )
+
+    def test_reassociate_strict_fp(self):
+        stmt = ast.parse('y = a + b + c + d + (1 + 2 + 3 + 4)').body[0]
+        self.assertEqual(
+            mathparse.StaticMathParse.render_expression(
+                mathparse.StaticMathParse.reassociate_expression(stmt.value, strict_fp=True)
+            ),
+            '(((([_a] + [_b]) + [_c]) + [_d]) + ((1 + 2) + (3 + 4)))'
+        )
+
+    def test_reassociate_shared_nodes(self):
+        # x = x + x + i, repeated, shares each x between two parents as substitution does;
+        # walking every path would take 2 ** 60 steps
+        def shared_chain(n):
+            x = ast.BinOp(left=ast.Name(id='a', ctx=ast.Load()), op=ast.Add(), right=ast.Name(id='b', ctx=ast.Load()))
+            for i in range(1, n + 1):
+                x = ast.BinOp(left=ast.BinOp(left=x, op=ast.Add(), right=x), op=ast.Add(), right=ast.Constant(i))
+            return x
+
+        balanced = mathparse.StaticMathParse.reassociate_expression(shared_chain(60))
+        # x + x + i became x + (x + i), still sharing x
+        self.assertIs(balanced.left, balanced.right.left)
+        strict = mathparse.StaticMathParse.reassociate_expression(shared_chain(60), strict_fp=True)
+        self.assertIs(strict.left.left, strict.left.right)
+
+        expected = eval(compile(ast.fix_missing_locations(ast.Expression(shared_chain(5))), '<test>', 'eval'),
+                        {'a': 0.1, 'b': 0.7})
+        for strict_fp in (False, True):
+            balanced = mathparse.StaticMathParse.reassociate_expression(shared_chain(5), strict_fp)
+            self.assertEqual(
+                eval(compile(ast.fix_missing_locations(ast.Expression(balanced)), '<test>', 'eval'), {'a': 0.1, 'b': 0.7}),
+                expected,
+            )
+
+    def test_split_assignments(self):
+        stmts = list(
+            mathparse.StaticMathParse.substitution_wrapper(
+                mathparse.StaticMathParse.split_assignments(
+                    mathparse.StaticMathParse.unwrap_module_statements(
+                        ast.parse('x = 2 * b\na, c = x + 1, x * 3\np = q = a + c\na, c = c, a\nu, v = f(a)')
+                    )
+                )
+            )
+        )
+        self.assertEqual(
+            [
+                (ast.unparse(stmt.targets[0]), mathparse.StaticMathParse.render_expression(stmt.value, True))
+                for stmt in stmts
+            ], [
+                ('x', '2 * [_b]'),
+                ('a', '2 * [_b] + 1'),
+                ('c', '2 * [_b] * 3'),
+                ('p', '2 * [_b] + 1 + 2 * [_b] * 3'),
+                ('q', '2 * [_b] + 1 + 2 * [_b] * 3'),
+                ('_elt_4_0', '2 * [_b] * 3'),
+                ('_elt_4_1', '2 * [_b] + 1'),
+                ('a', '2 * [_b] * 3'),
+                ('c', '2 * [_b] + 1'),
+                ('(u, v)', 'f(2 * [_b] * 3)'),
+            ]
+        )
+
+    def test_eliminate_dead_stores(self):
+        def live(source, outputs=None):
+            return [
+                ast.unparse(stmt) for stmt in mathparse.StaticMathParse.eliminate_dead_stores(
+                    mathparse.StaticMathParse.substitution_wrapper(
+                        mathparse.StaticMathParse.unwrap_module_statements(ast.parse(source))
+                    ), outputs
+                )
+            ]
+
+        source = 'x = 99\nd = 2 * p\nx = d * p\nc = 1\nc = c + x\ny = c * c'
+        self.assertEqual(live(source), ['d = 2 * p', 'x = 2 * p * p', 'c = 1 + 2 * p * p', 'y = (1 + 2 * p * p) * (1 + 2 * p * p)'])
+        self.assertEqual(live(source, ['y']), ['y = (1 + 2 * p * p) * (1 + 2 * p * p)'])
+        self.assertEqual(live(source, ()), [])
+        # unpacking is live if any of its names is
+        self.assertEqual(live('w = 2\nz = q * w\na, b = f(z)', ['a']), ['a, b = f(q * 2)'])
+
+    def test_render_memo(self):
+        source = 'x = a\n' + 'x = x * x + 1\n' * 12
+        stmts = list(mathparse.StaticMathParse.substitution_wrapper(iter(ast.parse(source).body)))
+        for minimal in (False, True):
+            memo = mathparse.RenderMemo()
+            rendered = [
+                mathparse.StaticMathParse.render_expression(stmt.value, minimal, memo) for stmt in stmts
+            ]
+            self.assertEqual(rendered, [
+                mathparse.StaticMathParse.render_expression(stmt.value, minimal) for stmt in stmts
+            ])
+            # each statement adds a BinOp, a BinOp and a Constant; the x * x operands are one node
+            self.assertEqual(len(memo), 1 + 3 * 12)
+        self.assertIsNone(mathparse.TranslatorVisitor.memo)
+
+        # without a memo of its own, one expression still renders each shared node once
+        source = 'x = a\n' + 'x = x * x + 1\n' * 20
+        stmts = list(mathparse.StaticMathParse.substitution_wrapper(iter(ast.parse(source).body)))
+        for minimal in (False, True):
+            with unittest.mock.patch.object(mathparse.RenderMemo, 'put', autospec=True,
+                                            side_effect=mathparse.RenderMemo.put) as put:
+                rendered = mathparse.StaticMathParse.render_expression(stmts[-1].value, minimal)
+            self.assertEqual(put.call_count, 1 + 3 * 20)
+            self.assertEqual(rendered.count('[_a]'), 2 ** 20)
+
+        # the memo only sees nodes changing when told
+        memo = mathparse.RenderMemo()
+        expr = ast.parse('a + b * c').body[0].value
+        self.assertEqual(mathparse.StaticMathParse.render_expression(expr, memo=memo), '([_a] + ([_b] * [_c]))')
+        expr.right.right = ast.Name(id='d', ctx=ast.Load())
+        self.assertEqual(mathparse.StaticMathParse.render_expression(expr, memo=memo), '([_a] + ([_b] * [_c]))')
+        memo.invalidate(expr)
+        memo.invalidate(expr.right)
+        self.assertEqual(mathparse.StaticMathParse.render_expression(expr, memo=memo), '([_a] + ([_b] * [_d]))')
+        memo.invalidate()
+        self.assertEqual(len(memo), 0)
+
+    def test_output_expressions(self):
+        stmt = ast.parse('return y, a * c').body[0]
+        self.assertEqual(
+            {
+                name: mathparse.StaticMathParse.render_expression(expr)
+                for name, expr in mathparse.StaticMathParse.output_expressions('f', stmt).items()
+            },
+            {'_f_out_0': '[_y]', '_f_out_1': '([_a] * [_c])'}
+        )
+
     def test_identify_substituting_context(self):
         myast = ast.parse('x = 99 * b\ny = x + 17 * dag + yo / ribbit + frobnitz\na,b,c=some_goofy_tuple_thing(x, y, z)\nx = 33 + y\ny = 7 / x')
         stmts = list(mathparse.StaticMathParse.unwrap_module_statements(myast))
@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+
+import unittest
+import asyncio
+import concurrent.futures
+import json
+import threading
+
+import libsnapshot
+import mathserver
+
+class BlockingTranslator:
+    """Counts calls and holds each translation until released."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self, source, options):
+        self.calls += 1
+        self.release.wait(5)
+        return mathserver.translate_source(source, options)
+
+class TestTranslationService(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(4)
+
+    async def asyncTearDown(self):
+        self.executor.shutdown(wait=True)
+
+    async def test_translate(self):
+        service = mathserver.TranslationService(self.executor)
+        fields = await service.translate('def f(a, b):\n    return a * b + 1\n')
+        self.assertEqual(fields['_f_stmt_0'], '(([_f_arg_a] * [_f_arg_b]) + 1)')
+
+        minimal = await service.translate(
+            'def f(a, b):\n    return a * b + 1\n', {'minimal_parentheses': True}
+        )
+        self.assertEqual(minimal['_f_stmt_0'], '[_f_arg_a] * [_f_arg_b] + 1')
+
+        with self.assertRaises(ValueError):
+            await service.translate('def f(a):\n    return a\n', {'bogus': True})
+        with self.assertRaises(TypeError):
+            await service.translate('def f(a):\n    return a\n', ['minimal_parentheses'])
+        for value in ['no', 'false', 0, None]:
+            with self.assertRaises(TypeError):
+                await service.translate('def f(a):\n    return a\n', {'minimal_parentheses': value})
+
+        # long sums need their chains rebalanced to translate
+        source = 'def f(a):\n    return {}\n'.format(' + '.join(['a'] * 1000))
+        with self.assertRaises(RecursionError):
+            await service.translate(source)
+        fields = await service.translate(source, {'reassociate': True})
+        self.assertEqual(fields['_f_stmt_0'].count('[_f_arg_a]'), 1000)
+
+        # folding stops short of integers too large to compute
+        fields = await service.translate('def f(a):\n    return 9 ** 9 ** 9 + a\n')
+        self.assertEqual(fields['_f_stmt_0'], '((9 ^ 387420489) + [_f_arg_a])')
+
+    async def test_translate_without_snapshot(self):
+        # library calls are linked from A396.py when the snapshot cannot be used
+        saved = libsnapshot.DEFAULT_LIBRARY
+        libsnapshot.DEFAULT_LIBRARY = libsnapshot.LibrarySnapshot('/nonexistent/A396.snapshot', missing_ok=True)
+        try:
+            fields = mathserver.translate_source('def q(p):\n    return tquantile(5, p)\n')
+        finally:
+            libsnapshot.DEFAULT_LIBRARY = saved
+        self.assertEqual(fields['_q_stmt_0'], '[_q_tquantile_1]')
+        self.assertIn('_q_tquantile_1_stmt_0', fields)
+
+    async def test_coalesce_and_cache(self):
+        translator = BlockingTranslator()
+        service = mathserver.TranslationService(self.executor, translator=translator)
+        source = 'def f(a):\n    return a + 1\n'
+
+        requests = [asyncio.ensure_future(service.translate(source)) for _ in range(10)]
+        await asyncio.sleep(0.05)
+        translator.release.set()
+        results = await asyncio.gather(*requests)
+        self.assertEqual(translator.calls, 1)
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(service.stats['coalesced'], 9)
+
+        await service.translate(source)
+        self.assertEqual(translator.calls, 1)
+        self.assertEqual(service.stats['cache_hits'], 1)
+
+    async def test_lru_eviction(self):
+        service = mathserver.TranslationService(self.executor, cache_size=2)
+        sources = ['def f(a):\n    return a + {}\n'.format(i) for i in range(3)]
+        for source in sources:
+            await service.translate(source)
+        await service.translate(sources[1])
+        self.assertEqual(len(service.cache), 2)
+        self.assertNotIn((sources[0], ()), service.cache)
+        self.assertIn((sources[1], ()), service.cache)
+
+    async def test_supersede_session(self):
+        translator = BlockingTranslator()
+        service = mathserver.TranslationService(self.executor, translator=translator)
+        old = asyncio.ensure_future(service.translate('def f(a):\n    return a\n', session='s'))
+        await asyncio.sleep(0.01)
+        new = asyncio.ensure_future(service.translate('def f(a):\n    return a + 1\n', session='s'))
+        await asyncio.sleep(0.01)
+        translator.release.set()
+
+        with self.assertRaises(mathserver.Superseded):
+            await old
+        self.assertEqual((await new)['_f_stmt_0'], '([_f_arg_a] + 1)')
+        self.assertEqual(service.stats['superseded'], 1)
+        self.assertEqual(service.sessions, {})
+        self.assertEqual(service.superseded, set())
+
+        # cancelled for any other reason, e.g. shutdown, a request stays cancelled
+        translator.release.clear()
+        other = asyncio.ensure_future(service.translate('def f(a):\n    return a + 2\n', session='s'))
+        await asyncio.sleep(0.01)
+        other.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await other
+        translator.release.set()
+
+        # the superseded translation still finishes and is cached for later
+        while service.pending:
+            await asyncio.sleep(0.01)
+        self.assertIn(('def f(a):\n    return a\n', ()), service.cache)
+
+    async def test_abandon_queued(self):
+        # one worker, held by the first translation, so the next one queues
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        translator = BlockingTranslator()
+        service = mathserver.TranslationService(executor, translator=translator)
+        running = asyncio.ensure_future(service.translate('def f(a):\n    return a\n', session='s'))
+        await asyncio.sleep(0.01)
+        queued = asyncio.ensure_future(service.translate('def f(a):\n    return a + 1\n', session='t'))
+        await asyncio.sleep(0.01)
+        new = asyncio.ensure_future(service.translate('def f(a):\n    return a + 2\n', session='t'))
+        await asyncio.sleep(0.01)
+
+        with self.assertRaises(mathserver.Superseded):
+            await queued
+        self.assertEqual(service.stats['abandoned'], 1)
+        self.assertNotIn(('def f(a):\n    return a + 1\n', ()), service.pending)
+        translator.release.set()
+        self.assertEqual((await new)['_f_stmt_0'], '([_f_arg_a] + 2)')
+        await running
+        self.assertEqual(translator.calls, 2)
+        self.assertEqual(service.waiters, {})
+
+        # the same source asked again is translated afresh
+        self.assertEqual((await service.translate('def f(a):\n    return a + 1\n'))['_f_stmt_0'],
+                         '([_f_arg_a] + 1)')
+        executor.shutdown(wait=True)
+
+class TestTranslationServer(unittest.IsolatedAsyncioTestCase):
+
+    async def post(self, port, path, payload):
+        body = json.dumps(payload).encode('utf-8')
+        return await self.send(
+            port, 'POST {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(path, len(body)).encode('latin-1') + body
+        )
+
+    async def send(self, port, data):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(data)
+        await writer.drain()
+        result = await self.read_response(reader)
+        writer.close()
+        await writer.wait_closed()
+        return result
+
+    async def read_response(self, reader):
+        status = (await reader.readline()).decode('latin-1').split(' ', 2)[1]
+        length = 0
+        while True:
+            header = await reader.readline()
+            if header == b'\r\n':
+                break
+            name, _, value = header.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        return int(status), json.loads(await reader.readexactly(length))
+
+    async def test_http(self):
+        server = mathserver.TranslationServer(mathserver.TranslationService())
+        port = await server.start(port=0)
+        try:
+            status, response = await self.post(port, '/translate', {
+                'source': 'def g(x):\n    return -x\n',
+                'session': 'editor-1',
+            })
+            self.assertEqual(status, 200)
+            self.assertEqual(response['fields']['_g_stmt_0'], '-[_g_arg_x]')
+
+            status, response = await self.post(port, '/translate', {'source': 'def g(:'})
+            self.assertEqual(status, 400)
+
+            status, response = await self.post(port, '/elsewhere', {})
+            self.assertEqual(status, 404)
+
+            for payload in [['def g(x):\n    return x\n'], 'def g(x):\n    return x\n', {'source': 1},
+                            {'source': 'def g(x):\n    return x\n', 'options': ['minimal_parentheses']},
+                            {'source': 'def g(x):\n    return x\n', 'session': ['editor-1']}]:
+                status, response = await self.post(port, '/translate', payload)
+                self.assertEqual(status, 400, payload)
+                self.assertTrue(response['error'].startswith('TypeError: '), response)
+
+            # requests that cannot be framed get an answer before the connection closes
+            for data in [b'garbage\r\n\r\n', b'POST /translate HTTP/1.1\r\nContent-Length: x\r\n\r\n']:
+                status, response = await self.send(port, data)
+                self.assertEqual(status, 400, data)
+                self.assertTrue(response['error'].startswith('BadRequest: '), response)
+
+            # a source too deeply nested to parse fails alone, and the connection carries on
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            for source in ['def g(x):\n    return {}x\n'.format('-' * 3000), 'def g(x):\n    return x\n']:
+                body = json.dumps({'source': source}).encode('utf-8')
+                writer.write('POST /translate HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(
+                    len(body)).encode('latin-1') + body)
+            await writer.drain()
+            status, response = await self.read_response(reader)
+            self.assertEqual(status, 500)
+            self.assertTrue(response['error'].startswith('RecursionError: '), response)
+            status, response = await self.read_response(reader)
+            self.assertEqual((status, response['fields']['_g']), (200, '[_g_stmt_0]'))
+            writer.close()
+            await writer.wait_closed()
+        finally:
+            await server.close()
+
+if __name__ == '__main__':
+    unittest.main()
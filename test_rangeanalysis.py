@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+import math
+import sqlite3
+import unittest
+
+import costmodel
+import ctxmathparse
+import libsnapshot
+import rangeanalysis
+import sqlrender
+
+class TestRangeAnalysis(unittest.TestCase):
+
+    def simplify(self, formula, *declarations):
+        fields = {'_a': 'a', '_b': 'b', '_x': formula}
+        return rangeanalysis.simplify(fields, rangeanalysis.declare(*declarations))['_x']
+
+    def test_declarations(self):
+        ranges = rangeanalysis.declare('0 < p < 1', 'n >= 1', '10 >= n', 'k == 2')
+        self.assertEqual(ranges['p'].low, 5e-324)
+        self.assertEqual(ranges['p'].high, math.nextafter(1.0, 0.0))
+        self.assertEqual((ranges['n'].low, ranges['n'].high), (1.0, 10.0))
+        self.assertEqual(ranges['k'].point(), 2.0)
+        self.assertFalse(ranges['p'].nullable)
+        for declaration in ['p', '0 < 1', 'p < q', '1 < p < 0']:
+            with self.assertRaises(ValueError):
+                rangeanalysis.declare(declaration)
+        with self.assertRaises(ValueError):
+            rangeanalysis.declare('n > 1', 'n < 0')
+
+    def test_decisions(self):
+        self.assertEqual(self.simplify('[_a] < 0 OR [_a] > 1.0', '0 < a < 1'), 'FALSE')
+        self.assertEqual(self.simplify('[_a] <= 0', '0 < a < 1'), 'FALSE')
+        self.assertEqual(self.simplify('[_a] <= 0', '0 <= a < 1'), '[_a] <= 0')
+        self.assertEqual(self.simplify('1 - [_a] > 0', '0 <= a < 1'), 'TRUE')
+        self.assertEqual(self.simplify('ABS([_a] - 2) + SIGN([_a] - 5)', '0 <= a <= 1'), '-([_a] - 2) + -1')
+        self.assertEqual(self.simplify('ABS([_a] - 2)', '0 <= a <= 3'), 'ABS([_a] - 2)')
+        self.assertEqual(self.simplify('ABS([_a] - 2)', 'a <= 2'), '-([_a] - 2)')
+        self.assertEqual(self.simplify('MIN([_a], [_b]) * 1', 'a < 0', 'b >= 0'), '[_a]')
+        self.assertEqual(self.simplify('MIN([_a], [_b]) * 1', 'a < 1', 'b >= 0'), 'MIN([_a], [_b])')
+        self.assertEqual(self.simplify('MAX([_a] ^ 2, [_b])', '0 <= a <= 2', 'b > 4'), '[_b]')
+        self.assertEqual(self.simplify('IF [_a] < 1 THEN 2 * 3.5 ELSEIF [_b] THEN [_a] ELSE 0 END', 'a < 1'), '7')
+        self.assertEqual(self.simplify('IF [_a] > 1 THEN [_b] ELSEIF [_b] > 2 THEN [_a] END', 'a < 1'),
+                         'IF [_b] > 2 THEN [_a] END')
+        self.assertEqual(self.simplify('IF [_b] > 2 THEN [_a] ELSE [_a] END'), '[_a]')
+        self.assertEqual(self.simplify('EXP([_a]) > 0 AND SQRT([_a]) >= 0', 'a >= 0'), 'TRUE')
+        self.assertEqual(self.simplify('[_a] ^ (2 / 3) > 0', 'a > 0'), 'TRUE')
+        self.assertEqual(self.simplify('[_a] ^ 2 >= 0', 'a > -5'), 'TRUE')
+        self.assertEqual(self.simplify('- -[_a] == 3', 'a > 4'), 'FALSE')
+
+    def test_nulls_are_kept(self):
+        # undeclared columns may be NULL, and so may a division by a range containing zero
+        self.assertEqual(self.simplify('[_a] > 0 OR [_b] > 0', '0 < a < 1'), 'TRUE')
+        self.assertEqual(self.simplify('[_a] > 0 AND [_b] > 0', '0 < a < 1'), '[_b] > 0')
+        self.assertEqual(self.simplify('1 / [_a] > -1', '-1 < a < 1'), '1 / [_a] > -1')
+        self.assertEqual(self.simplify('SQRT([_a]) >= 0', '-1 < a < 1'), 'SQRT([_a]) >= 0')
+        self.assertEqual(self.simplify('LN([_a]) > 5', '0 <= a < 1'), 'LN([_a]) > 5')
+        self.assertEqual(self.simplify('LN([_a]) > 5', '0 < a < 1'), 'FALSE')
+        self.assertEqual(self.simplify('MIN([_a], [_b])', 'a < 0'), 'MIN([_a], [_b])')
+        self.assertEqual(self.simplify('IF [_a] > 0 THEN NULL ELSE 1 END', 'a > 0'), 'NULL')
+        self.assertEqual(self.simplify('(-2) ^ [_a] > 0', 'a > 0'), '(-2) ^ [_a] > 0')
+
+    def test_negated_powers(self):
+        source = (
+            'def f(x):\n    if (-x) ** 2 > 0.5:\n        return 1\n    else:\n        return 2\n'
+            'def g(x):\n    if -x ** 2 > 0.5:\n        return 1\n    else:\n        return 2\n'
+        )
+        namespace = {}
+        exec(source, namespace)
+        for minimal_parentheses in (False, True):
+            mathparse = ctxmathparse.MathParse(minimal_parentheses=minimal_parentheses)
+            mathparse.add_module(source)
+            fields = mathparse.link(['f', 'g'])
+            simplified = rangeanalysis.simplify(fields, rangeanalysis.declare('1 < x < 2'), ['_f', '_g'])
+            for name in ('f', 'g'):
+                expected = {namespace[name](x) for x in (1.01, 1.5, 1.99)}
+                self.assertEqual(expected, {1 if name == 'f' else 2})
+                self.assertEqual(simplified['_{}_stmt_0_return'.format(name)], str(expected.pop()))
+
+    def test_tquantile_unchanged(self):
+        fields = libsnapshot.library_mathparse(minimal_parentheses=True).link(['tquantile'])
+        roots = costmodel.function_roots(fields, 'tquantile')
+        connection = sqlite3.connect(':memory:')
+        sqlrender.register_math_functions(connection)
+        connection.execute('CREATE TABLE points (id INTEGER PRIMARY KEY, n REAL, p REAL)')
+        for declarations, ns in [(['n >= 1', '0 < p < 1'], range(1, 40)), (['n >= 5', '0 < p < 1'], range(5, 80))]:
+            analysis = rangeanalysis.RangeAnalysis(rangeanalysis.declare(*declarations))
+            simplified = analysis.simplify(fields, roots)
+            self.assertIn('_tquantile_stmt_0_return', analysis.rewritten)
+            self.assertNotIn('_tquantile_stmt_0', simplified)
+            model = costmodel.CostModel()
+            self.assertLess(model.roots_cost(simplified, roots), model.roots_cost(fields, roots))
+
+            connection.execute('DELETE FROM points')
+            connection.executemany('INSERT INTO points VALUES (?, ?, ?)', [
+                (k, n, p) for k, (n, p) in enumerate((n, (j + 0.5) / 97) for n in ns for j in range(97))
+            ])
+            results = [
+                connection.execute(sqlrender.render_query(
+                    translation, {'value': '_tquantile'}, 'points', keep=['id'], materialized=True,
+                ) + ' ORDER BY id').fetchall()
+                for translation in (fields, simplified)
+            ]
+            self.assertEqual(results[0], results[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+import unittest
+import sqlite3
+
+import ctxmathparse
+import sqlrender
+
+class TestSQLRender(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        sqlrender.register_math_functions(self.connection)
+        self.connection.execute('CREATE TABLE inputs (id INTEGER PRIMARY KEY, a REAL, b INTEGER)')
+        self.rows = [(1, 0.5, 3), (2, 4.0, -2), (3, 9.0, 0), (4, -1.0, 7)]
+        self.connection.executemany('INSERT INTO inputs VALUES (?, ?, ?)', self.rows)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def translate(self, source, entry):
+        mathparse = ctxmathparse.MathParse()
+        mathparse.add_module(source)
+        return mathparse.link([entry])
+
+    def test_render_expressions(self):
+        renderer = sqlrender.SQLRenderer({
+            '_x': 'IF [_c] THEN [_a] ^ 2 ELSE -[_b] / 2 END',
+            '_y': 'LOG([_a], 2) + MOD(7, 3) % 2',
+            '_z': 'NOT [_a] == "it\'s" AND [_b] != TRUE',
+        })
+        self.assertEqual(renderer.render_field('_x'),
+            'CASE WHEN "_c" THEN POWER("_a", 2) ELSE (CAST((-"_b") AS REAL) / 2) END')
+        self.assertEqual(renderer.render_field('_y'), '(LOG(2, "_a") + MOD(MOD(7, 3), 2))')
+        self.assertEqual(renderer.render_field('_z'), '((NOT ("_a" = \'it\'\'s\')) AND ("_b" <> TRUE))')
+
+    def test_query_matches_python(self):
+        source = (
+            'def f(a, b):\n'
+            '    s = a * a + b\n'
+            '    if b > 0:\n'
+            '        t = s / b\n'
+            '    else:\n'
+            '        t = s - math.sqrt(abs(a))\n'
+            '    return t * s + s\n'
+        )
+        fields = self.translate(source, 'f')
+        query = sqlrender.render_query(fields, {'result': '_f'}, 'inputs', keep=['id'])
+        # s is shared, so it is computed once in a CTE rather than inlined
+        self.assertIn('AS "_f_stmt_0"', query)
+        results = dict(self.connection.execute(query).fetchall())
+
+        namespace = {'math': __import__('math')}
+        exec(source, namespace)
+        for row_id, a, b in self.rows:
+            self.assertAlmostEqual(results[row_id], namespace['f'](a, b))
+
+    def test_negated_powers(self):
+        # Tableau reads -x ^ 2 as (-x) ^ 2; the full-parentheses output relies on it
+        source = 'def f(a):\n    return (-a) ** 2\ndef g(a):\n    return -a ** 2\ndef h(a):\n    return 2 ** -a\n'
+        namespace = {}
+        exec(source, namespace)
+        for minimal_parentheses in (False, True):
+            mathparse = ctxmathparse.MathParse(minimal_parentheses=minimal_parentheses)
+            mathparse.add_module(source)
+            fields = mathparse.link(['f', 'g', 'h'])
+            query = sqlrender.render_query(fields, {'f': '_f', 'g': '_g', 'h': '_h'}, 'inputs', keep=['id'])
+            for row_id, f, g, h in self.connection.execute(query + ' ORDER BY id').fetchall():
+                a = self.rows[row_id - 1][1]
+                self.assertEqual((f, g), (namespace['f'](a), namespace['g'](a)), (minimal_parentheses, a))
+                self.assertAlmostEqual(h, namespace['h'](a))
+
+    def test_query_columns_and_nulls(self):
+        fields = self.translate('def g(x):\n    if x < 0:\n        raise ValueError()\n    return x ** 0.5\n', 'g')
+        query = sqlrender.render_query(fields, ['_g'], 'inputs', columns={'x': '"a" * 4'}, keep=['id'])
+        self.assertEqual(
+            sorted(self.connection.execute(query).fetchall()),
+            [(1, 2 ** 0.5), (2, 4.0), (3, 6.0), (4, None)],
+        )
+
+    def test_query_deep_chains(self):
+        # each link is used once, so all would inline into one expression too deep to parse
+        fields = {'_x_0': 'a'}
+        for k in range(1, 300):
+            fields['_x_{}'.format(k)] = '[_x_{}] + 1'.format(k - 1)
+        for materialized in (False, True):
+            query = sqlrender.render_query(fields, ['_x_299'], 'inputs', keep=['id'], materialized=materialized)
+            self.assertEqual(' AS MATERIALIZED (' in query, materialized)
+            self.assertEqual(
+                sorted(self.connection.execute(query).fetchall()),
+                [(row_id, a + 299) for row_id, a, _ in self.rows],
+            )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+import unittest
+
+import stressgen
+
+class TestStressGen(unittest.TestCase):
+
+    def test_generator_is_seeded(self):
+        first = stressgen.ProgramGenerator(7, branching=0.5)
+        second = stressgen.ProgramGenerator(7, branching=0.5)
+        self.assertEqual(first.program().source, second.program().source)
+        self.assertEqual(first.straight_line().source, second.straight_line().source)
+
+        program = stressgen.ProgramGenerator(3, statements=6, helpers=2, fanout=2).program()
+        self.assertIn('def h1(', program.source)
+        self.assertIn('h0(', program.source.split('def f(')[1])
+        # every name is bound before it is read, on every path
+        namespace = dict(stressgen.PYTHON_FUNCTIONS)
+        exec(program.source, namespace)
+        namespace['f'](0.5, -1.0, 1.5)
+
+    def test_translations_match_python(self):
+        static, functions = stressgen.check(15, rows=20, statements=6, branching=0.4)
+        for comparison in (static, functions):
+            self.assertEqual(comparison.programs, 15)
+            self.assertEqual(comparison.mismatches, [])
+            self.assertGreater(comparison.compared, 200)
+            # each program is checked with full and with minimal parentheses
+            self.assertEqual(comparison.rows, 15 * 20 * 2)
+
+        checker = stressgen.EquivalenceChecker(rows=20)
+        program = stressgen.Program('def f(a, b, c):\n    return (-a) ** 2 - -b ** 2 + c\n', 'f', stressgen.ARGUMENTS)
+        comparison = checker.check_functions(program)
+        checker.close()
+        self.assertEqual((comparison.programs, comparison.compared, comparison.mismatches), (1, 40, []))
+
+    def test_mismatch_is_reported(self):
+        checker = stressgen.EquivalenceChecker(rows=5)
+        program = stressgen.Program('def f(a, b, c):\n    return a - b\n', 'f', stressgen.ARGUMENTS)
+        comparison = checker.compare(program, {'_f_arg_a': 'a', '_f_arg_b': 'b', '_f': '[_f_arg_b] - [_f_arg_a]'}, '_f')
+        checker.close()
+        self.assertEqual(len(comparison.mismatches), 5)
+
+    def test_scaling(self):
+        results = stressgen.scaling([3, 6], trials=1)
+        self.assertEqual([(size, kind) for size, kind, *_ in results], [
+            (3, 'straight_line'), (3, 'functions'), (6, 'straight_line'), (6, 'functions'),
+        ])
+        self.assertEqual(len(stressgen.growth(results)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+import unittest
+import math
+
+import tableapprox
+
+class TestTableApprox(unittest.TestCase):
+
+    def test_chebyshev_reproduces_polynomials(self):
+        coefficients = tableapprox.chebyshev_monomial_coefficients(
+            lambda x: 2 - 3 * x + x ** 3, 1.0, 3.0, 3
+        )
+        # around the midpoint 2: 4 + 9u + 6u^2 + u^3
+        for got, expected in zip(coefficients, [4.0, 9.0, 6.0, 1.0]):
+            self.assertAlmostEqual(got, expected)
+
+    def test_piecewise_fit(self):
+        approximation = tableapprox.PiecewiseApproximation(math.exp, 0.0, 2.0, 1e-8, degree=5)
+        self.assertGreater(len(approximation.segments), 1)
+        self.assertEqual(approximation.segments[0].lo, 0.0)
+        self.assertEqual(approximation.segments[-1].hi, 2.0)
+        for left, right in zip(approximation.segments, approximation.segments[1:]):
+            self.assertEqual(left.hi, right.lo)
+        self.assertLess(approximation.max_error(), 2e-8)
+
+        with self.assertRaises(ValueError):
+            tableapprox.PiecewiseApproximation(math.sqrt, 0.0, 1.0, 1e-12, degree=2, max_segments=8)
+
+    def test_translate(self):
+        approximation = tableapprox.PiecewiseApproximation(math.sin, 0.0, 3.0, 1e-6, degree=4)
+        namespace = {}
+        exec(approximation.source('sin_approx'), namespace)
+        for x in [0.0, 0.4, 1.5, 2.999, 3.0]:
+            self.assertAlmostEqual(namespace['sin_approx'](x), approximation(x))
+
+        fields = approximation.translate('sin_approx')
+        self.assertEqual(set(fields), {'_sin_approx_arg_x', '_sin_approx_stmt_0', '_sin_approx'})
+        self.assertEqual(
+            fields['_sin_approx_stmt_0'].count('IF '), len(approximation.segments) - 1
+        )
+        # every segment costs 3 * degree operations; negative literals parse as negations
+        self.assertGreaterEqual(
+            tableapprox.count_operations(fields),
+            2 * (len(approximation.segments) - 1) + len(approximation.segments) * 3 * approximation.degree,
+        )
+        self.assertEqual(
+            tableapprox.row_operations(approximation),
+            math.ceil(math.log2(len(approximation.segments))) + 3 * approximation.degree,
+        )
+
+    def test_branch_free(self):
+        approximation = tableapprox.PiecewiseApproximation(math.sin, 0.0, 3.0, 1e-6, degree=4)
+        namespace = {'sign': lambda x: (x > 0) - (x < 0)}
+        exec(approximation.source('sin_approx', branch_free=True), namespace)
+        breakpoints = [segment.lo for segment in approximation.segments]
+        for x in [0.0, 0.4, 1.5, 2.999, 3.0] + breakpoints:
+            self.assertLess(abs(namespace['sin_approx'](x) - math.sin(x)), 2e-6)
+
+        fields = approximation.translate('sin_approx', branch_free=True)
+        self.assertFalse(any('IF ' in formula for formula in fields.values()))
+        self.assertEqual(sum(formula.count('SIGN(') for formula in fields.values()),
+                         2 * (len(approximation.segments) - 1))
+        self.assertEqual(tableapprox.row_operations(approximation, fields), tableapprox.count_operations(fields))
+
+    def test_vectorized_sampling(self):
+        calls = []
+
+        def vectorized_exp(points):
+            calls.append(len(points))
+            return [math.exp(x) for x in points]
+
+        approximation = tableapprox.PiecewiseApproximation(vectorized_exp, 0.0, 2.0, 1e-8, degree=5, vectorized=True)
+        self.assertEqual(len(approximation.segments), len(tableapprox.PiecewiseApproximation(
+            math.exp, 0.0, 2.0, 1e-8, degree=5).segments))
+        # one call for the Chebyshev nodes and one for the error grid of every segment tried
+        self.assertEqual(set(calls), {6, approximation.samples})
+        self.assertLess(approximation.max_error(), 2e-8)
+
+if __name__ == '__main__':
+    unittest.main()
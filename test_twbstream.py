@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+
+import io
+import os
+import tempfile
+import tracemalloc
+import unittest
+import xml.etree.ElementTree as ElementTree
+
+import ctxmathparse
+import twbstream
+
+WORKBOOK = '''<?xml version='1.0' encoding='utf-8' ?>
+
+<!-- build 20231.23.0310.1045 -->
+<workbook source-build='2023.1.0' version='18.1' xmlns:user='http://www.tableausoftware.com/xml/user'>
+  <datasources>
+    <datasource hasconnection='false' inline='true' name='Parameters' version='18.1'>
+      <aliases enabled='yes' />
+    </datasource>
+    <datasource caption='Samples' inline='true' name='federated.0abc' version='18.1'>
+      <connection class='federated'>
+        <relation name='samples' table='[samples]' type='table' />
+      </connection>
+      <aliases enabled='yes' />
+      <column caption='Quantile' datatype='real' name='[_f]' role='measure' type='quantitative' user:auto-column='numeric'>
+        <calculation class='tableau' formula='0' />
+        <desc>kept &amp; described</desc>
+      </column>
+      <column caption='Old' datatype='real' name='[_f_stmt_9]' role='measure' type='quantitative'>
+        <calculation class='tableau' formula='1' />
+      </column>
+      <column datatype='real' name='[Probability]' role='measure' type='quantitative' />
+      <layout dim-ordering='alphabetic' measure-ordering='alphabetic' show-structure='true' />
+    </datasource>
+  </datasources>
+  <worksheets>
+    <worksheet name='Sheet 1'>
+      <table>
+        <view>
+          <datasources>
+            <datasource caption='Samples' name='federated.0abc' />
+          </datasources>
+          <datasource-dependencies datasource='federated.0abc'>
+            <column caption='Quantile' datatype='real' name='[_f]' role='measure' type='quantitative'>
+              <calculation class='tableau' formula='0' />
+            </column>
+          </datasource-dependencies>
+        </view>
+      </table>
+    </worksheet>
+  </worksheets>
+</workbook>
+'''
+
+FIELDS = {
+    '_f_arg_p': 'p',
+    '_f_stmt_0': '[_f_arg_p] < 0.5',
+    '_f': "IF [_f_stmt_0] THEN SQRT([_f_arg_p]) ELSE 1 - p END",
+}
+
+class TestTwbStream(unittest.TestCase):
+
+    def write(self, workbook, fields=FIELDS, **options):
+        sink = io.StringIO()
+        counts = twbstream.write_fields(io.BytesIO(workbook.encode('utf-8')), sink, fields, **options)
+        return sink.getvalue(), counts
+
+    def test_merge_workbook(self):
+        output, counts = self.write(
+            WORKBOOK, columns={'p': '[Probability]'}, visible=['_f'], prune='_f_',
+        )
+        self.assertEqual(counts, {'replaced': 1, 'added': 2, 'removed': 1, 'dependencies': 1})
+        tree = ElementTree.fromstring(output)
+        source = tree.find('datasources/datasource[@name="federated.0abc"]')
+        self.assertEqual(
+            [(child.tag, child.get('name')) for child in source],
+            [('connection', None), ('aliases', None), ('column', '[_f]'), ('column', '[Probability]'),
+             ('column', '[_f_arg_p]'), ('column', '[_f_stmt_0]'), ('layout', None)],
+        )
+        replaced = source.find('column[@name="[_f]"]')
+        self.assertEqual(replaced.get('caption'), 'Quantile')
+        self.assertEqual(replaced.find('desc').text, 'kept & described')
+        self.assertEqual(replaced.find('calculation').get('formula'),
+                         'IF [_f_stmt_0] THEN SQRT([_f_arg_p]) ELSE 1 - [Probability] END')
+        added = source.find('column[@name="[_f_stmt_0]"]')
+        self.assertEqual((added.get('datatype'), added.get('role'), added.get('hidden')),
+                         ('boolean', 'dimension', 'true'))
+        self.assertEqual(source.find('column[@name="[_f_arg_p]"]/calculation').get('formula'), '[Probability]')
+        self.assertEqual(tree.find('.//datasource-dependencies/column/calculation').get('formula'),
+                         replaced.find('calculation').get('formula'))
+        self.assertEqual(len(tree.find('datasources/datasource[@name="Parameters"]')), 1)
+
+        # everything else is copied as it was, indentation and comments included
+        self.assertTrue(output.startswith(
+            "<?xml version='1.0' encoding='utf-8' ?>\n<!-- build 20231.23.0310.1045 -->\n<workbook "))
+        self.assertIn("user:auto-column='numeric'", output)
+        self.assertIn(
+            "\n      <column caption='f_stmt_0' datatype='boolean' hidden='true' name='[_f_stmt_0]' role='dimension'"
+            " type='nominal'>\n        <calculation class='tableau' formula='[_f_arg_p] &lt; 0.5' />\n"
+            "      </column>\n      <layout ", output)
+        self.assertIn("            <datasource caption='Samples' name='federated.0abc' />\n", output)
+
+        # writing the same fields again changes nothing
+        again, counts = self.write(output, columns={'p': '[Probability]'}, visible=['_f'], prune='_f_')
+        self.assertEqual(again, output)
+        self.assertEqual(counts, {'replaced': 3, 'dependencies': 1})
+
+    def test_data_source_file(self):
+        source = "<?xml version='1.0' encoding='utf-8' ?>\n<datasource name='x'>\n  <connection class='hyper' />\n</datasource>\n"
+        output, counts = self.write(source, {'_g': '"it\'s"'}, datasource='x')
+        self.assertEqual(counts, {'added': 1})
+        self.assertEqual(output, (
+            "<?xml version='1.0' encoding='utf-8' ?>\n<datasource name='x'>\n  <connection class='hyper' />\n"
+            "  <column caption='g' datatype='string' name='[_g]' role='dimension' type='nominal'>\n"
+            "    <calculation class='tableau' formula='&quot;it&apos;s&quot;' />\n"
+            "  </column>\n</datasource>\n"
+        ))
+        with self.assertRaises(twbstream.WorkbookError):
+            self.write(source, FIELDS, datasource='y')
+
+    def test_datatypes(self):
+        # negated operands of ^, as the translators write (-a)**2 and -a**2
+        self.assertEqual(twbstream.field_datatypes({
+            '_a': 'a',
+            '_n': '(-[_a] ^ 2)',
+            '_m': '-([_a] ^ 2)',
+            '_c': '-[_a] ^ 2 > [_n]',
+            '_d': 'IF [_c] THEN (-[_a]) ^ [_m] END',
+            '_e': 'NOT -[_a] ^ 2 > 0',
+            '_s': 'IF [_e] THEN NULL ELSE "x" END',
+        }), {'_a': 'real', '_n': 'real', '_m': 'real', '_c': 'boolean', '_d': 'real', '_e': 'boolean', '_s': 'string'})
+        for minimal_parentheses in (False, True):
+            mathparse = ctxmathparse.MathParse(minimal_parentheses=minimal_parentheses)
+            mathparse.add_module('def f(a):\n    b = (-a) ** 2 > 1\n    return b\n')
+            datatypes = twbstream.field_datatypes(mathparse.link(['f']))
+            self.assertEqual((datatypes['_f_stmt_0'], datatypes['_f']), ('boolean', 'boolean'))
+
+    def test_flat_memory(self):
+        worksheet = WORKBOOK[WORKBOOK.index('    <worksheet '):WORKBOOK.index('  </worksheets>')]
+        peaks = []
+        with tempfile.TemporaryDirectory() as directory:
+            for copies in (500, 4000):
+                path = os.path.join(directory, 'big.twb')
+                with open(path, 'w') as workbook:
+                    workbook.write(WORKBOOK[:WORKBOOK.index('    <worksheet ')])
+                    for _ in range(copies):
+                        workbook.write(worksheet)
+                    workbook.write(WORKBOOK[WORKBOOK.index('  </worksheets>'):])
+                tracemalloc.start()
+                counts = twbstream.write_file(path, path, FIELDS, prune='_f_')
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                self.assertEqual(counts['dependencies'], copies)
+                self.assertEqual(os.listdir(directory), ['big.twb'])
+        # eight times the workbook, nowhere near eight times the memory
+        self.assertLess(peaks[1], peaks[0] * 1.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,426 @@
+#!/usr/bin/python3
+
+"""
+    Stream translated fields into a Tableau workbook (.twb) or data source
+    (.tds) as calculated fields, without loading the file.
+
+    The XML is read with an incremental SAX parser and written straight
+    back out as it is parsed, so memory does not grow with the workbook;
+    only the fields being written and the path to the current element are
+    held. In the target data source, columns named after a field have the
+    formula of their calculation replaced, keeping their caption and other
+    settings; the remaining fields are added as new columns where Tableau
+    expects columns, after the connection and any existing columns. Copies
+    of replaced columns in the worksheets' datasource-dependencies are
+    updated as well, and with a prune prefix, generated columns of an
+    earlier translation that are no longer produced are removed.
+
+    fields is what MathParse.translate or link, or
+    ASTMathParse.translate_statements, returns. Their formulas refer to a
+    function's arguments by bare placeholders (n, p); columns maps those to
+    Tableau fields ('[Degrees of Freedom]').
+
+    python twbstream.py in.twb out.twb A396.py tquantile --column n='[N]' --column p='[P]'
+"""
+
+import argparse
+import collections
+import os
+import re
+import tempfile
+import xml.sax
+import xml.sax.handler
+import xml.sax.saxutils
+
+import costmodel
+import ctxmathparse
+import formulaparse
+
+# the data source children Tableau requires before its columns
+BEFORE_COLUMNS = frozenset(['repository-location', 'connection', 'overridable-settings', 'aliases'])
+
+BOOLEAN_OPERATORS = frozenset(['AND', 'OR', '=', '==', '!=', '<>', '<', '<=', '>', '>='])
+
+# besides &, < and >, which saxutils.escape always replaces
+ATTRIBUTE_ENTITIES = {"'": '&apos;', '"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'}
+
+CALL_FOLLOWS = re.compile(r'\s*\(')
+
+class WorkbookError(ValueError):
+    """The workbook has no data source to write the fields into."""
+
+def local_name(name):
+    """Strip the _.fcp.Feature.true... prefix Tableau puts on feature-flagged element names."""
+    return name.rsplit('...', 1)[-1]
+
+def field_name(reference):
+    """Return the field a column's name attribute, [name], refers to."""
+    if reference and reference.startswith('[') and reference.endswith(']'):
+        return reference[1:-1]
+    return reference
+
+def substitute_columns(formula, columns):
+    """Replace the bare argument placeholders in formula by the fields in columns, leaving the rest of the text alone."""
+    def replace(match):
+        name = match.group('name')
+        if name is None or name not in columns or CALL_FOLLOWS.match(formula, match.end()):
+            return match.group(0)
+        return formula[match.start():match.start('name')] + columns[name]
+    return formulaparse.TOKEN.sub(replace, formula)
+
+def field_datatypes(fields):
+    """
+        Return the Tableau datatype of each field: boolean for comparisons
+        and logic, string for text, real for anything else, following
+        references and the values of conditionals.
+    """
+    datatypes = {}
+    for name in ctxmathparse.field_dependency_order(fields):
+        try:
+            node = formulaparse.parse_formula(fields[name])
+        except formulaparse.FormulaSyntaxError:
+            datatypes[name] = 'real'
+            continue
+        while node[0] == 'if':
+            values = [value for _, value in node[1]] + ([node[2]] if node[2] is not None else [])
+            node = next((value for value in values if value != ('null',)), ('null',))
+        if node[0] == 'field':
+            datatypes[name] = datatypes.get(node[1], 'real')
+        elif node[0] == 'boolean' or (node[0] == 'binary' and node[1] in BOOLEAN_OPERATORS) \
+                or node[:2] == ('unary', 'NOT'):
+            datatypes[name] = 'boolean'
+        elif node[0] == 'string':
+            datatypes[name] = 'string'
+        else:
+            datatypes[name] = 'real'
+    return datatypes
+
+class XMLWriter:
+    """
+        Incremental XML serialization in Tableau's style: single-quoted
+        attributes and <empty />. Whitespace between elements is held back
+        until the next event, so callers can insert elements before it or
+        drop it, and output is written to sink chunk pieces at a time.
+    """
+
+    def __init__(self, sink, chunk=4096):
+        self.sink = sink
+        self.chunk = chunk
+        self.buffer = []
+        self.pending = ''
+        self.open_tag = False
+
+    def write(self, text):
+        self.buffer.append(text)
+        if len(self.buffer) >= self.chunk:
+            self.sink.write(''.join(self.buffer))
+            self.buffer = []
+
+    def close_start(self):
+        if self.open_tag:
+            self.write('>')
+            self.open_tag = False
+
+    def take_pending(self):
+        """Return the held whitespace and forget it."""
+        pending, self.pending = self.pending, ''
+        return pending
+
+    def flush_pending(self):
+        if self.pending:
+            self.close_start()
+            self.write(self.take_pending())
+
+    def declaration(self):
+        self.write("<?xml version='1.0' encoding='utf-8' ?>\n")
+
+    def start(self, name, attributes):
+        self.flush_pending()
+        self.close_start()
+        self.write('<' + name + ''.join(
+            " {}='{}'".format(key, xml.sax.saxutils.escape(value, ATTRIBUTE_ENTITIES))
+            for key, value in attributes.items()
+        ))
+        self.open_tag = True
+
+    def end(self, name):
+        self.flush_pending()
+        if self.open_tag:
+            self.write(' />')
+            self.open_tag = False
+        else:
+            self.write('</{}>'.format(name))
+
+    def characters(self, text):
+        if text.isspace():
+            self.pending += text
+            return
+        self.flush_pending()
+        self.close_start()
+        self.write(xml.sax.saxutils.escape(text))
+
+    def comment(self, text):
+        self.flush_pending()
+        self.close_start()
+        self.write('<!--{}-->'.format(text))
+
+    def processing_instruction(self, target, data):
+        self.flush_pending()
+        self.close_start()
+        self.write('<?{} {}?>'.format(target, data) if data else '<?{}?>'.format(target))
+
+    def close(self):
+        self.flush_pending()
+        self.close_start()
+        self.sink.write(''.join(self.buffer))
+        self.buffer = []
+
+class FieldMerger(xml.sax.handler.ContentHandler, xml.sax.handler.LexicalHandler):
+    """
+        SAX handler copying a workbook to an XMLWriter while writing fields
+        into the data source named or captioned datasource (by default the
+        first one other than Parameters). Fields not in visible, if given,
+        are added hidden. counts tallies the columns replaced, added and
+        removed, and the dependency copies updated.
+    """
+
+    def __init__(self, writer, fields, datasource=None, columns=None, visible=None, prune=None):
+        super().__init__()
+        self.writer = writer
+        self.fields = fields
+        self.datatypes = field_datatypes(fields)
+        self.datasource = datasource
+        self.columns = columns or {}
+        self.visible = None if visible is None else frozenset(visible)
+        self.prune = prune
+        self.counts = collections.Counter()
+        # names of the open elements, from the root
+        self.path = []
+        self.found = False
+        self.target_name = None
+        self.target_depth = None
+        self.child_indent = None
+        self.written = set()
+        self.added = False
+        self.dependencies_depth = None
+        self.column = None
+        self.column_depth = None
+        self.calculation_seen = False
+        self.skip_depth = None
+
+    def formula(self, name):
+        formula = self.fields[name]
+        return substitute_columns(formula, self.columns) if self.columns else formula
+
+    def is_target(self, attributes):
+        """Whether a top-level data source is the one to write into."""
+        if self.found:
+            return False
+        if not self.path or self.path[1:] == ['datasources']:
+            if self.datasource is None:
+                return attributes.get('name') != 'Parameters'
+            return self.datasource in (attributes.get('name'), attributes.get('caption'))
+        return False
+
+    def add_columns(self):
+        """Write the fields not already in the data source, before the held whitespace."""
+        self.added = True
+        closing = self.writer.take_pending()
+        indent = self.child_indent if self.child_indent is not None else closing + '  '
+        for name in self.fields:
+            if name in self.written:
+                continue
+            attributes = {
+                'caption': name[1:] if name.startswith('_') else name,
+                'datatype': self.datatypes[name],
+            }
+            if self.visible is not None and name not in self.visible:
+                attributes['hidden'] = 'true'
+            attributes['name'] = '[{}]'.format(name)
+            attributes['role'] = 'measure' if self.datatypes[name] == 'real' else 'dimension'
+            attributes['type'] = 'quantitative' if self.datatypes[name] == 'real' else 'nominal'
+            self.writer.characters(indent)
+            self.writer.start('column', attributes)
+            self.writer.characters(indent + '  ')
+            self.writer.start('calculation', {'class': 'tableau', 'formula': self.formula(name)})
+            self.writer.end('calculation')
+            self.writer.characters(indent)
+            self.writer.end('column')
+            self.written.add(name)
+            self.counts['added'] += 1
+        self.writer.characters(closing)
+
+    def skip(self):
+        """Leave out the element being started, and the whitespace before it."""
+        self.writer.take_pending()
+        self.skip_depth = len(self.path)
+        self.path.append(None)
+
+    def startDocument(self):
+        self.writer.declaration()
+
+    def startElement(self, name, attrs):
+        if self.skip_depth is not None:
+            self.path.append(name)
+            return
+        attributes = dict(attrs.items())
+        depth = len(self.path)
+        local = local_name(name)
+        if local == 'datasource' and self.is_target(attributes):
+            self.found = True
+            self.target_name = attributes.get('name')
+            self.target_depth = depth
+        elif self.target_depth is not None and depth == self.target_depth + 1:
+            if self.child_indent is None:
+                self.child_indent = self.writer.pending
+            field = field_name(attributes.get('name')) if local == 'column' else None
+            if field in self.fields:
+                if self.added:
+                    # already written by add_columns, before this out-of-place column
+                    self.counts['added'] -= 1
+                    self.counts['replaced'] += 1
+                    return self.skip()
+                self.written.add(field)
+                self.counts['replaced'] += 1
+                self.begin_column(field, depth, attributes)
+            elif field is not None and self.prune and field.startswith(self.prune):
+                self.counts['removed'] += 1
+                return self.skip()
+            elif local not in BEFORE_COLUMNS and local != 'column' and not self.added:
+                self.add_columns()
+        elif local == 'datasource-dependencies' and self.target_name is not None \
+                and attributes.get('datasource') == self.target_name:
+            self.dependencies_depth = depth
+        elif self.dependencies_depth is not None and depth == self.dependencies_depth + 1 and local == 'column':
+            field = field_name(attributes.get('name'))
+            if field in self.fields:
+                self.counts['dependencies'] += 1
+                self.begin_column(field, depth, attributes)
+        elif self.column is not None and depth == self.column_depth + 1 and local == 'calculation':
+            attributes['formula'] = self.formula(self.column)
+            self.calculation_seen = True
+        self.path.append(name)
+        self.writer.start(name, attributes)
+
+    def begin_column(self, field, depth, attributes):
+        """Start rewriting the column of field; its calculation gets the new formula."""
+        self.column = field
+        self.column_depth = depth
+        self.calculation_seen = False
+        if 'datatype' in attributes:
+            attributes['datatype'] = self.datatypes[field]
+
+    def endElement(self, name):
+        self.path.pop()
+        depth = len(self.path)
+        if self.skip_depth is not None:
+            if depth == self.skip_depth:
+                self.skip_depth = None
+            return
+        if self.column is not None and depth == self.column_depth:
+            if not self.calculation_seen:
+                self.writer.start('calculation', {'class': 'tableau', 'formula': self.formula(self.column)})
+                self.writer.end('calculation')
+            self.column = None
+        elif depth == self.target_depth:
+            if not self.added:
+                self.add_columns()
+            self.target_depth = None
+        elif depth == self.dependencies_depth:
+            self.dependencies_depth = None
+        self.writer.end(name)
+
+    def characters(self, content):
+        if self.skip_depth is None:
+            self.writer.characters(content)
+
+    def ignorableWhitespace(self, whitespace):
+        self.characters(whitespace)
+
+    def processingInstruction(self, target, data):
+        if self.skip_depth is None:
+            self.writer.processing_instruction(target, data)
+            self.prolog_newline()
+
+    def comment(self, content):
+        if self.skip_depth is None:
+            self.writer.comment(content)
+            self.prolog_newline()
+
+    def prolog_newline(self):
+        # the parser does not report whitespace outside the root element
+        if not self.path:
+            self.writer.write('\n')
+
+    def endDocument(self):
+        self.writer.write('\n')
+        self.writer.close()
+        if not self.found:
+            raise WorkbookError('no data source {}to write the fields into'.format(
+                '' if self.datasource is None else '{!r} '.format(self.datasource)))
+
+def write_fields(source, sink, fields, datasource=None, columns=None, visible=None, prune=None):
+    """
+        Copy the workbook or data source XML from source (a path or binary
+        file) to sink (a text file), writing fields into it as described
+        for FieldMerger. Returns the counts of columns replaced, added,
+        removed and dependency copies updated.
+    """
+    merger = FieldMerger(XMLWriter(sink), fields, datasource, columns, visible, prune)
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(merger)
+    parser.setProperty(xml.sax.handler.property_lexical_handler, merger)
+    parser.parse(source)
+    return merger.counts
+
+def write_file(source_path, output_path, fields, **options):
+    """
+        write_fields from one file to another, through a temporary file so
+        output_path may be source_path and is untouched on failure.
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8', newline='') as sink:
+            counts = write_fields(source_path, sink, fields, **options)
+        os.replace(temporary, output_path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return counts
+
+def main():
+    """Translate functions of a Python module into a workbook's calculated fields."""
+    parser = argparse.ArgumentParser(description='Write translated functions into a .twb or .tds file.')
+    parser.add_argument('workbook')
+    parser.add_argument('output', help='the file to write, which may be the workbook itself')
+    parser.add_argument('module')
+    parser.add_argument('functions', nargs='+')
+    parser.add_argument('--column', action='append', default=[], metavar='ARGUMENT=FIELD',
+                        help="the Tableau field for an argument, e.g. p='[Probability]' (repeatable)")
+    parser.add_argument('--datasource', help='name or caption of the data source (default the first)')
+    parser.add_argument('--prune', metavar='PREFIX', help='remove columns named PREFIX... that are not written')
+    parser.add_argument('--minimal-parentheses', action='store_true')
+    args = parser.parse_args()
+    columns = {}
+    for mapping in args.column:
+        argument, separator, field = mapping.partition('=')
+        if not separator:
+            parser.error('--column takes ARGUMENT=FIELD, not {!r}'.format(mapping))
+        columns[argument] = field
+
+    mathparse = ctxmathparse.MathParse(minimal_parentheses=args.minimal_parentheses)
+    with open(args.module) as source:
+        mathparse.add_module(source.read())
+    fields = mathparse.link(args.functions)
+    visible = [root for name in args.functions for root in costmodel.function_roots(fields, name)]
+    try:
+        counts = write_file(args.workbook, args.output, fields, datasource=args.datasource, columns=columns,
+                            visible=visible, prune=args.prune)
+    except (WorkbookError, xml.sax.SAXParseException) as e:
+        parser.exit(1, '{}\n'.format(e))
+    print('{}: {} fields replaced, {} added, {} removed, {} dependency copies updated'.format(
+        args.output, counts['replaced'], counts['added'], counts['removed'], counts['dependencies']))
+
+if __name__ == '__main__':
+    main()